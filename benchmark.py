@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_apis
+
+# Banc d'essai hors ligne : exécute un cycle complet de check_airtable_changes contre les API factices
+# et mesure durée, requêtes et octets par backend et mémoire maximale.
+# Chaque scénario tourne dans un processus enfant pour que la mémoire mesurée soit celle du script seul.
+#
+#   python benchmark.py                         # 1k, 10k et 100k enregistrements
+#   python benchmark.py --sizes 1000 --latency 0.05 --error-rate 0.02
+#   python benchmark.py --json apres.json --compare avant.json
+#   python benchmark.py --sizes 10000 --processes 4 --shard-mode lease   # 4 processus concurrents, aucun doublon attendu
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai hors ligne du script de demandes de mandat")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Tailles de la table Airtable")
+    parser.add_argument("--eligible-ratio", type=float, default=0.01, help="Part des enregistrements à traiter")
+    parser.add_argument("--installers", type=int, default=50, help="Nombre d'installateurs")
+    parser.add_argument("--latency", type=float, default=0.0, help="Latence ajoutée à chaque requête (secondes)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probabilité d'une réponse 503")
+    parser.add_argument("--airtable-quota", type=float, default=0.0, help="Quota Airtable simulé en req/s (429 au-delà, 0 = illimité)")
+    parser.add_argument("--sellsy-quota", type=float, default=0.0, help="Quota Sellsy simulé en req/s (429 au-delà, 0 = illimité)")
+    parser.add_argument("--api-rate", type=float, default=1000.0, help="Limiteurs du script en req/s (AIRTABLE/INSTALLERS/SELLSY_RATE_LIMIT)")
+    parser.add_argument("--processes", type=int, default=1, help="Nombre de processus lancés en parallèle sur la même table")
+    parser.add_argument("--shard-mode", choices=["hash", "lease"], default="hash",
+                        help="Répartition entre processus : partitions SHARD_INDEX/SHARD_COUNT ou baux seuls")
+    parser.add_argument("--env", action="append", default=[], metavar="NOM=VALEUR", help="Variable d'environnement passée au script")
+    parser.add_argument("--timeout", type=float, default=1800, help="Durée maximale d'un scénario (secondes)")
+    parser.add_argument("--json", help="Écrit les résultats dans ce fichier")
+    parser.add_argument("--compare", help="Compare avec les résultats d'une exécution précédente")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def start_fake_apis(size, args):
+    server = fake_apis.FakeApiServer().start()
+    state = server.state
+    state.add_table("appBENCH", "Abonnes", fake_apis.FakeAirtableTable(
+        size, fake_apis.default_subscriber_factory(args.eligible_ratio, args.installers)))
+    state.add_table("appBENCHINST", "Installateurs", fake_apis.FakeAirtableTable(
+        args.installers, fake_apis.default_installer_factory))
+    state.sellsy_clients = fake_apis.FakeSellsyClients(size)
+    state.behaviors["airtable"] = fake_apis.FakeBackendBehavior(args.latency, args.error_rate, args.airtable_quota, seed=1)
+    state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior(args.latency, args.error_rate, args.sellsy_quota, seed=2)
+    return server
+
+
+def child_env(server, work_dir, args):
+    env = os.environ.copy()
+    env.pop("GITHUB_ACTIONS", None)
+    env.update({
+        "AIRTABLE_API_KEY": "keyBENCH",
+        "AIRTABLE_BASE_ID": "appBENCH",
+        "AIRTABLE_TABLE_NAME": "Abonnes",
+        "AIRTABLE_INSTALLERS_BASE_ID": "appBENCHINST",
+        "AIRTABLE_INSTALLATEURS_TABLE": "Installateurs",
+        "AIRTABLE_API_ROOT": f"{server.url}/v0",
+        "SELLSY_API_URL": f"{server.url}/sellsy/0/",
+        "SELLSY_CONSUMER_TOKEN": "bench",
+        "SELLSY_CONSUMER_SECRET": "bench",
+        "SELLSY_USER_TOKEN": "bench",
+        "SELLSY_USER_SECRET": "bench",
+        "AIRTABLE_RATE_LIMIT": str(args.api_rate),
+        "INSTALLERS_RATE_LIMIT": str(args.api_rate),
+        "SELLSY_RATE_LIMIT": str(args.api_rate),
+        "LOG_LEVEL": "ERROR",
+        "LOG_DIR": os.path.join(work_dir, "logs"),
+        "STATE_DIR": os.path.join(work_dir, "state"),
+    })
+    for assignment in args.env:
+        name, _, value = assignment.partition("=")
+        env[name] = value
+    return env
+
+
+# Variables propres au processus `index` : partition en mode hash, identifiant de bail dans tous les cas
+def shard_env(env, index, args):
+    env = dict(env, LEASE_OWNER=f"bench-{index}")
+    if args.shard_mode == "hash":
+        env.update(SHARD_COUNT=str(args.processes), SHARD_INDEX=str(index))
+    return env
+
+
+def run_scenario(size, args):
+    server = start_fake_apis(size, args)
+    try:
+        # Les processus partagent STATE_DIR, donc le journal SQLite des envois et des baux
+        with tempfile.TemporaryDirectory(prefix="mandat-bench-") as work_dir:
+            env = child_env(server, work_dir, args)
+            processes = [
+                subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "--child"],
+                    env=shard_env(env, index, args),
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                )
+                for index in range(args.processes)
+            ]
+            children = []
+            for process in processes:
+                stdout, stderr = process.communicate(timeout=args.timeout)
+                lines = [line for line in stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+                if process.returncode != 0 or not lines:
+                    raise RuntimeError(f"Le scénario {size} a échoué:\n{stdout[-2000:]}\n{stderr[-2000:]}")
+                children.append(json.loads(lines[-1][len(RESULT_PREFIX):]))
+        stats = server.state.stats
+        sent = server.state.sent_emails
+    finally:
+        server.stop()
+
+    backends = {}
+    for backend, values in sorted(stats.items()):
+        name = "sellsy" if backend == "sellsy" else ("installers" if backend.endswith("INST") else "airtable")
+        backends[name] = {
+            "requests": values.get("requests", 0),
+            "bytes_in": values.get("bytes_in", 0),
+            "bytes_out": values.get("bytes_out", 0),
+            "http_429": values.get("http_429", 0),
+            "http_503": values.get("http_503", 0),
+        }
+    first_emails = [child["first_email_seconds"] for child in children if child.get("first_email_seconds") is not None]
+    return {
+        "size": size,
+        "processes": args.processes,
+        "wall_time": max(child["wall_time"] for child in children),
+        "peak_rss_kb": max(child["peak_rss_kb"] for child in children),
+        "connections": sum(child["connections"] for child in children),
+        "first_page_seconds": min((child["first_page_seconds"] for child in children if child.get("first_page_seconds") is not None), default=None),
+        "first_email_seconds": min(first_emails, default=None),
+        "sent_per_process": [child.get("sent", 0) for child in children],
+        "backends": backends,
+        "emails_sent": len(sent),
+        "duplicate_emails": len(sent) - len(set(sent)),
+    }
+
+
+def child_main():
+    import resource
+
+    import main
+
+    start = time.perf_counter()
+    summary = main.check_airtable_changes()
+    wall_time = time.perf_counter() - start
+    transport = main.get_transport_stats()
+    result = {
+        "wall_time": round(wall_time, 3),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "connections": sum(transport["connections"].values()),
+        "first_page_seconds": main.get_cold_start_seconds(),
+        "first_email_seconds": summary.get("first_email_seconds"),
+        "sent": summary.get("sent", 0),
+    }
+    sys.stdout.write(RESULT_PREFIX + json.dumps(result) + "\n")
+
+
+def format_bytes(value):
+    for unit in ("o", "Ko", "Mo", "Go"):
+        if value < 1024 or unit == "Go":
+            return f"{value:.0f} {unit}" if unit == "o" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def print_report(results, previous=None):
+    previous = {result["size"]: result for result in previous or []}
+    header = f"{'taille':>8} {'durée (s)':>10} {'1er email':>9} {'airtable':>9} {'install.':>9} {'sellsy':>8} {'octets':>10} {'429':>5} {'emails':>7} {'doublons':>8} {'RSS max':>9}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        backends = result["backends"]
+        total_bytes = sum(b["bytes_in"] + b["bytes_out"] for b in backends.values())
+        throttled = sum(b["http_429"] for b in backends.values())
+        line = (
+            f"{result['size']:>8} {result['wall_time']:>10.2f} {format_seconds(result.get('first_email_seconds')):>9} "
+            f"{backends.get('airtable', {}).get('requests', 0):>9} "
+            f"{backends.get('installers', {}).get('requests', 0):>9} "
+            f"{backends.get('sellsy', {}).get('requests', 0):>8} "
+            f"{format_bytes(total_bytes):>10} {throttled:>5} {result['emails_sent']:>7} "
+            f"{result['duplicate_emails']:>8} {format_bytes(result['peak_rss_kb'] * 1024):>9}"
+        )
+        before = previous.get(result["size"])
+        if before:
+            change = (result["wall_time"] - before["wall_time"]) / before["wall_time"] * 100 if before["wall_time"] else 0
+            line += f"  ({change:+.0f} % durée)"
+        print(line)
+        if result.get("processes", 1) > 1:
+            print(f"{'':>8} envois par processus : {result['sent_per_process']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        return child_main()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = json.load(f)["results"]
+
+    results = []
+    for size in args.sizes:
+        print(f"⏱️ Scénario {size} enregistrements...", flush=True)
+        results.append(run_scenario(size, args))
+    print_report(results, previous)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,673 @@
+import base64
+import hashlib
+import hmac
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from urllib.request import Request, urlopen
+
+# Serveurs HTTP locaux imitant les API Airtable et Sellsy pour mesurer le script sans toucher la production.
+# Les enregistrements sont générés à la volée à partir de leur index pour garder une empreinte mémoire faible.
+
+AIRTABLE_MAX_PAGE_SIZE = 100
+AIRTABLE_MAX_WEBHOOK_PAYLOADS = 50
+SELLSY_TIMESTAMP_TOLERANCE = 300  # Écart maximal accepté entre oauth_timestamp et l'heure du serveur (secondes)
+
+
+# Évaluateur minimal des formules Airtable utilisées par main.py
+_TOKEN_RE = re.compile(r"\s*(?:(\{[^}]*\})|('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|(\d+(?:\.\d+)?)|([A-Z_][A-Z0-9_]*)|(!=|>=|<=|[(),=<>&]))")
+
+
+def _tokenize(formula):
+    tokens = []
+    pos = 0
+    formula = formula.strip()
+    while pos < len(formula):
+        match = _TOKEN_RE.match(formula, pos)
+        if not match:
+            raise ValueError(f"Formule invalide près de: {formula[pos:pos + 20]}")
+        field, string, number, name, op = match.groups()
+        if field is not None:
+            tokens.append(("field", field[1:-1]))
+        elif string is not None:
+            tokens.append(("str", re.sub(r"\\(.)", r"\1", string[1:-1])))
+        elif number is not None:
+            tokens.append(("num", float(number)))
+        elif name is not None:
+            tokens.append(("name", name))
+        else:
+            tokens.append(("op", op))
+        pos = match.end()
+    return tokens
+
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+_FUNCTIONS = {
+    "AND": lambda *args: all(_truthy(a) for a in args),
+    "OR": lambda *args: any(_truthy(a) for a in args),
+    "NOT": lambda value: not _truthy(value),
+    "DATETIME_PARSE": lambda value, *_: _parse_datetime(value),
+    "IS_AFTER": lambda a, b: bool(a and b and _parse_datetime(a) > _parse_datetime(b)),
+    "IS_BEFORE": lambda a, b: bool(a and b and _parse_datetime(a) < _parse_datetime(b)),
+}
+
+
+def _truthy(value):
+    return bool(value) and value != "0"
+
+
+def compile_formula(formula):
+    tokens = _tokenize(formula)
+    position = [0]
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else (None, None)
+
+    def take():
+        token = peek()
+        position[0] += 1
+        return token
+
+    def parse_expression():
+        left = parse_operand()
+        kind, value = peek()
+        if kind == "op" and value in ("=", "!=", ">", "<", ">=", "<=", "&"):
+            take()
+            right = parse_operand()
+            return _binary(value, left, right)
+        return left
+
+    def parse_operand():
+        kind, value = take()
+        if kind == "field":
+            return lambda record: record["fields"].get(value)
+        if kind in ("str", "num"):
+            return lambda record: value
+        if kind == "op" and value == "(":
+            inner = parse_expression()
+            take()
+            return inner
+        if kind == "name":
+            if value in ("TRUE", "FALSE") and peek() != ("op", "("):
+                return lambda record: value == "TRUE"
+            take()  # "("
+            args = []
+            if peek() != ("op", ")"):
+                args.append(parse_expression())
+                while peek() == ("op", ","):
+                    take()
+                    args.append(parse_expression())
+            take()  # ")"
+            if value == "RECORD_ID":
+                return lambda record: record["id"]
+            if value == "LAST_MODIFIED_TIME":
+                return lambda record: record.get("_modified")
+            if value == "CREATED_TIME":
+                return lambda record: record.get("createdTime")
+            if value in ("TRUE", "FALSE"):
+                return lambda record: value == "TRUE"
+            func = _FUNCTIONS[value]
+            return lambda record: func(*(arg(record) for arg in args))
+        raise ValueError(f"Jeton inattendu dans la formule: {value}")
+
+    def _binary(op, left, right):
+        if op == "&":
+            return lambda record: f"{left(record) or ''}{right(record) or ''}"
+        compare = {
+            "=": lambda a, b: a == b,
+            "!=": lambda a, b: a != b,
+            ">": lambda a, b: a > b,
+            "<": lambda a, b: a < b,
+            ">=": lambda a, b: a >= b,
+            "<=": lambda a, b: a <= b,
+        }[op]
+        return lambda record: compare(left(record), right(record))
+
+    expression = parse_expression()
+    return lambda record: _truthy(expression(record))
+
+
+# Table Airtable factice : enregistrements générés à la demande, modifications conservées en mémoire
+class FakeAirtableTable:
+    def __init__(self, size, record_factory):
+        self.size = size
+        self.record_factory = record_factory
+        self.overrides = {}
+        self.lock = threading.Lock()
+
+    def record_id(self, index):
+        return f"rec{index:014d}"
+
+    def index_of(self, record_id):
+        try:
+            return int(record_id[3:])
+        except ValueError:
+            return None
+
+    def get(self, index):
+        record = self.record_factory(index)
+        record["id"] = self.record_id(index)
+        record.setdefault("createdTime", "2024-01-01T00:00:00.000Z")
+        record.setdefault("_modified", record["createdTime"])
+        override = self.overrides.get(index)
+        if override:
+            record["fields"].update(override["fields"])
+            record["_modified"] = override["_modified"]
+        return record
+
+    def update(self, record_id, fields):
+        index = self.index_of(record_id)
+        if index is None or not 0 <= index < self.size:
+            return None
+        with self.lock:
+            override = self.overrides.setdefault(index, {"fields": {}})
+            override["fields"].update(fields)
+            override["_modified"] = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        return self.get(index)
+
+
+# Identifiant de table au format Airtable (tblXXX), utilisé par l'API meta et les payloads de webhook
+def table_id(table_name):
+    return f"tbl{table_name}"
+
+
+def public_record(record, fields=None):
+    data = record["fields"]
+    if fields:
+        data = {name: value for name, value in data.items() if name in fields}
+    return {"id": record["id"], "createdTime": record["createdTime"], "fields": data}
+
+
+# Enregistrement d'abonné réaliste : la plupart ont déjà été traités, avec du texte long et des pièces jointes
+def default_subscriber_factory(eligible_ratio=0.02, installers=20):
+    eligible_every = max(1, int(round(1 / eligible_ratio))) if eligible_ratio else 0
+
+    def factory(index):
+        eligible = bool(eligible_every) and index % eligible_every == 0
+        fields = {
+            "Nom": f"Client {index}",
+            "Email": f"client{index}@example.com",
+            "ID_Sellsy": str(100000 + index),
+            "Installateur": [f"rec{index % installers:014d}"],
+            "Date de signature de contrat": "2024-03-15",
+            "Contrat abonnement signe": True,
+            "Adresse": f"{index} rue du Soleil, 69000 Lyon",
+            "Notes": "Installation photovoltaïque 6 kWc, onduleur hybride, raccordement Enedis validé. " * 8,
+            "Documents": [
+                {
+                    "id": f"att{index:014d}",
+                    "url": f"https://dl.airtable.example/{index}/contrat.pdf",
+                    "filename": "contrat.pdf",
+                    "size": 182344,
+                    "type": "application/pdf",
+                }
+            ],
+        }
+        if not eligible:
+            fields["Email Mandat sellsy"] = True
+            fields["Date envoi mandat"] = "2024-04-01"
+            if index % 3 == 0:
+                fields["Mandat GoCardless"] = True
+        return {"fields": fields}
+
+    return factory
+
+
+def default_installer_factory(index):
+    return {"fields": {"Nom": f"Installateur {index}", "Ville": "Lyon"}}
+
+
+# Clients Sellsy factices : ID 100000 + index, email et prénom renseignés sauf pour quelques clients incomplets
+class FakeSellsyClients:
+    def __init__(self, size, first_id=100000, incomplete_every=0):
+        self.size = size
+        self.first_id = first_id
+        self.incomplete_every = incomplete_every
+        self.created_at = 0
+
+    def exists(self, client_id):
+        try:
+            index = int(client_id) - self.first_id
+        except (TypeError, ValueError):
+            return None
+        return index if 0 <= index < self.size else None
+
+    def get(self, index):
+        incomplete = self.incomplete_every and index % self.incomplete_every == 0
+        return {
+            "id": str(self.first_id + index),
+            "name": f"Client {index}",
+            "email": "" if incomplete else f"client{index}@example.com",
+            "mobile": "0600000000",
+            "people_forename": f"Prénom{index}",
+            "people_name": f"Nom{index}",
+        }
+
+
+# Comportement réseau simulé d'un backend : latence, taux d'erreurs 5xx et quota (429 au-delà)
+class FakeBackendBehavior:
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.tokens = rate_limit
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Renvoie le code d'erreur à simuler pour cette requête, ou None
+    def next_failure(self):
+        with self.lock:
+            if self.rate_limit:
+                now = time.monotonic()
+                self.tokens = min(self.rate_limit, self.tokens + (now - self.updated_at) * self.rate_limit)
+                self.updated_at = now
+                if self.tokens < 1:
+                    return 429
+                self.tokens -= 1
+            if self.error_rate and self.random.random() < self.error_rate:
+                return 503
+        return None
+
+
+class FakeApiState:
+    def __init__(self):
+        self.behaviors = {"airtable": FakeBackendBehavior(), "sellsy": FakeBackendBehavior()}
+        self.tables = {}
+        self.sellsy_clients = FakeSellsyClients(0)
+        self.sent_emails = []
+        self.nonces = set()
+        self.webhooks = {}
+        self.webhooks_created = 0
+        self.response_delays = {}  # Méthode Sellsy -> délai en secondes avant la réponse, après traitement
+        self.offset_ttl = 0  # Durée de validité des offsets de pagination en secondes (0 = illimitée)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    def add_table(self, base_id, table_name, table):
+        self.tables[(base_id, table_name)] = table
+        return table
+
+    def add_webhook(self, base_id, notification_url, record_change_scope=None):
+        with self.stats_lock:
+            self.webhooks_created += 1
+            webhook_id = f"ach{self.webhooks_created:014d}"
+            self.webhooks[webhook_id] = {
+                "base_id": base_id,
+                "notification_url": notification_url,
+                "record_change_scope": record_change_scope,
+                "mac_secret": base64.b64encode(random.Random(webhook_id).randbytes(32)).decode("ascii"),
+                "payloads": [],
+            }
+        return webhook_id, self.webhooks[webhook_id]
+
+    # Modifie un enregistrement comme le ferait un utilisateur, puis notifie les webhooks de la base
+    def update_record(self, base_id, table_name, record_id, fields, source="client"):
+        record = self.tables[(base_id, table_name)].update(record_id, fields)
+        if record is not None:
+            self.record_change(base_id, table_name, record_id, source)
+        return record
+
+    # Ajoute un payload au format Airtable aux webhooks de la base et envoie la notification (sans le contenu)
+    def record_change(self, base_id, table_name, record_id, source="client"):
+        for webhook_id, webhook in list(self.webhooks.items()):
+            if webhook["base_id"] != base_id:
+                continue
+            if webhook["record_change_scope"] not in (None, table_id(table_name)):
+                continue
+            with self.stats_lock:
+                webhook["payloads"].append({
+                    "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+                    "baseTransactionNumber": len(webhook["payloads"]) + 1,
+                    "payloadFormat": "v0",
+                    "actionMetadata": {"source": source},
+                    "changedTablesById": {
+                        table_id(table_name): {"changedRecordsById": {record_id: {"current": {"cellValuesByFieldId": {}}}}},
+                    },
+                })
+            if webhook["notification_url"]:
+                threading.Thread(target=self._ping, args=(webhook_id, webhook), daemon=True).start()
+
+    def _ping(self, webhook_id, webhook):
+        body = json.dumps({
+            "base": {"id": webhook["base_id"]},
+            "webhook": {"id": webhook_id},
+            "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        }).encode("utf-8")
+        mac = hmac.new(base64.b64decode(webhook["mac_secret"]), body, hashlib.sha256).hexdigest()
+        request = Request(webhook["notification_url"], data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "X-Airtable-Content-MAC": f"hmac-sha256={mac}",
+        })
+        try:
+            with urlopen(request, timeout=5) as response:
+                response.read()
+            self.count("webhooks", "notifications")
+        except OSError:
+            self.count("webhooks", "notification_errors")
+
+    def count(self, backend, key, amount=1):
+        with self.stats_lock:
+            backend_stats = self.stats.setdefault(backend, {})
+            backend_stats[key] = backend_stats.get(key, 0) + amount
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {}
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, backend, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Le client a abandonné la requête (délai de lecture dépassé)
+        self.state.count(backend, "requests")
+        self.state.count(backend, "bytes_out", len(body))
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    # Applique latence, erreurs et quota du backend ; renvoie True si une erreur a déjà été répondue
+    def _misbehave(self, kind, backend, body_read=False):
+        self.state.count(backend, "bytes_in", len(self.requestline) + len(str(self.headers)) + int(self.headers.get("Content-Length") or 0))
+        behavior = self.state.behaviors[kind]
+        if behavior.latency:
+            time.sleep(behavior.latency)
+        status = behavior.next_failure()
+        if status is None:
+            return False
+        if not body_read:
+            self._read_body()
+        self.state.count(backend, f"http_{status}")
+        body = json.dumps({"error": {"type": "RATE_LIMITED" if status == 429 else "SERVICE_UNAVAILABLE"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+        self.state.count(backend, "requests")
+        self.state.count(backend, "bytes_out", len(body))
+        return True
+
+    def _airtable_target(self, path):
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if len(parts) < 3 or parts[0] != "v0":
+            return None, None, None
+        table = self.state.tables.get((parts[1], parts[2]))
+        record_id = parts[3] if len(parts) > 3 else None
+        return parts[1], table, record_id
+
+    # API meta Airtable : /v0/meta/bases/{base}/tables
+    def _meta_tables_target(self, path):
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if len(parts) != 5 or parts[:3] != ["v0", "meta", "bases"] or parts[4] != "tables":
+            return None
+        return parts[3]
+
+    # API webhooks Airtable : /v0/bases/{base}/webhooks[/{id}/payloads|/{id}/refresh]
+    def _webhook_target(self, path):
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+        if len(parts) < 4 or parts[:2] != ["v0", "bases"] or parts[3] != "webhooks":
+            return None
+        webhook_id = parts[4] if len(parts) > 4 else None
+        action = parts[5] if len(parts) > 5 else None
+        return parts[2], webhook_id, action
+
+    def _handle_webhooks(self, method, parsed, target):
+        base_id, webhook_id, action = target
+        backend = f"airtable:{base_id}"
+        if self._misbehave("airtable", backend):
+            return
+        body = self._read_body() if method == "POST" else b""
+        if webhook_id is None and method == "POST":
+            specification = json.loads(body or b"{}")
+            filters = specification.get("specification", {}).get("options", {}).get("filters", {})
+            webhook_id, webhook = self.state.add_webhook(base_id, specification.get("notificationUrl"),
+                                                         filters.get("recordChangeScope"))
+            return self._send_json(backend, 200, {
+                "id": webhook_id,
+                "macSecretBase64": webhook["mac_secret"],
+                "expirationTime": "2099-01-01T00:00:00.000Z",
+            })
+        webhook = self.state.webhooks.get(webhook_id)
+        if webhook is None or webhook["base_id"] != base_id:
+            return self._send_json(backend, 404, {"error": "NOT_FOUND"})
+        if method == "DELETE" and action is None:
+            with self.state.stats_lock:
+                del self.state.webhooks[webhook_id]
+            return self._send_json(backend, 200, {})
+        if method == "POST" and action == "refresh":
+            self.state.count(backend, "webhook_refreshes")
+            return self._send_json(backend, 200, {"expirationTime": "2099-01-01T00:00:00.000Z"})
+        if method == "GET" and action == "payloads":
+            query = parse_qs(parsed.query)
+            cursor = max(1, int(query.get("cursor", ["1"])[0]))
+            limit = min(int(query.get("limit", [AIRTABLE_MAX_WEBHOOK_PAYLOADS])[0]), AIRTABLE_MAX_WEBHOOK_PAYLOADS)
+            with self.state.stats_lock:
+                payloads = webhook["payloads"][cursor - 1:cursor - 1 + limit]
+                total = len(webhook["payloads"])
+            self.state.count(backend, "webhook_payload_pages")
+            return self._send_json(backend, 200, {
+                "payloads": payloads,
+                "cursor": cursor + len(payloads),
+                "mightHaveMore": cursor - 1 + len(payloads) < total,
+            })
+        return self._send_json(backend, 404, {"error": "NOT_FOUND"})
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        webhook_target = self._webhook_target(parsed.path)
+        if webhook_target:
+            return self._handle_webhooks("GET", parsed, webhook_target)
+        meta_base_id = self._meta_tables_target(parsed.path)
+        if meta_base_id:
+            backend = f"airtable:{meta_base_id}"
+            if self._misbehave("airtable", backend):
+                return
+            tables = [{"id": table_id(name), "name": name} for base, name in self.state.tables if base == meta_base_id]
+            return self._send_json(backend, 200, {"tables": tables})
+        base_id, table, record_id = self._airtable_target(parsed.path)
+        if table is None:
+            return self._send_json("unknown", 404, {"error": "NOT_FOUND"})
+        backend = f"airtable:{base_id}"
+        if self._misbehave("airtable", backend):
+            return
+        if record_id:
+            index = table.index_of(record_id)
+            if index is None or not 0 <= index < table.size:
+                return self._send_json(backend, 404, {"error": "NOT_FOUND"})
+            return self._send_json(backend, 200, public_record(table.get(index)))
+
+        query = parse_qs(parsed.query)
+        fields = query.get("fields[]")
+        page_size = min(int(query.get("pageSize", [AIRTABLE_MAX_PAGE_SIZE])[0]), AIRTABLE_MAX_PAGE_SIZE)
+        max_records = int(query.get("maxRecords", [0])[0])
+        if max_records:
+            page_size = min(page_size, max_records)
+        offset = query.get("offset", [""])[0]
+        start, _, issued = offset.partition("/itr")
+        start = int(start or 0)
+        # Comme Airtable, un offset trop ancien n'est plus accepté
+        if issued and self.state.offset_ttl and time.time() * 1000 - int(issued) > self.state.offset_ttl * 1000:
+            return self._send_json(backend, 422, {"error": {"type": "LIST_RECORDS_ITERATOR_NOT_AVAILABLE"}})
+        formula = query.get("filterByFormula", [""])[0]
+        try:
+            predicate = compile_formula(formula) if formula else None
+        except (ValueError, KeyError) as e:
+            return self._send_json(backend, 422, {"error": {"type": "INVALID_FILTER_BY_FORMULA", "message": str(e)}})
+
+        records = []
+        index = start
+        while index < table.size and len(records) < page_size:
+            record = table.get(index)
+            index += 1
+            if predicate is None or predicate(record):
+                records.append(public_record(record, fields))
+        payload = {"records": records}
+        if index < table.size and not max_records:
+            payload["offset"] = f"{index}/itr{int(time.time() * 1000)}"
+        self.state.count(backend, "pages")
+        return self._send_json(backend, 200, payload)
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        webhook_target = self._webhook_target(parsed.path)
+        if webhook_target:
+            return self._handle_webhooks("POST", parsed, webhook_target)
+        if not parsed.path.startswith("/sellsy"):
+            return self._send_json("unknown", 404, {"error": "NOT_FOUND"})
+        # Comme Sellsy, le nonce est consommé dès réception, même si la requête échoue ensuite (429, 503)
+        form = parse_qs(self._read_body().decode("utf-8"))
+        nonce = form.get("oauth_nonce", [""])[0]
+        with self.state.stats_lock:
+            reused = nonce in self.state.nonces
+            self.state.nonces.add(nonce)
+        if self._misbehave("sellsy", "sellsy", body_read=True):
+            return
+        # Comme Sellsy, un timestamp OAuth absent ou trop éloigné de l'heure courante est refusé
+        timestamp = form.get("oauth_timestamp", [""])[0]
+        if not timestamp.isdigit() or abs(int(timestamp) - time.time()) > SELLSY_TIMESTAMP_TOLERANCE:
+            self.state.count("sellsy", "invalid_timestamp")
+            return self._send_json("sellsy", 200, {"status": "error", "error": "oauth_timestamp invalide"})
+        if reused:
+            self.state.count("sellsy", "nonce_reuse")
+            return self._send_json("sellsy", 200, {"status": "error", "error": "oauth_nonce already used"})
+        request = json.loads(form.get("do_in", ["{}"])[0])
+        method = request.get("method")
+        params = request.get("params", {})
+        self.state.count("sellsy", method)
+        clients = self.state.sellsy_clients
+
+        if method == "Client.getOne":
+            index = clients.exists(params.get("clientid"))
+            if index is None:
+                return self._send_json("sellsy", 200, {"status": "error", "error": "Client introuvable"})
+            entry = clients.get(index)
+            response = {
+                "corporation": {"name": entry["name"], "email": entry["email"], "mobile": entry["mobile"]},
+                "contact": {"forename": entry["people_forename"], "name": entry["people_name"]},
+            }
+            return self._send_json("sellsy", 200, {"status": "success", "response": response})
+
+        if method == "Client.getList":
+            pagination = params.get("pagination", {})
+            per_page = int(pagination.get("nbperpage", 10))
+            page = int(pagination.get("pagenum", 1))
+            total = clients.size
+            period = params.get("search", {}).get("periodecreated")
+            if period and not period.get("start", 0) <= clients.created_at <= period.get("end", 0):
+                total = 0
+            first = (page - 1) * per_page
+            result = {}
+            for index in range(first, min(first + per_page, total)):
+                entry = clients.get(index)
+                result[entry["id"]] = entry
+            infos = {"nbpages": max(1, -(-total // per_page)), "pagenum": page, "nbtotal": total}
+            return self._send_json("sellsy", 200, {"status": "success", "response": {"infos": infos, "result": result}})
+
+        if method == "Mails.sendOne":
+            email = params.get("email", {})
+            if clients.exists(email.get("linkedid")) is None:
+                return self._send_json("sellsy", 200, {"status": "error", "error": "Tiers introuvable"})
+            with self.state.stats_lock:
+                self.state.sent_emails.append((str(email.get("linkedid")), tuple(email.get("emails", []))))
+            # Réponse lente : l'email est déjà parti si le client abandonne avant la réponse
+            time.sleep(self.state.response_delays.get(method, 0))
+            return self._send_json("sellsy", 200, {"status": "success", "response": {"id": len(self.state.sent_emails)}})
+
+        return self._send_json("sellsy", 200, {"status": "error", "error": f"Méthode inconnue {method}"})
+
+    def do_DELETE(self):
+        parsed = urlparse(self.path)
+        webhook_target = self._webhook_target(parsed.path)
+        if webhook_target:
+            return self._handle_webhooks("DELETE", parsed, webhook_target)
+        return self._send_json("unknown", 404, {"error": "NOT_FOUND"})
+
+    def do_PATCH(self):
+        parsed = urlparse(self.path)
+        base_id, table, record_id = self._airtable_target(parsed.path)
+        backend = f"airtable:{base_id}"
+        if table is None:
+            return self._send_json("unknown", 404, {"error": "NOT_FOUND"})
+        if self._misbehave("airtable", backend):
+            return
+        body = json.loads(self._read_body() or b"{}")
+        self.state.count(backend, "patches")
+        if record_id:
+            record = table.update(record_id, body.get("fields", {}))
+            if record is None:
+                return self._send_json(backend, 404, {"error": "NOT_FOUND"})
+            self.state.record_change(base_id, unquote(parsed.path.strip("/").split("/")[2]), record_id, source="publicApi")
+            return self._send_json(backend, 200, public_record(record))
+        updates = body.get("records", [])
+        if not updates or len(updates) > 10:
+            return self._send_json(backend, 422, {"error": {"type": "INVALID_RECORDS"}})
+        updated = []
+        for update in updates:
+            record = table.update(update.get("id", ""), update.get("fields", {}))
+            if record is None:
+                return self._send_json(backend, 404, {"error": "NOT_FOUND"})
+            self.state.record_change(base_id, unquote(parsed.path.strip("/").split("/")[2]), record["id"], source="publicApi")
+            updated.append(public_record(record))
+        return self._send_json(backend, 200, {"records": updated})
+
+
+# Lance les API factices dans un thread, à l'adresse FakeApiServer.url
+class FakeApiServer:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.state = FakeApiState()
+        handler = type("BoundFakeApiHandler", (FakeApiHandler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    server = FakeApiServer(port=8765)
+    server.state.add_table("appFAKE", "Abonnes", FakeAirtableTable(1000, default_subscriber_factory()))
+    server.state.add_table("appINSTALL", "Installateurs", FakeAirtableTable(20, default_installer_factory))
+    server.state.sellsy_clients = FakeSellsyClients(1000)
+    print(f"API factices disponibles sur {server.url}")
+    server.httpd.serve_forever()
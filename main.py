@@ -1,8 +1,31 @@
 import os
 import time
+_process_started = time.perf_counter()  # Référence du temps de démarrage à froid
+import atexit
+import base64
+import hashlib
+import hmac
+import math
+import queue
+import random
+import re
+import socket
+import sqlite3
+import sys
+import threading
+import zlib
 import requests
 import json
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from urllib3.util.retry import Retry
 try:
     from dotenv import load_dotenv
     load_dotenv()  # Essayer de charger depuis .env si disponible
@@ -31,77 +54,1368 @@ SELLSY_EMAIL_TEMPLATE_ID = "74"  # ID du template "Demande de mandat API"
 
 # Paramètres de l'application
 LOG_DIR = os.getenv("LOG_DIR", "logs")
-CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "300"))  # 5 min par défaut
-
-# URLS des APIs
-AIRTABLE_API_URL = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}"
-AIRTABLE_INSTALLERS_API_URL = f"https://api.airtable.com/v0/{AIRTABLE_INSTALLERS_BASE_ID}/{AIRTABLE_INSTALLATEURS_TABLE}"
-SELLSY_API_URL = "https://apifeed.sellsy.com/0/"
-
-# Fonction de log
-def log_activity(message):
-    if not os.path.exists(LOG_DIR):
-        os.makedirs(LOG_DIR)
-    log_file = os.path.join(LOG_DIR, f"log_{datetime.now().strftime('%Y-%m-%d')}.txt")
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(log_file, "a", encoding="utf-8") as f:
-        f.write(f"[{timestamp}] {message}\n")
-    print(message)
-
-# Vérifie les enregistrements Airtable
-def check_airtable_changes():
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").strip().upper()  # DEBUG pour journaliser les requêtes et réponses complètes
+LOG_ASYNC = os.getenv("LOG_ASYNC", "false").strip().lower() in ("1", "true", "yes")  # Écriture dans un thread dédié
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1"))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").strip().lower() in ("1", "true", "yes")  # Export Prometheus et traces
+TRACE_MAX_RECORDS = int(os.getenv("TRACE_MAX_RECORDS", "1000"))  # Traces d'enregistrements conservées par cycle
+CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", "300"))  # 5 min par défaut, intervalle de départ du planificateur
+POLL_MIN_INTERVAL = int(os.getenv("POLL_MIN_INTERVAL", "60"))  # Intervalle quand du travail est en attente
+POLL_MAX_INTERVAL = int(os.getenv("POLL_MAX_INTERVAL", "1800"))  # Plafond du backoff quand rien n'arrive
+POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", "2"))
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.1"))  # ±10 % pour désynchroniser plusieurs instances
+STATE_DIR = os.getenv("STATE_DIR", "state")  # Caches persistés entre deux exécutions
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(STATE_DIR, "state.db"))  # Journal des envois (SQLite)
+UNKNOWN_SEND_GRACE = 300  # Un envoi "sending" plus récent peut être en cours dans un autre processus
+INSTALLERS_CACHE_TTL = int(os.getenv("INSTALLERS_CACHE_TTL", "3600"))  # 1 h par défaut
+SELLSY_CLIENTS_CACHE_TTL = int(os.getenv("SELLSY_CLIENTS_CACHE_TTL", "86400"))  # Rechargement complet quotidien
+SELLSY_CLIENTS_REFRESH_INTERVAL = int(os.getenv("SELLSY_CLIENTS_REFRESH_INTERVAL", "600"))  # Rafraîchissement incrémental
+# Âge maximal d'une entrée de l'annuaire utilisée pour un envoi (0 = désactivé) : l'annuaire est alors rechargé
+# en entier dès qu'il dépasse cet âge, car le rafraîchissement incrémental ne voit que les nouveaux clients
+SELLSY_CLIENT_MAX_AGE = int(os.getenv("SELLSY_CLIENT_MAX_AGE", "0"))
+SELLSY_LIST_PAGE_SIZE = int(os.getenv("SELLSY_LIST_PAGE_SIZE", "500"))
+
+# Synchronisation incrémentale : seuls les enregistrements modifiés depuis le dernier passage sont lus
+INCREMENTAL_SYNC = os.getenv("INCREMENTAL_SYNC", "true").strip().lower() in ("1", "true", "yes")
+SYNC_OVERLAP_SECONDS = int(os.getenv("SYNC_OVERLAP_SECONDS", "900"))  # Recouvrement de sécurité
+FULL_SYNC_INTERVAL = int(os.getenv("FULL_SYNC_INTERVAL", "21600"))  # Réconciliation complète toutes les 6 h
+
+# Mode push : récepteur local des notifications de webhook Airtable, le polling devient un filet de sécurité
+WEBHOOK_ENABLED = os.getenv("WEBHOOK_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_NOTIFICATION_URL = os.getenv("WEBHOOK_NOTIFICATION_URL", "").strip()  # URL publique transmise à Airtable
+WEBHOOK_RECONCILE_INTERVAL = int(os.getenv("WEBHOOK_RECONCILE_INTERVAL", "3600"))  # Polling de sécurité en mode push
+AIRTABLE_TABLE_ID = os.getenv("AIRTABLE_TABLE_ID", "").strip()  # ID tblXXX de la table, résolu via l'API meta si absent
+
+# Sondes de santé au démarrage : parallèles, délai court, résultat mis en cache dans STATE_DIR
+PROBE_CACHE_TTL = int(os.getenv("PROBE_CACHE_TTL", "3600"))  # 0 pour sonder à chaque exécution
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "3"))
+PROBE_GATE = os.getenv("PROBE_GATE", "true").strip().lower() in ("1", "true", "yes")  # Annule le cycle si une API critique échoue
+
+# Paramètres de la couche HTTP partagée
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+HTTP_RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", "30"))  # Plafond des attentes entre deux tentatives (secondes)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+
+# Traitement concurrent des demandes de mandat et quotas par API (requêtes par seconde)
+MAX_WORKERS = max(1, int(os.getenv("MAX_WORKERS", "4")))
+
+# Exécution répartie : chaque processus traite la partition SHARD_INDEX (hash stable de l'ID) parmi SHARD_COUNT,
+# et réserve chaque enregistrement par un bail dans la base SQLite partagée (STATE_DB_PATH) avant de le traiter
+SHARD_COUNT = max(1, int(os.getenv("SHARD_COUNT", "1")))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+RECORD_LEASE_TTL = float(os.getenv("RECORD_LEASE_TTL", "300"))  # Un bail non libéré (processus arrêté) expire après 5 min
+LEASE_OWNER = os.getenv("LEASE_OWNER", f"{socket.gethostname()}:{os.getpid()}")
+
+# Cache négatif : un enregistrement en échec n'est retraité qu'après un délai exponentiel plafonné
+FAILURE_BACKOFF_BASE = float(os.getenv("FAILURE_BACKOFF_BASE", "600"))  # Premier délai après une erreur transitoire
+FAILURE_BACKOFF_MAX = float(os.getenv("FAILURE_BACKOFF_MAX", "86400"))  # Plafond, appliqué d'emblée aux erreurs permanentes
+
+# Rattrapage par morceaux : BACKFILL identifie le rattrapage (ex. "import-2024-10"), une nouvelle valeur en démarre un autre
+BACKFILL = os.getenv("BACKFILL", "").strip()
+# Une variable GitHub Actions absente arrive vide : la valeur par défaut s'applique aussi dans ce cas
+BACKFILL_TIME_BUDGET = float(os.getenv("BACKFILL_TIME_BUDGET") or "480")  # Secondes par exécution (sous les 10 min du cron)
+BACKFILL_MAX_PASSES = max(1, int(os.getenv("BACKFILL_MAX_PASSES") or "3"))  # Passages pour retenter les échecs transitoires
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", "5"))  # 5 req/s par base Airtable
+INSTALLERS_RATE_LIMIT = float(os.getenv("INSTALLERS_RATE_LIMIT", "5"))
+SELLSY_RATE_LIMIT = float(os.getenv("SELLSY_RATE_LIMIT", "5"))
+
+# Contrôle adaptatif de la concurrence (AIMD) et disjoncteur par backend
+AIMD_MAX_CONCURRENCY = max(1, int(os.getenv("AIMD_MAX_CONCURRENCY", str(MAX_WORKERS + 2))))  # Requêtes simultanées max par backend
+AIMD_LATENCY_TARGET = float(os.getenv("AIMD_LATENCY_TARGET", "2"))  # Au-delà (secondes), la limite est réduite
+AIMD_DECREASE_FACTOR = float(os.getenv("AIMD_DECREASE_FACTOR", "0.5"))
+BREAKER_FAILURE_THRESHOLD = max(1, int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")))  # Échecs consécutifs avant ouverture
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))  # Secondes avant une requête d'essai (demi-ouvert)
+
+# Taille des pages Airtable (100 maximum côté API)
+AIRTABLE_PAGE_SIZE = min(int(os.getenv("AIRTABLE_PAGE_SIZE", "100")), 100)
+AIRTABLE_PREFETCH_PAGES = max(1, int(os.getenv("AIRTABLE_PREFETCH_PAGES", "2")))  # Pages lues d'avance pendant le traitement
+
+# URLS des APIs (surchargeables pour pointer vers des API factices locales)
+AIRTABLE_API_ROOT = os.getenv("AIRTABLE_API_ROOT", "https://api.airtable.com/v0").strip().rstrip("/")
+AIRTABLE_API_URL = f"{AIRTABLE_API_ROOT}/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}"
+AIRTABLE_INSTALLERS_API_URL = f"{AIRTABLE_API_ROOT}/{AIRTABLE_INSTALLERS_BASE_ID}/{AIRTABLE_INSTALLATEURS_TABLE}"
+AIRTABLE_WEBHOOKS_URL = f"{AIRTABLE_API_ROOT}/bases/{AIRTABLE_BASE_ID}/webhooks"
+AIRTABLE_META_TABLES_URL = f"{AIRTABLE_API_ROOT}/meta/bases/{AIRTABLE_BASE_ID}/tables"
+SELLSY_API_URL = os.getenv("SELLSY_API_URL", "https://apifeed.sellsy.com/0/").strip()
+
+# Champs Airtable lus par le pipeline : seuls ceux-ci sont demandés à l'API
+AIRTABLE_ELIGIBILITY_FIELDS = ["Contrat abonnement signe", "Email Mandat sellsy", "Mandat GoCardless"]
+AIRTABLE_FIELDS = ["Nom", "Email", "ID_Sellsy", "Installateur", "Date de signature de contrat"] + AIRTABLE_ELIGIBILITY_FIELDS
+
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+_log_threshold = LOG_LEVELS.get(LOG_LEVEL, LOG_LEVELS["INFO"])
+
+# Écrivain du journal : fichier quotidien LOG_DIR/log_AAAA-MM-JJ.txt au format JSON lines, gardé ouvert
+# et vidé périodiquement, éventuellement depuis un thread dédié
+class ActivityLogWriter:
+    def __init__(self, log_dir, background=False, flush_interval=1.0):
+        self.log_dir = log_dir
+        self.flush_interval = flush_interval
+        self.file = None
+        self.day = None
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.queue = None
+        if background:
+            self.queue = queue.SimpleQueue()
+            threading.Thread(target=self._run, name="log-writer", daemon=True).start()
+
+    def write(self, day, line, urgent=False):
+        if self.queue is not None:
+            self.queue.put((day, line, urgent))
+        else:
+            self._write(day, line, urgent)
+
+    def _write(self, day, line, urgent):
+        with self.lock:
+            if day != self.day:
+                self._open(day)
+            self.file.write(line + "\n")
+            if urgent or time.monotonic() - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    def _open(self, day):
+        if self.file:
+            self.file.close()
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        self.file = open(os.path.join(self.log_dir, f"log_{day}.txt"), "a", encoding="utf-8")
+        self.day = day
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._flush_file()
+                continue
+            if isinstance(item, threading.Event):
+                self._flush_file()
+                item.set()
+            else:
+                self._write(*item)
+
+    def _flush_file(self):
+        with self.lock:
+            if self.file:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    # Vide le journal ; en mode asynchrone, attend que le thread ait écrit les messages en file
+    def flush(self, timeout=5):
+        if self.queue is not None:
+            done = threading.Event()
+            self.queue.put(done)
+            done.wait(timeout)
+        else:
+            self._flush_file()
+
+_log_writer = ActivityLogWriter(LOG_DIR, background=LOG_ASYNC, flush_interval=LOG_FLUSH_INTERVAL)
+atexit.register(_log_writer.flush)
+
+def log_enabled(level):
+    return LOG_LEVELS.get(level, 20) >= _log_threshold
+
+# Fonction de log : `message` peut être une fonction, appelée seulement si le niveau est actif,
+# pour ne pas sérialiser les requêtes et réponses complètes quand DEBUG est désactivé
+def log_activity(message, level="INFO", **fields):
+    if not log_enabled(level):
+        return
+    if callable(message):
+        message = message()
+    now = datetime.now()
+    entry = {"ts": now.isoformat(timespec="milliseconds"), "level": level, "msg": message}
+    if fields:
+        entry.update(fields)
+    _log_writer.write(now.strftime("%Y-%m-%d"), json.dumps(entry, ensure_ascii=False, default=str), urgent=level == "ERROR")
+    # Une seule écriture par message pour ne pas entremêler les lignes des workers
+    sys.stdout.write(f"{message}\n")
+
+# Compteurs agrégés du cycle, journalisés une seule fois au lieu d'une ligne par enregistrement
+_cycle_counters = Counter()
+_cycle_outcomes = Counter()
+_cycle_counters_lock = threading.Lock()
+
+# `outcome` alimente aussi le compteur Prometheus mandat_records_total (scanned, eligible, sent, failed, skipped)
+def count_event(name, amount=1, outcome=None):
+    with _cycle_counters_lock:
+        _cycle_counters[name] += amount
+        if outcome:
+            _cycle_outcomes[outcome] += amount
+    if outcome:
+        metrics.inc("mandat_records_total", amount, outcome=outcome)
+
+# Journalise le bilan du cycle et renvoie le nombre d'enregistrements par résultat
+def log_cycle_counters():
+    with _cycle_counters_lock:
+        counters = dict(_cycle_counters)
+        outcomes = dict(_cycle_outcomes)
+        _cycle_counters.clear()
+        _cycle_outcomes.clear()
+    if counters:
+        summary = ", ".join(f"{name}: {count}" for name, count in sorted(counters.items()))
+        log_activity(f"📊 Bilan du cycle: {summary}", counters=counters)
+    return outcomes
+
+# Métriques du processus : compteurs et histogrammes de latence, exportés au format textfile Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Échappe une valeur de label selon le format texte Prometheus (antislash, guillemet, retour à la ligne)
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+        lines = []
+        with self.lock:
+            for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({key[0] for key in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (series_name, labels), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{name}{labels_text(labels)} {value}")
+            for name in sorted({key[0] for key in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (series_name, labels), histogram in sorted(self.histograms.items()):
+                    if series_name != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                        lines.append(f"{name}_bucket{labels_text(labels, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{labels_text(labels, [('le', '+Inf')])} {histogram['count']}")
+                    lines.append(f"{name}_sum{labels_text(labels)} {histogram['sum']:.6f}")
+                    lines.append(f"{name}_count{labels_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# Traces : chaque enregistrement traité reçoit un arbre de spans imbriqués (phases puis appels HTTP)
+_trace_context = threading.local()
+_finished_traces = []
+_trace_counts = {"records": 0, "dropped": 0}  # Traces d'enregistrements gardées et écartées depuis le dernier export
+_traces_lock = threading.Lock()
+
+@contextmanager
+def span(name, record_phase=True, **attributes):
+    stack = getattr(_trace_context, "stack", None)
+    if stack is None:
+        stack = _trace_context.stack = []
+    current = {"name": name, "start": time.time(), "attributes": attributes, "children": []}
+    started = time.perf_counter()
+    stack.append(current)
+    try:
+        yield current
+    except Exception as e:
+        current["attributes"]["error"] = str(e)
+        raise
+    finally:
+        stack.pop()
+        current["duration"] = round(time.perf_counter() - started, 6)
+        if record_phase:
+            metrics.observe("mandat_phase_duration_seconds", current["duration"], phase=name)
+        if stack:
+            stack[-1]["children"].append(current)
+        elif METRICS_ENABLED:
+            # Seules les traces par enregistrement sont plafonnées : celle du cycle (détail des phases) est toujours gardée
+            with _traces_lock:
+                if name != "record":
+                    _finished_traces.append(current)
+                elif _trace_counts["records"] < TRACE_MAX_RECORDS:
+                    _trace_counts["records"] += 1
+                    _finished_traces.append(current)
+                else:
+                    _trace_counts["dropped"] += 1
+
+# Écrit les métriques (LOG_DIR/metrics.prom) et ajoute les traces du cycle à LOG_DIR/traces_AAAA-MM-JJ.jsonl
+def export_metrics_and_traces():
+    if not METRICS_ENABLED:
+        return
+    with _traces_lock:
+        traces = list(_finished_traces)
+        _finished_traces.clear()
+        dropped = _trace_counts["dropped"]
+        _trace_counts.update(records=0, dropped=0)
+    try:
+        if not os.path.exists(LOG_DIR):
+            os.makedirs(LOG_DIR)
+        metrics_path = os.path.join(LOG_DIR, "metrics.prom")
+        with open(f"{metrics_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+            f.write(metrics.render())
+        os.replace(f"{metrics_path}.{os.getpid()}.tmp", metrics_path)
+        if traces:
+            traces_path = os.path.join(LOG_DIR, f"traces_{datetime.now().strftime('%Y-%m-%d')}.jsonl")
+            with open(traces_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"cycle_end": datetime.now().isoformat(timespec="seconds"), "traces": traces,
+                                    "dropped_record_traces": dropped}, ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        log_activity(f"⚠️ Impossible d'exporter les métriques: {str(e)}", level="WARNING")
+
+# Indique si un enregistrement doit recevoir l'email de demande de mandat
+def is_record_eligible(fields):
+    return bool(fields.get("Contrat abonnement signe")) and not fields.get("Email Mandat sellsy") and not fields.get("Mandat GoCardless")
+
+# Formule Airtable équivalente à is_record_eligible, évaluée côté serveur
+def build_eligibility_formula():
+    return "AND({Contrat abonnement signe}, NOT({Email Mandat sellsy}), NOT({Mandat GoCardless}))"
+
+# Construit les paramètres de requête de liste Airtable (filtre, projection des champs, pagination)
+def build_airtable_query(formula=None, fields=None, page_size=None, offset=None):
+    params = []
+    if formula:
+        params.append(("filterByFormula", formula))
+    for field in fields or []:
+        params.append(("fields[]", field))
+    if page_size:
+        params.append(("pageSize", str(page_size)))
+    if offset:
+        params.append(("offset", offset))
+    return params
+
+# Statistiques de la couche HTTP : requêtes par backend et connexions ouvertes par hôte
+_transport_stats = {"requests": {}, "connections": {}}
+_transport_lock = threading.Lock()
+
+def _count_transport(kind, key):
+    with _transport_lock:
+        _transport_stats[kind][key] = _transport_stats[kind].get(key, 0) + 1
+
+# Pools urllib3 qui comptent chaque nouvelle connexion (donc chaque handshake TCP/TLS)
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count_transport("connections", self.host)
+        return super()._new_conn()
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count_transport("connections", self.host)
+        return super()._new_conn()
+
+class PooledHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool
+        }
+
+# Politique de relance, appliquée par http_request (et non par urllib3) pour que chaque tentative passe par
+# les limiteurs, le contrôleur AIMD et, pour Sellsy, reçoive un nouveau nonce OAuth.
+# Les requêtes non idempotentes (envoi d'email) ne sont rejouées que si le serveur ne les a pas traitées
+# (connexion impossible ou 429).
+RETRY_STATUSES = {True: frozenset([429, 500, 502, 503, 504]), False: frozenset([429])}
+
+def request_not_sent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+# Erreur survenue après l'envoi de la requête : le serveur a pu la traiter (délai de lecture dépassé, connexion coupée)
+def outcome_unknown(error):
+    if isinstance(error, (requests.exceptions.ReadTimeout, requests.exceptions.ChunkedEncodingError)):
+        return True
+    return isinstance(error, requests.exceptions.ConnectionError) and not request_not_sent(error)
+
+def should_retry(error, idempotent):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if idempotent:
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return request_not_sent(error)
+
+# Délai avant la tentative `attempt` : Retry-After s'il est fourni (borné), backoff exponentiel sinon
+def retry_delay(attempt, response=None):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), HTTP_RETRY_AFTER_MAX)
+        except ValueError:
+            pass
+    return min(HTTP_BACKOFF_FACTOR * (2 ** attempt), HTTP_RETRY_AFTER_MAX)
+
+# Seau à jetons : autorise `rate` requêtes par seconde avec des rafales de `capacity` requêtes
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Un limiteur par backend (base Airtable des abonnés, base des installateurs, Sellsy)
+RATE_LIMITERS = {
+    "airtable": TokenBucket(AIRTABLE_RATE_LIMIT),
+    "installers": TokenBucket(INSTALLERS_RATE_LIMIT),
+    "sellsy": TokenBucket(SELLSY_RATE_LIMIT)
+}
+
+# Levée sans appel réseau quand le disjoncteur d'un backend est ouvert ; hérite de RequestException
+# pour être traitée comme une erreur réseau par les appelants
+class CircuitOpenError(requests.RequestException):
+    pass
+
+# Limite de requêtes simultanées ajustée en AIMD (+1/limite par succès rapide, ×AIMD_DECREASE_FACTOR sur 429/5xx,
+# erreur réseau ou latence excessive) et disjoncteur : fermé → ouvert après N échecs consécutifs → demi-ouvert
+# après BREAKER_COOLDOWN (une seule requête d'essai) → fermé si elle réussit, ouvert sinon
+class BackendController:
+    def __init__(self, name, max_limit, latency_target, decrease_factor, failure_threshold, cooldown):
+        self.name = name
+        self.max_limit = max_limit
+        self.limit = float(max_limit)
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.last_decrease_at = 0
+        self.trial_in_flight = False
+        self.stats = Counter()
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                if self.state == "open":
+                    if time.monotonic() - self.opened_at < self.cooldown:
+                        self.stats["rejected"] += 1
+                        raise CircuitOpenError(f"Disjoncteur {self.name} ouvert")
+                    self.state = "half_open"
+                    log_activity(f"🔁 Disjoncteur {self.name} demi-ouvert : requête d'essai", level="WARNING")
+                if self.state == "half_open":
+                    if self.trial_in_flight:
+                        self.stats["rejected"] += 1
+                        raise CircuitOpenError(f"Disjoncteur {self.name} en essai")
+                    self.trial_in_flight = True
+                    self.in_flight += 1
+                    return True
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return False
+                self.stats["throttled"] += 1
+                self.condition.wait(timeout=1)
+
+    # `trial` est la valeur renvoyée par acquire ; `failed` signale un 429/5xx ou une erreur réseau
+    def release(self, trial, failed, latency):
+        with self.condition:
+            self.in_flight -= 1
+            if trial:
+                self.trial_in_flight = False
+            now = time.monotonic()
+            if failed or latency > self.latency_target:
+                # Une seule réduction par aller-retour, pour ne pas diviser la limite pour chaque requête d'une même rafale
+                if now - self.last_decrease_at >= latency:
+                    self.limit = max(1.0, self.limit * self.decrease_factor)
+                    self.last_decrease_at = now
+                    self.stats["decreases"] += 1
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+            if failed:
+                self.stats["failures"] += 1
+                self.consecutive_failures += 1
+                if trial or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                    self.state = "open"
+                    self.opened_at = now
+                    self.stats["opened"] += 1
+                    log_activity(f"🚨 Disjoncteur {self.name} ouvert après {self.consecutive_failures} échecs consécutifs", level="ERROR")
+            else:
+                self.consecutive_failures = 0
+                if trial:
+                    self.state = "closed"
+                    log_activity(f"✅ Disjoncteur {self.name} refermé")
+            self.condition.notify_all()
+
+    # État courant et compteurs depuis le dernier appel (remis à zéro à chaque bilan de cycle)
+    def snapshot(self):
+        with self.condition:
+            snapshot = {"state": self.state, "limit": round(self.limit, 2), "in_flight": self.in_flight}
+            snapshot.update(self.stats)
+            self.stats.clear()
+        return snapshot
+
+BACKEND_CONTROLLERS = {
+    backend: BackendController(backend, AIMD_MAX_CONCURRENCY, AIMD_LATENCY_TARGET, AIMD_DECREASE_FACTOR,
+                               BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN)
+    for backend in RATE_LIMITERS
+}
+
+_sessions = {}
+
+# Une session (donc un pool de connexions keep-alive) par hôte ; urllib3 ne relance rien lui-même
+def get_http_session(url):
+    key = urlparse(url).netloc
+    with _transport_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = PooledHTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=Retry(total=0, read=False, redirect=0, raise_on_status=False)
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
+
+# Point d'entrée unique pour tous les appels HTTP du script, relances comprises.
+# `build_data`, s'il est fourni, reconstruit le corps à chaque tentative (nonce OAuth Sellsy à usage unique).
+def http_request(backend, method, url, idempotent=True, endpoint=None, build_data=None, **kwargs):
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    endpoint = endpoint or method
+    attempt = 0
+    while True:
+        if build_data:
+            kwargs["data"] = build_data()
+        try:
+            response = http_attempt(backend, method, url, endpoint, **kwargs)
+        except requests.RequestException as e:
+            if attempt >= HTTP_MAX_RETRIES or not should_retry(e, idempotent):
+                raise
+            delay = retry_delay(attempt)
+        else:
+            if attempt >= HTTP_MAX_RETRIES or response.status_code not in RETRY_STATUSES[idempotent]:
+                return response
+            delay = retry_delay(attempt, response)
+        attempt += 1
+        metrics.inc("mandat_http_retries_total", backend=backend, endpoint=endpoint)
+        time.sleep(delay)
+
+# Une tentative : disjoncteur et limite de concurrence du backend, seau à jetons, puis requête
+def http_attempt(backend, method, url, endpoint, **kwargs):
+    with span(f"http {backend} {endpoint}", record_phase=False) as current:
+        controller = BACKEND_CONTROLLERS.get(backend)
+        trial = False
+        if controller:
+            try:
+                trial = controller.acquire()
+            except CircuitOpenError:
+                current["attributes"]["status"] = "circuit_open"
+                metrics.inc("mandat_http_requests_total", backend=backend, endpoint=endpoint, status="circuit_open")
+                raise
+        started = time.perf_counter()
+        status = "exception"
+        try:
+            limiter = RATE_LIMITERS.get(backend)
+            if limiter:
+                limiter.acquire()
+                metrics.observe("mandat_rate_limit_wait_seconds", time.perf_counter() - started, backend=backend)
+            _count_transport("requests", backend)
+            started = time.perf_counter()
+            response = get_http_session(url).request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            latency = time.perf_counter() - started
+            if controller:
+                controller.release(trial, status == "exception" or status == "429" or status.startswith("5"), latency)
+            metrics.observe("mandat_http_request_duration_seconds", latency, backend=backend, endpoint=endpoint)
+            metrics.inc("mandat_http_requests_total", backend=backend, endpoint=endpoint, status=status)
+            current["attributes"]["status"] = status
+
+def get_transport_stats():
+    with _transport_lock:
+        return {
+            "requests": dict(_transport_stats["requests"]),
+            "connections": dict(_transport_stats["connections"])
+        }
+
+def log_transport_summary():
+    stats = get_transport_stats()
+    total_requests = sum(stats["requests"].values())
+    total_connections = sum(stats["connections"].values())
+    reused = max(total_requests - total_connections, 0)
+    details = ", ".join(f"{backend}: {count}" for backend, count in sorted(stats["requests"].items()))
+    log_activity(f"🔌 HTTP: {total_requests} requêtes ({details}), {total_connections} connexions ouvertes, {reused} réutilisations")
+
+# Journalise et exporte l'état des disjoncteurs et des limites de concurrence ; renvoie l'état par backend
+def log_backend_controllers():
+    snapshots = {backend: controller.snapshot() for backend, controller in BACKEND_CONTROLLERS.items()}
+    for backend, snapshot in snapshots.items():
+        metrics.set_gauge("mandat_backend_concurrency_limit", snapshot["limit"], backend=backend)
+        metrics.set_gauge("mandat_circuit_open", 0 if snapshot["state"] == "closed" else 1, backend=backend)
+    details = ", ".join(
+        f"{backend}: {snapshot['state']}, limite {snapshot['limit']}, {snapshot.get('failures', 0)} échecs, {snapshot.get('rejected', 0)} rejets"
+        for backend, snapshot in sorted(snapshots.items())
+    )
+    degraded = any(snapshot["state"] != "closed" or snapshot.get("opened") for snapshot in snapshots.values())
+    log_activity(f"🛡️ Backends: {details}", level="WARNING" if degraded else "INFO", backends=snapshots)
+    return snapshots
+
+# Journal durable des envois (outbox SQLite) : l'intention d'envoi est écrite avant Mails.sendOne,
+# puis le résultat, puis la confirmation de la mise à jour Airtable
+#   sending : envoi en cours, ou interrompu par un arrêt brutal (résultat inconnu, jamais renvoyé automatiquement)
+#   sent    : email envoyé, mise à jour Airtable à écrire ou à rejouer
+#   marked  : case Airtable cochée, Airtable redevient la référence
+#   failed  : envoi refusé, l'enregistrement pourra être retraité
+class StateStore:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS sends (
+                record_id TEXT PRIMARY KEY,
+                client_id TEXT,
+                status TEXT NOT NULL,
+                fields TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS sends_status ON sends (status)")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS sellsy_clients (
+                client_key TEXT PRIMARY KEY,
+                first_name TEXT,
+                last_name TEXT,
+                email TEXT,
+                company TEXT,
+                phone TEXT,
+                seen_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS failures (
+                record_id TEXT PRIMARY KEY,
+                client_id TEXT,
+                kind TEXT NOT NULL,
+                reason TEXT,
+                attempts INTEGER NOT NULL,
+                first_failed_at REAL NOT NULL,
+                last_failed_at REAL NOT NULL,
+                retry_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                record_id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS backfill_records (
+                backfill_id TEXT NOT NULL,
+                record_id TEXT NOT NULL,
+                PRIMARY KEY (backfill_id, record_id)
+            )
+        """)
+
+    def _execute(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    # Enregistre l'intention d'envoi ; renvoie False si l'email est déjà parti ou en cours d'envoi.
+    # Un enregistrement déjà marqué n'est renvoyé que s'il a été lu dans Airtable après ce marquage (`read_at`),
+    # pour qu'une page lue avant la mise à jour d'un autre processus ne provoque pas de doublon.
+    def begin_send(self, record_id, client_id, read_at=None):
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute("""
+                INSERT INTO sends (record_id, client_id, status, attempts, created_at, updated_at)
+                VALUES (?, ?, 'sending', 1, ?, ?)
+                ON CONFLICT (record_id) DO UPDATE SET
+                    client_id = excluded.client_id, status = 'sending',
+                    attempts = sends.attempts + 1, updated_at = excluded.updated_at
+                WHERE sends.status = 'failed' OR (sends.status = 'marked' AND sends.updated_at < ?)
+            """, (record_id, client_id, now, now, read_at if read_at is not None else now))
+            return cursor.rowcount == 1
+
+    # Réserve les enregistrements libres (ou dont le bail a expiré) pour `owner` ; renvoie les IDs obtenus
+    def claim_records(self, record_ids, owner, ttl):
+        now = time.time()
+        claimed = set()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                for record_id in record_ids:
+                    cursor = self.connection.execute("""
+                        INSERT INTO leases (record_id, owner, expires_at) VALUES (?, ?, ?)
+                        ON CONFLICT (record_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                        WHERE leases.expires_at < ? OR leases.owner = excluded.owner
+                    """, (record_id, owner, now + ttl, now))
+                    if cursor.rowcount == 1:
+                        claimed.add(record_id)
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def release_record(self, record_id, owner):
+        self._execute("DELETE FROM leases WHERE record_id = ? AND owner = ?", (record_id, owner))
+
+    # Enregistre un échec et calcule la prochaine tentative : délai doublé à chaque échec transitoire,
+    # plafond immédiat pour un échec permanent ; renvoie (tentatives, heure de la prochaine tentative)
+    def record_failure(self, record_id, client_id, kind, reason, base, ceiling):
+        now = time.time()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT attempts, first_failed_at, client_id FROM failures WHERE record_id = ?", (record_id,)).fetchall()
+            attempts, first_failed_at = 1, now
+            if rows and rows[0][2] == client_id:
+                attempts, first_failed_at = rows[0][0] + 1, rows[0][1]
+            delay = ceiling if kind == "permanent" else min(ceiling, base * 2 ** (attempts - 1))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record_id, client_id, kind, reason, attempts, first_failed_at, now, now + delay))
+        return attempts, now + delay
+
+    # Enregistrements dont le délai après échec est écoulé : à relire même s'ils n'ont pas été modifiés
+    def due_failure_ids(self):
+        return [row[0] for row in self._execute("SELECT record_id FROM failures WHERE retry_at <= ?", (time.time(),))]
+
+    def clear_failure(self, record_id):
+        self._execute("DELETE FROM failures WHERE record_id = ?", (record_id,))
+
+    # Enregistrements encore en attente après un échec ; un ID Sellsy corrigé dans Airtable lève l'attente
+    def backed_off_record_ids(self, client_ids_by_record):
+        now = time.time()
+        found = set()
+        record_ids = list(client_ids_by_record)
+        for start in range(0, len(record_ids), 500):
+            chunk = record_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._execute(
+                f"SELECT record_id, client_id FROM failures WHERE record_id IN ({placeholders}) AND retry_at > ?", chunk + [now])
+            found.update(record_id for record_id, client_id in rows if client_ids_by_record[record_id] == client_id)
+        return found
+
+    # Enregistrements en échec, les plus tentés d'abord ; les entrées qui ne sont plus retentées depuis longtemps
+    # (enregistrement devenu inéligible) sont supprimées
+    def stuck_records(self, forget_after):
+        self._execute("DELETE FROM failures WHERE retry_at < ?", (time.time() - forget_after,))
+        rows = self._execute("""
+            SELECT record_id, client_id, kind, reason, attempts, first_failed_at, retry_at
+            FROM failures ORDER BY attempts DESC, first_failed_at
+        """)
+        columns = ("record_id", "client_id", "kind", "reason", "attempts", "first_failed_at", "retry_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+    # Annuaire des clients Sellsy : gardé sur disque plutôt qu'en mémoire, pour une empreinte indépendante du nombre de clients
+    def save_sellsy_clients(self, clients):
+        now = time.time()
+        rows = [
+            (key, info["first_name"], info["last_name"], info["email"], info["company"], info["phone"], now)
+            for key, info in clients.items()
+        ]
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany("INSERT OR REPLACE INTO sellsy_clients VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    # Renvoie (informations client, heure de lecture dans Sellsy), ou (None, None)
+    def get_sellsy_client(self, client_key):
+        rows = self._execute(
+            "SELECT first_name, last_name, email, company, phone, seen_at FROM sellsy_clients WHERE client_key = ?", (client_key,))
+        if not rows:
+            return None, None
+        first_name, last_name, email, company, phone, seen_at = rows[0]
+        return {"first_name": first_name, "last_name": last_name, "email": email, "company": company, "phone": phone}, seen_at
+
+    # Supprime les clients absents du dernier rechargement complet
+    def prune_sellsy_clients(self, seen_before):
+        self._execute("DELETE FROM sellsy_clients WHERE seen_at < ?", (seen_before,))
+
+    # Enregistrements déjà traités par le rattrapage `backfill_id` ; renvoie le nombre de nouveaux enregistrements
+    def mark_backfilled(self, backfill_id, record_ids):
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                before = self.connection.total_changes
+                self.connection.executemany("INSERT OR IGNORE INTO backfill_records VALUES (?, ?)",
+                                            [(backfill_id, record_id) for record_id in record_ids])
+                added = self.connection.total_changes - before
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+        return added
+
+    def backfilled_record_ids(self, backfill_id, record_ids):
+        found = set()
+        record_ids = list(record_ids)
+        for start in range(0, len(record_ids), 500):
+            chunk = record_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._execute(
+                f"SELECT record_id FROM backfill_records WHERE backfill_id = ? AND record_id IN ({placeholders})", [backfill_id] + chunk)
+            found.update(row[0] for row in rows)
+        return found
+
+    # Oublie les rattrapages précédents
+    def prune_backfills(self, backfill_id):
+        self._execute("DELETE FROM backfill_records WHERE backfill_id != ?", (backfill_id,))
+
+    def mark_sent(self, record_id, fields):
+        self._execute("UPDATE sends SET status = 'sent', fields = ?, updated_at = ? WHERE record_id = ?",
+                      (json.dumps(fields), time.time(), record_id))
+
+    def mark_failed(self, record_id):
+        self._execute("UPDATE sends SET status = 'failed', updated_at = ? WHERE record_id = ?", (time.time(), record_id))
+
+    def mark_written(self, record_ids):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.executemany("UPDATE sends SET status = 'marked', updated_at = ? WHERE record_id = ?",
+                                            [(now, record_id) for record_id in record_ids])
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+
+    # Enregistrements à ne pas retraiter : email envoyé (ou en cours) mais case Airtable pas encore confirmée
+    def unconfirmed_record_ids(self, record_ids):
+        found = set()
+        record_ids = list(record_ids)
+        for start in range(0, len(record_ids), 500):
+            chunk = record_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._execute(
+                f"SELECT record_id FROM sends WHERE record_id IN ({placeholders}) AND status IN ('sending', 'sent')", chunk)
+            found.update(row[0] for row in rows)
+        return found
+
+    def pending_writebacks(self):
+        rows = self._execute("SELECT record_id, fields FROM sends WHERE status = 'sent'")
+        return {record_id: json.loads(fields) for record_id, fields in rows}
+
+    # Envois au résultat inconnu (délai dépassé ou arrêt brutal pendant Mails.sendOne), les plus anciens d'abord ;
+    # `older_than` écarte les envois en cours dans un autre processus
+    def interrupted_sends(self, older_than=0):
+        return [send["record_id"] for send in self.interrupted_send_details(older_than)]
+
+    def interrupted_send_details(self, older_than=0):
+        rows = self._execute("""
+            SELECT record_id, client_id, attempts, updated_at FROM sends
+            WHERE status = 'sending' AND updated_at <= ? ORDER BY updated_at
+        """, (time.time() - older_than,))
+        columns = ("record_id", "client_id", "attempts", "sending_since")
+        return [dict(zip(columns, row)) for row in rows]
+
+    # Tranche manuellement un envoi au résultat inconnu : "sent" (l'email est parti) ou "failed" (à renvoyer)
+    def resolve_send(self, record_id, outcome, fields=None):
+        status = "sent" if outcome == "sent" else "failed"
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE sends SET status = ?, fields = ?, updated_at = ? WHERE record_id = ? AND status = 'sending'",
+                (status, json.dumps(fields) if fields else None, time.time(), record_id))
+            return cursor.rowcount == 1
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+_state_store = None
+_state_store_lock = threading.Lock()
+
+def get_state_store():
+    global _state_store
+    with _state_store_lock:
+        if _state_store is None:
+            _state_store = StateStore(STATE_DB_PATH)
+            atexit.register(_state_store.close)
+        return _state_store
+
+# Nonce OAuth Sellsy : timestamp en millisecondes, strictement croissant même entre threads
+_last_sellsy_nonce = 0
+_sellsy_nonce_lock = threading.Lock()
+
+# Suffixe propre au processus : plusieurs processus (partitions) peuvent générer un nonce dans la même milliseconde.
+# Il n'entre que dans le nonce : oauth_timestamp reste un timestamp Unix en secondes.
+_sellsy_nonce_suffix = f"{os.getpid() % 100000:05d}{random.SystemRandom().randrange(1000):03d}"
+
+def next_sellsy_nonce():
+    global _last_sellsy_nonce
+    with _sellsy_nonce_lock:
+        _last_sellsy_nonce = max(int(time.time() * 1000), _last_sellsy_nonce + 1)
+        return f"{_last_sellsy_nonce}{_sellsy_nonce_suffix}"
+
+# Paramètres OAuth 1.0 (signature PLAINTEXT) d'un appel à l'API Sellsy
+def build_sellsy_oauth_params(sellsy_request):
+    return {
+        "oauth_consumer_key": SELLSY_CONSUMER_TOKEN,
+        "oauth_token": SELLSY_USER_TOKEN,
+        "oauth_nonce": next_sellsy_nonce(),
+        "oauth_timestamp": str(int(time.time())),
+        "oauth_signature_method": "PLAINTEXT",
+        "oauth_version": "1.0",
+        "oauth_signature": f"{SELLSY_CONSUMER_SECRET}&{SELLSY_USER_SECRET}",
+        "io_mode": "json",
+        "do_in": json.dumps(sellsy_request)
+    }
+
+# Lecture d'un fichier d'état JSON, avec valeur par défaut s'il est absent ou illisible
+def read_state_file(name, default):
+    path = os.path.join(STATE_DIR, name)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        log_activity(f"⚠️ Fichier d'état {path} illisible, il sera reconstruit: {str(e)}", level="WARNING")
+        return default
+
+# Écriture atomique d'un fichier d'état JSON
+def write_state_file(name, data):
+    if not os.path.exists(STATE_DIR):
+        os.makedirs(STATE_DIR)
+    path = os.path.join(STATE_DIR, name)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+# Chaque partition a son propre watermark : une partition en retard ne doit pas hériter de celui d'une autre
+SYNC_STATE_FILE = "sync_state.json" if SHARD_COUNT == 1 else f"sync_state.shard{SHARD_INDEX}-{SHARD_COUNT}.json"
+
+# Partition d'un enregistrement : stable d'un processus et d'une exécution à l'autre (contrairement à hash())
+def record_shard(record_id):
+    return zlib.crc32(record_id.encode("utf-8")) % SHARD_COUNT
+
+# Choisit entre lecture incrémentale (depuis le watermark moins le recouvrement) et réconciliation complète
+def build_sync_formula(sync_state):
+    formula = build_eligibility_formula()
+    watermark = sync_state.get("watermark")
+    if not INCREMENTAL_SYNC or not watermark or time.time() - sync_state.get("last_full_sync", 0) > FULL_SYNC_INTERVAL:
+        return formula, True
+
+    since = datetime.fromisoformat(watermark) - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+    since_iso = since.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    return f"AND({formula}, IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{since_iso}')))", False
+
+RECORD_IDS_PER_FORMULA = 50  # Garde l'URL de filterByFormula sous les limites d'Airtable
+
+# Formules restreignant l'éligibilité à une liste d'IDs (notifications de webhook), par paquets
+def build_record_ids_formulas(record_ids):
+    eligibility = build_eligibility_formula()
+    record_ids = list(record_ids)
+    formulas = []
+    for start in range(0, len(record_ids), RECORD_IDS_PER_FORMULA):
+        chunk = record_ids[start:start + RECORD_IDS_PER_FORMULA]
+        ids_formula = ", ".join(f"RECORD_ID()='{record_id}'" for record_id in chunk)
+        formulas.append(f"AND({eligibility}, OR({ids_formula}))")
+    return formulas
+
+# Vérifie les enregistrements Airtable ; avec `record_ids`, seuls ces enregistrements sont relus (mode push)
+def check_airtable_changes(record_ids=None, backfill=None):
+    global _cycle_started, _first_email_seconds
+    cycle_started = _cycle_started = time.perf_counter()
+    _first_email_seconds = None
+    with span("cycle", targeted=record_ids is not None, backfill=backfill is not None):
+        with span("writeback_replay"):
+            replay_pending_writebacks()
+
+        # Le watermark est l'heure de début du parcours : tout enregistrement modifié ensuite sera relu
+        scan_started_at = datetime.now(timezone.utc)
+        sync_state = read_state_file(SYNC_STATE_FILE, {})
+        if backfill is not None:
+            formulas = [build_eligibility_formula()]
+            full_sync = False
+            mode = f"de rattrapage {backfill.backfill_id}" + (" (reprise)" if backfill.offset else "")
+        elif record_ids is None:
+            formula, full_sync = build_sync_formula(sync_state)
+            formulas = [formula]
+            mode = "complète" if full_sync else f"incrémentale depuis {sync_state['watermark']}"
+            if not full_sync:
+                # Le watermark a dépassé les enregistrements en échec ou laissés de côté : ils sont relus par leur ID
+                retry_ids = list(dict.fromkeys(get_state_store().due_failure_ids() + sync_state.get("recheck", [])))
+                if retry_ids:
+                    formulas += build_record_ids_formulas(retry_ids)
+                    mode += f", plus {len(retry_ids)} enregistrements à retenter"
+        else:
+            formulas = build_record_ids_formulas(record_ids)
+            full_sync = False
+            mode = f"ciblée sur {len(record_ids)} enregistrements modifiés"
+        log_activity(f"📡 Début de la vérification des changements Airtable (pagination activée, synchronisation {mode})...")
+
+        # Pipeline : un thread lit les pages suivantes pendant que les workers traitent la page courante.
+        # Les pages lues avant une erreur de pagination sont traitées normalement.
+        pagination = {"pages": 0, "complete": True}
+
+        # En rattrapage, la lecture reprend à l'offset enregistré et s'arrête une fois le budget de temps écoulé
+        start_offset = backfill.offset if backfill else None
+
+        def airtable_pages():
+            for formula in formulas:
+                yield from iter_airtable_pages(formula, pagination, offset=start_offset)
+
+        scanned = 0
+        directory_warmed = False
+        out_of_time = False
+        in_flight = threading.BoundedSemaphore(MAX_WORKERS * 2)  # Contre-pression jusqu'au producteur de pages
+        store = get_state_store()
+        seen_ids = set() if len(formulas) > 1 else None  # Un enregistrement peut répondre à plusieurs formules
+        recheck_ids = set()  # Enregistrements laissés de côté, relus par leur ID au prochain cycle
+        recheck_lock = threading.Lock()
+
+        # Seuls les enregistrements tranchés comptent comme traités par le rattrapage ; un échec transitoire
+        # sera retenté au passage suivant
+        def record_done(candidate, future):
+            in_flight.release()
+            if future.result() == "transient":
+                with recheck_lock:
+                    recheck_ids.add(candidate.record_id)
+            if backfill:
+                if future.result() in BACKFILL_DONE_OUTCOMES:
+                    backfill.mark_processed([candidate.record_id])
+                else:
+                    backfill.defer(1)
+
+        with span("records_pipeline", full_sync=full_sync) as pipeline:
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mandat") as executor:
+                candidate_pages = prefetch(iter_candidate_pages(airtable_pages()), AIRTABLE_PREFETCH_PAGES, "airtable_pagination", parent=pipeline)
+                with closing(candidate_pages):
+                    for page_size, candidates, page_offset in candidate_pages:
+                        if backfill:
+                            # Point de reprise : début de la page courante, ses enregistrements déjà traités seront ignorés
+                            backfill.save(page_offset)
+                            if scanned and backfill.out_of_time():
+                                out_of_time = True
+                                break
+                            candidates = backfill.unprocessed(candidates)
+                        if seen_ids is not None:
+                            candidates = [candidate for candidate in candidates if candidate.record_id not in seen_ids]
+                            seen_ids.update(candidate.record_id for candidate in candidates)
+                        scanned += page_size
+
+                        # Les enregistrements dont la mise à jour Airtable n'est pas confirmée ont déjà reçu leur email
+                        unconfirmed = store.unconfirmed_record_ids(candidate.record_id for candidate in candidates)
+                        if unconfirmed:
+                            count_event("déjà traités", len(unconfirmed), outcome="skipped")
+                            candidates = [candidate for candidate in candidates if candidate.record_id not in unconfirmed]
+
+                        # Les enregistrements en échec attendent la fin de leur délai avant d'être retentés
+                        backed_off = set()
+                        if candidates:
+                            backed_off = store.backed_off_record_ids({candidate.record_id: candidate.client_id for candidate in candidates})
+                            if backed_off:
+                                count_event("en attente après échec", len(backed_off), outcome="skipped")
+                                candidates = [candidate for candidate in candidates if candidate.record_id not in backed_off]
+                        if backfill:
+                            backfill.mark_processed(unconfirmed)
+                            backfill.defer(len(backed_off))
+
+                        # Un enregistrement réservé par un autre processus est laissé à ce processus
+                        if candidates:
+                            claimed = store.claim_records([candidate.record_id for candidate in candidates], LEASE_OWNER, RECORD_LEASE_TTL)
+                            if len(claimed) < len(candidates):
+                                count_event("réservés par un autre processus", len(candidates) - len(claimed), outcome="skipped")
+                                with recheck_lock:
+                                    recheck_ids.update(candidate.record_id for candidate in candidates if candidate.record_id not in claimed)
+                                candidates = [candidate for candidate in candidates if candidate.record_id in claimed]
+                        count_event("éligibles", len(candidates), outcome="eligible")
+
+                        # L'annuaire Sellsy n'est réchauffé que s'il y a des emails à envoyer
+                        if candidates and not directory_warmed:
+                            with span("sellsy_directory_warm"):
+                                warm_sellsy_client_directory()
+                            directory_warmed = True
+
+                        # Traitement parallèle borné : le débit est régulé par les limiteurs de chaque API
+                        for candidate in candidates:
+                            in_flight.acquire()
+                            executor.submit(handle_eligible_record, candidate).add_done_callback(lambda future, candidate=candidate: record_done(candidate, future))
+        complete = pagination["complete"] and not out_of_time
+
+        log_activity(f"🔍 {scanned} enregistrements éligibles récupérés au total ({pagination['pages']} pages)")
+
+        # Le passage est terminé une fois la liste entièrement parcourue, sinon il reprendra à la dernière page
+        if backfill:
+            if complete:
+                backfill.end_pass()
+            else:
+                backfill.save(backfill.offset)
+
+        # Le watermark n'avance que si toutes les pages d'un parcours complet ou incrémental ont été lues ;
+        # les enregistrements à relire remplacent alors les précédents, qui viennent d'être relus
+        if backfill is None:
+            if complete and record_ids is None:
+                sync_state["watermark"] = scan_started_at.isoformat()
+                if full_sync:
+                    sync_state["last_full_sync"] = time.time()
+            else:
+                recheck_ids.update(sync_state.get("recheck", []))
+            sync_state["recheck"] = sorted(recheck_ids)
+            try:
+                write_state_file(SYNC_STATE_FILE, sync_state)
+            except OSError as e:
+                log_activity(f"⚠️ Impossible d'enregistrer l'état de synchronisation: {str(e)}", level="WARNING")
+
+        # Écrit les mises à jour Airtable restantes en fin de cycle
+        with span("airtable_writeback"):
+            if not airtable_write_buffer.flush():
+                log_activity("⚠️ Certaines mises à jour Airtable ont échoué, elles seront réessayées au prochain cycle", level="WARNING")
+
+    metrics.set_gauge("mandat_last_cycle_duration_seconds", round(time.perf_counter() - cycle_started, 3))
+    metrics.set_gauge("mandat_last_cycle_timestamp_seconds", int(time.time()))
+    summary = log_cycle_counters()
+    summary["complete"] = complete
+    summary["pending_writebacks"] = airtable_write_buffer.pending_count()
+    summary["first_email_seconds"] = _first_email_seconds
+    summary["backends"] = log_backend_controllers()
+    summary["stuck_records"] = report_stuck_records()
+    log_transport_summary()
+    export_metrics_and_traces()
+    _log_writer.flush()
+    return summary
+
+# Parcourt les pages Airtable correspondant à la formule et renvoie (heure de lecture, enregistrements, offset de la page)
+# page par page, à partir de `offset` si fourni. `pagination` compte les pages lues et passe "complete" à False
+# si le parcours s'interrompt.
+def iter_airtable_pages(formula, pagination, offset=None, fields=AIRTABLE_FIELDS):
     headers = {
         "Authorization": f"Bearer {AIRTABLE_API_KEY}",
         "Content-Type": "application/json"
     }
 
-    log_activity("📡 Début de la vérification des changements Airtable (pagination activée)...")
-
-    records = []
-    offset = None
+    resumed = offset is not None
 
     while True:
-        url = AIRTABLE_API_URL
-        if offset:
-            url += f"?offset={offset}"
+        params = build_airtable_query(
+            formula=formula,
+            fields=fields,
+            page_size=AIRTABLE_PAGE_SIZE,
+            offset=offset
+        )
 
-        response = requests.get(url, headers=headers)
+        read_at = time.time()
+        try:
+            response = http_request("airtable", "GET", AIRTABLE_API_URL, endpoint="records.list", headers=headers, params=params)
+        except requests.RequestException as e:
+            log_activity(f"❌ Exception Airtable pendant la récupération paginée : {str(e)}", level="ERROR")
+            pagination["complete"] = False
+            return
         if response.status_code == 200:
+            pagination["pages"] += 1
             data = response.json()
-            records.extend(data.get("records", []))
+            record_cold_start()
+            yield read_at, data.get("records", []), offset
             offset = data.get("offset")
+            resumed = False
             if not offset:
-                break
+                return
+        elif resumed and response.status_code == 422 and "LIST_RECORDS_ITERATOR_NOT_AVAILABLE" in response.text:
+            # Les offsets Airtable expirent : la reprise repart du début de la liste
+            log_activity("⚠️ Offset de reprise Airtable expiré, le parcours repart du début", level="WARNING")
+            offset = None
+            resumed = False
         else:
-            log_activity(f"❌ Erreur Airtable pendant la récupération paginée : {response.status_code} - {response.text}")
-            break
+            log_activity(f"❌ Erreur Airtable pendant la récupération paginée : {response.status_code} - {response.text}", level="ERROR")
+            pagination["complete"] = False
+            return
+
+# Enregistrement Airtable réduit aux champs utilisés pour la demande de mandat.
+# Avec __slots__, une instance occupe une fraction d'un enregistrement brut (pas de dict, pas de champs inutiles).
+class MandateCandidate:
+    __slots__ = ("record_id", "customer_name", "customer_email", "client_id", "installer", "signature_date", "read_at")
 
-    log_activity(f"🔍 {len(records)} enregistrements récupérés au total")
+    def __init__(self, record_id, customer_name, customer_email, client_id, installer, signature_date, read_at):
+        self.record_id = record_id
+        self.customer_name = customer_name
+        self.customer_email = customer_email
+        self.client_id = client_id
+        self.installer = installer
+        self.signature_date = signature_date
+        self.read_at = read_at
 
-    for record in records:
+    @classmethod
+    def from_record(cls, record, read_at):
         fields = record.get("fields", {})
-        record_id = record.get("id")
-        
-        # CORRECTION ICI: Vérifier aussi le champ "Mandat GoCardless"
-        if fields.get("Contrat abonnement signe") and not fields.get("Email Mandat sellsy") and not fields.get("Mandat GoCardless"):
-            customer_name = fields.get("Nom", "Client")
-            customer_email = fields.get("Email")
-            customer_id = fields.get("ID_Sellsy", "").strip()
-            installer_raw = fields.get("Installateur", "")
-            signature_date = fields.get("Date de signature de contrat", "")
-            
-            installer_name = get_installer_name(installer_raw)
+        return cls(
+            record.get("id"),
+            fields.get("Nom", "Client"),
+            fields.get("Email"),
+            fields.get("ID_Sellsy", "").strip(),
+            fields.get("Installateur", ""),
+            fields.get("Date de signature de contrat", ""),
+            read_at,
+        )
 
-            log_activity(f"📨 Préparation de l'email avec lien GoCardless direct pour : {customer_name} (Email: {customer_email}, ID Sellsy: {customer_id})")
-            
-            process_mandate_request(
-                client_id=customer_id,
+# Convertit chaque page brute en (taille de la page, candidats, offset de la page) en écartant aussitôt les
+# enregistrements inéligibles ou d'une autre partition : seuls les candidats compacts restent en mémoire
+def iter_candidate_pages(pages):
+    for read_at, records, offset in pages:
+        count_event("enregistrements lus", len(records), outcome="scanned")
+        candidates = []
+        other_shards = 0
+        for record in records:
+            if SHARD_COUNT > 1 and record_shard(record.get("id", "")) != SHARD_INDEX:
+                other_shards += 1
+            elif is_record_eligible(record.get("fields", {})):
+                candidates.append(MandateCandidate.from_record(record, read_at))
+        if other_shards:
+            count_event("autres partitions", other_shards, outcome="skipped")
+        ineligible = len(records) - other_shards - len(candidates)
+        if ineligible:
+            count_event("déjà traités", ineligible, outcome="skipped")
+        yield len(records), candidates, offset
+
+# Consomme `iterable` dans un thread producteur ; la file bornée à `depth` éléments limite son avance.
+# Le producteur est tracé dans un span `name` rattaché à `parent`.
+def prefetch(iterable, depth, name, parent=None):
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        _trace_context.stack = [parent] if parent else []
+        try:
+            with span(name):
+                for item in iterable:
+                    if not put(item):
+                        return
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    producer = threading.Thread(target=produce, name=f"{name}-prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+_cold_start_seconds = None
+_cycle_started = None
+_first_email_seconds = None
+_first_email_lock = threading.Lock()
+
+# Mesure le délai entre le début du cycle et le premier email envoyé
+def record_first_email():
+    global _first_email_seconds
+    with _first_email_lock:
+        if _first_email_seconds is not None or _cycle_started is None:
+            return
+        _first_email_seconds = round(time.perf_counter() - _cycle_started, 3)
+    metrics.set_gauge("mandat_time_to_first_email_seconds", _first_email_seconds)
+    log_activity(f"⏱️ Premier email du cycle envoyé après {_first_email_seconds} s", first_email_seconds=_first_email_seconds)
+
+# Mesure une seule fois le délai entre le lancement du processus et la première page Airtable
+def record_cold_start():
+    global _cold_start_seconds
+    if _cold_start_seconds is not None:
+        return
+    _cold_start_seconds = round(time.perf_counter() - _process_started, 3)
+    metrics.set_gauge("mandat_cold_start_seconds", _cold_start_seconds)
+    log_activity(f"⏱️ Première page Airtable reçue {_cold_start_seconds} s après le lancement", cold_start_seconds=_cold_start_seconds)
+
+def get_cold_start_seconds():
+    return _cold_start_seconds
+
+# Prépare puis traite la demande de mandat d'un candidat (exécuté par les workers),
+# puis libère le bail de l'enregistrement ; renvoie le résultat de process_mandate_request
+def handle_eligible_record(candidate):
+    record_id = candidate.record_id
+    try:
+        with span("record", record_id=record_id):
+            with span("installer_lookup"):
+                installer_name = get_installer_name(candidate.installer)
+
+            log_activity(f"📨 Préparation de l'email avec lien GoCardless direct pour : {candidate.customer_name} (Email: {candidate.customer_email}, ID Sellsy: {candidate.client_id})")
+
+            return process_mandate_request(
+                client_id=candidate.client_id,
                 record_id=record_id,
                 installer_name=installer_name,
-                signature_date=signature_date
+                signature_date=candidate.signature_date,
+                read_at=candidate.read_at
             )
-        elif fields.get("Email Mandat sellsy") or fields.get("Mandat GoCardless"):
-            log_activity(f"⏩ Invitation déjà envoyée ou mandat déjà créé pour {fields.get('Nom', 'Client')}, on ignore.")
+    except Exception as e:
+        log_activity(f"❌ Exception lors du traitement de l'enregistrement {record_id}: {str(e)}", level="ERROR")
+        return "transient"
+    finally:
+        try:
+            get_state_store().release_record(record_id, LEASE_OWNER)
+        except sqlite3.Error as e:
+            log_activity(f"⚠️ Impossible de libérer le bail de {record_id}: {str(e)}", level="WARNING")
 
 # Récupère le nom d'un installateur à partir d'un ID ou d'une liste d'IDs
 def get_installer_name(installer_data):
@@ -122,8 +1436,77 @@ def get_installer_name(installer_data):
     # Valeur par défaut
     return "Installateur non spécifié"
 
-# Récupère le nom de l'installateur depuis Airtable
+# Annuaire des installateurs (ID Airtable -> nom), chargé en une passe paginée et persisté sur disque
+INSTALLERS_CACHE_FILE = "installers.json"
+_installer_directory = None
+_installer_lock = threading.RLock()
+
+# Charge l'annuaire depuis le disque puis le recharge depuis Airtable si le TTL est dépassé
+def get_installer_directory():
+    global _installer_directory
+    with _installer_lock:
+        if _installer_directory is None:
+            _installer_directory = read_state_file(INSTALLERS_CACHE_FILE, {"loaded_at": 0, "names": {}})
+            if _installer_directory.get("names"):
+                log_activity(f"💾 Annuaire des installateurs chargé depuis le disque ({len(_installer_directory['names'])} installateurs)")
+        if time.time() - _installer_directory.get("loaded_at", 0) > INSTALLERS_CACHE_TTL:
+            refresh_installer_directory()
+        return _installer_directory
+
+# Charge toute la table des installateurs en une seule passe paginée
+def refresh_installer_directory():
+    global _installer_directory
+    with span("installer_directory_load"):
+        names = fetch_all_installer_names()
+    if names is None:
+        # On conserve l'annuaire existant et on ne réessaie pas avant le prochain TTL
+        _installer_directory["loaded_at"] = time.time()
+        return False
+
+    _installer_directory = {"loaded_at": time.time(), "names": names}
+    try:
+        write_state_file(INSTALLERS_CACHE_FILE, _installer_directory)
+    except OSError as e:
+        log_activity(f"⚠️ Impossible d'enregistrer l'annuaire des installateurs: {str(e)}", level="WARNING")
+    return True
+
+# Parcourt toutes les pages de la table des installateurs, renvoie None en cas d'échec
+def fetch_all_installer_names():
+    headers = {
+        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+    names = {}
+    offset = None
+    pages = 0
+    try:
+        while True:
+            params = build_airtable_query(fields=["Nom"], page_size=100, offset=offset)
+            response = http_request("installers", "GET", AIRTABLE_INSTALLERS_API_URL, endpoint="installers.list", headers=headers, params=params)
+            if response.status_code != 200:
+                log_activity(f"❌ Erreur lors du chargement des installateurs: {response.status_code} - {response.text}", level="ERROR")
+                return None
+            pages += 1
+            data = response.json()
+            for record in data.get("records", []):
+                names[record["id"]] = record.get("fields", {}).get("Nom", "Installateur non spécifié")
+            offset = data.get("offset")
+            if not offset:
+                break
+    except Exception as e:
+        log_activity(f"❌ Exception lors du chargement des installateurs: {str(e)}", level="ERROR")
+        return None
+
+    log_activity(f"✅ Annuaire des installateurs chargé: {len(names)} installateurs en {pages} pages")
+    return names
+
+# Récupère le nom de l'installateur depuis l'annuaire, ou depuis Airtable s'il est inconnu
 def get_installer_name_from_airtable(installer_id):
+    directory = get_installer_directory()
+    if installer_id in directory["names"]:
+        return directory["names"][installer_id]
+
     headers = {
         "Authorization": f"Bearer {AIRTABLE_API_KEY}",
         "Content-Type": "application/json"
@@ -132,24 +1515,135 @@ def get_installer_name_from_airtable(installer_id):
     url = f"{AIRTABLE_INSTALLERS_API_URL}/{installer_id}"
     
     try:
-        log_activity(f"🔍 Récupération de l'installateur depuis: {url}")
-        response = requests.get(url, headers=headers)
+        log_activity(f"🔍 Installateur absent de l'annuaire, récupération depuis: {url}")
+        response = http_request("installers", "GET", url, endpoint="installers.get", headers=headers)
         
         if response.status_code == 200:
             installer_data = response.json()
             installer_name = installer_data.get("fields", {}).get("Nom", "Installateur non spécifié")
             log_activity(f"✅ Nom de l'installateur récupéré: {installer_name}")
+            with _installer_lock:
+                directory["names"][installer_id] = installer_name
+                try:
+                    write_state_file(INSTALLERS_CACHE_FILE, directory)
+                except OSError as e:
+                    log_activity(f"⚠️ Impossible d'enregistrer l'annuaire des installateurs: {str(e)}", level="WARNING")
             return installer_name
         else:
-            log_activity(f"❌ Erreur lors de la récupération du nom de l'installateur: {response.status_code} - {response.text}")
+            log_activity(f"❌ Erreur lors de la récupération du nom de l'installateur: {response.status_code} - {response.text}", level="ERROR")
             # Utiliser une valeur de repli si la récupération échoue
             return "Installateur"
     except Exception as e:
-        log_activity(f"❌ Exception lors de la récupération du nom de l'installateur: {str(e)}")
+        log_activity(f"❌ Exception lors de la récupération du nom de l'installateur: {str(e)}", level="ERROR")
         return "Installateur"
 
-# Récupère les informations client depuis Sellsy
+# Annuaire local des clients Sellsy (ID -> informations client), alimenté par Client.getList
+# Les clients sont dans la table sellsy_clients du journal SQLite ; ce fichier ne garde que les dates de chargement
+SELLSY_DIRECTORY_STATE_FILE = "sellsy_directory.json"
+_sellsy_directory_lock = threading.RLock()
+
+# Clé unique pour les formes chaîne et entière d'un ID Sellsy ("0123", " 123" et 123 donnent "123")
+def sellsy_client_key(client_id):
+    key = str(client_id).strip()
+    try:
+        return str(int(key))
+    except ValueError:
+        return key
+
+# Réchauffe l'annuaire : rechargement complet après le TTL (ou SELLSY_CLIENT_MAX_AGE s'il est plus court),
+# sinon seulement les clients créés depuis le dernier passage
+def warm_sellsy_client_directory():
+    reload_after = min(SELLSY_CLIENTS_CACHE_TTL, SELLSY_CLIENT_MAX_AGE) if SELLSY_CLIENT_MAX_AGE > 0 else SELLSY_CLIENTS_CACHE_TTL
+    with _sellsy_directory_lock:
+        directory = read_state_file(SELLSY_DIRECTORY_STATE_FILE, {"loaded_at": 0, "refreshed_at": 0})
+        now = time.time()
+        if now - directory.get("loaded_at", 0) > reload_after:
+            if fetch_sellsy_client_list() is not None:
+                get_state_store().prune_sellsy_clients(now)
+                directory = {"loaded_at": now, "refreshed_at": now}
+            else:
+                directory["loaded_at"] = now - reload_after + min(reload_after, SELLSY_CLIENTS_REFRESH_INTERVAL)
+        elif now - directory.get("refreshed_at", 0) > SELLSY_CLIENTS_REFRESH_INTERVAL:
+            # Recouvrement d'une heure pour absorber les décalages d'horloge
+            since = int(directory.get("refreshed_at", 0)) - 3600
+            fetch_sellsy_client_list(created_since=since)
+            directory["refreshed_at"] = now
+        else:
+            return
+        try:
+            write_state_file(SELLSY_DIRECTORY_STATE_FILE, directory)
+        except OSError as e:
+            log_activity(f"⚠️ Impossible d'enregistrer l'état de l'annuaire des clients Sellsy: {str(e)}", level="WARNING")
+
+# Parcourt Client.getList page par page et enregistre chaque page dans l'annuaire ; renvoie le nombre de clients, ou None en cas d'échec
+def fetch_sellsy_client_list(created_since=None):
+    count = 0
+    page = 1
+    params = {"pagination": {"nbperpage": SELLSY_LIST_PAGE_SIZE, "pagenum": page}}
+    if created_since:
+        params["search"] = {"periodecreated": {"start": max(created_since, 0), "end": int(time.time())}}
+
+    try:
+        store = get_state_store()
+        while True:
+            params["pagination"]["pagenum"] = page
+            sellsy_request = {"method": "Client.getList", "params": params}
+            response = http_request("sellsy", "POST", SELLSY_API_URL, endpoint="Client.getList",
+                                    build_data=lambda: build_sellsy_oauth_params(sellsy_request))
+            if response.status_code != 200:
+                log_activity(f"❌ Erreur HTTP Sellsy lors du chargement de la liste des clients: {response.status_code}", level="ERROR")
+                return None
+            result = response.json()
+            if result.get("status") != "success":
+                log_activity(f"❌ Erreur API Sellsy lors du chargement de la liste des clients: {result.get('error')}", level="ERROR")
+                return None
+            data = result.get("response", {})
+            entries = data.get("result") or {}
+            if isinstance(entries, list):
+                entries = {entry.get("id"): entry for entry in entries}
+            store.save_sellsy_clients({
+                sellsy_client_key(entry.get("id") or entry_id): customer_info_from_list_entry(entry)
+                for entry_id, entry in entries.items()
+            })
+            count += len(entries)
+            if page >= int(data.get("infos", {}).get("nbpages", 1) or 1):
+                break
+            page += 1
+    except Exception as e:
+        log_activity(f"❌ Exception lors du chargement de la liste des clients Sellsy: {str(e)}", level="ERROR")
+        return None
+
+    mode = "incrémental" if created_since else "complet"
+    log_activity(f"✅ Annuaire des clients Sellsy ({mode}): {count} clients en {page} pages")
+    return count
+
+# Même structure que les informations extraites de Client.getOne
+def customer_info_from_list_entry(entry):
+    return {
+        "first_name": entry.get("people_forename") or entry.get("forename") or "",
+        "last_name": entry.get("people_name") or entry.get("lastname") or "",
+        "email": entry.get("email") or "",
+        "company": entry.get("name") or entry.get("fullName") or "",
+        "phone": entry.get("mobile") or ""
+    }
+
+def lookup_sellsy_client(client_id):
+    return get_state_store().get_sellsy_client(sellsy_client_key(client_id))
+
+def remember_sellsy_client(client_id, customer_info):
+    get_state_store().save_sellsy_clients({sellsy_client_key(client_id): customer_info})
+
+# Récupère les informations client depuis l'annuaire local, ou depuis Sellsy en cas d'absence
+# ou si l'entrée dépasse SELLSY_CLIENT_MAX_AGE (rechargement de l'annuaire en échec)
 def get_customer_info_from_sellsy(client_id):
+    cached_info, seen_at = lookup_sellsy_client(client_id)
+    if cached_info and cached_info["email"] and cached_info["first_name"]:
+        if SELLSY_CLIENT_MAX_AGE <= 0 or time.time() - seen_at <= SELLSY_CLIENT_MAX_AGE:
+            log_activity(f"✅ Informations client trouvées dans l'annuaire Sellsy local: {cached_info['first_name']} {cached_info['last_name']}", level="DEBUG")
+            count_event("clients lus dans l'annuaire Sellsy")
+            return cached_info
+        count_event("clients relus dans Sellsy (annuaire trop ancien)")
+
     log_activity(f"🔍 Récupération des informations client de Sellsy pour l'ID {client_id}...")
     
     # On essaie d'abord avec l'ID en tant que chaîne
@@ -160,19 +1654,17 @@ def get_customer_info_from_sellsy(client_id):
         try:
             int_client_id = int(client_id)
             log_activity(f"🔄 Tentative avec ID converti en entier: {int_client_id}")
-            # Attendre une seconde pour éviter les problèmes de nonce
-            time.sleep(1)
             client_info = _get_sellsy_client(int_client_id)
         except ValueError:
-            log_activity(f"❌ Impossible de convertir l'ID client '{client_id}' en entier")
+            log_activity(f"❌ Impossible de convertir l'ID client '{client_id}' en entier", level="ERROR")
+            note_failure("permanent", f"ID Sellsy invalide: '{client_id}'")
     
+    if client_info:
+        remember_sellsy_client(client_id, client_info)
     return client_info
 
 # Fonction interne pour l'appel API Sellsy
 def _get_sellsy_client(client_id):
-    # Utiliser le timestamp avec millisecondes pour avoir un nonce vraiment unique
-    nonce = str(int(time.time() * 1000))
-    
     sellsy_request = {
         "method": "Client.getOne",
         "params": {
@@ -180,27 +1672,16 @@ def _get_sellsy_client(client_id):
         }
     }
     
-    log_activity(f"🔧 Paramètres requête Sellsy: {json.dumps(sellsy_request)}")
-    
-    oauth_params = {
-        "oauth_consumer_key": SELLSY_CONSUMER_TOKEN,
-        "oauth_token": SELLSY_USER_TOKEN,
-        "oauth_nonce": nonce,
-        "oauth_timestamp": nonce,
-        "oauth_signature_method": "PLAINTEXT",
-        "oauth_version": "1.0",
-        "oauth_signature": f"{SELLSY_CONSUMER_SECRET}&{SELLSY_USER_SECRET}",
-        "io_mode": "json",
-        "do_in": json.dumps(sellsy_request)
-    }
+    log_activity(lambda: f"🔧 Paramètres requête Sellsy: {json.dumps(sellsy_request)}", level="DEBUG")
     
     try:
-        response = requests.post(SELLSY_API_URL, data=oauth_params)
-        log_activity(f"📊 Code de réponse Sellsy: {response.status_code}")
+        response = http_request("sellsy", "POST", SELLSY_API_URL, endpoint="Client.getOne",
+                                build_data=lambda: build_sellsy_oauth_params(sellsy_request))
+        log_activity(f"📊 Code de réponse Sellsy: {response.status_code}", level="DEBUG")
         
         if response.status_code == 200:
             result = response.json()
-            log_activity(f"📝 Réponse Sellsy: {json.dumps(result)[:200]}...")  # Affiche les 200 premiers caractères
+            log_activity(lambda: f"📝 Réponse Sellsy: {json.dumps(result)[:200]}...", level="DEBUG")  # Affiche les 200 premiers caractères
             
             if result.get("status") == "success":
                 client_data = result.get("response", {})
@@ -220,29 +1701,30 @@ def _get_sellsy_client(client_id):
                 
                 # Vérification des données importantes
                 if not customer_info["email"] or not customer_info["first_name"]:
-                    log_activity(f"❌ Informations client incomplètes: email={customer_info['email']}, prénom={customer_info['first_name']}, nom={customer_info['last_name']}")
+                    log_activity(f"❌ Informations client incomplètes: email={customer_info['email']}, prénom={customer_info['first_name']}, nom={customer_info['last_name']}", level="ERROR")
+                    note_failure("permanent", "Informations client incomplètes (email ou prénom)")
                     return None
                 
                 log_activity(f"✅ Informations client récupérées avec succès: {customer_info['first_name']} {customer_info['last_name']}")
                 return customer_info
             else:
-                log_activity(f"❌ Erreur API Sellsy lors de la récupération client: {result.get('error')}")
+                log_activity(f"❌ Erreur API Sellsy lors de la récupération client: {result.get('error')}", level="ERROR")
+                note_failure(classify_sellsy_error(result.get("error")), f"Client.getOne: {result.get('error')}")
                 return None
         else:
-            log_activity(f"❌ Erreur HTTP Sellsy: {response.status_code}")
-            log_activity(f"📄 Détail de la réponse: {response.text}")
+            log_activity(f"❌ Erreur HTTP Sellsy: {response.status_code}", level="ERROR")
+            log_activity(f"📄 Détail de la réponse: {response.text}", level="DEBUG")
+            note_failure("transient", f"Client.getOne: HTTP {response.status_code}")
             return None
     except Exception as e:
-        log_activity(f"❌ Exception lors de la récupération client: {str(e)}")
+        log_activity(f"❌ Exception lors de la récupération client: {str(e)}", level="ERROR")
+        note_failure("transient", f"Client.getOne: {str(e)}")
         return None
 
 # Envoie un email personnalisé via l'API Sellsy en utilisant le template email
 def send_email_via_sellsy_template(client_id, customer_info, installer_name, gocardless_link, signature_date):
     log_activity(f"📤 Envoi de l'email via le template Sellsy à {customer_info['email']}...")
     
-    # Utiliser un nonce unique avec millisecondes
-    nonce = str(int(time.time() * 1000))
-    
     # Tenter la conversion en entier pour l'ID client
     try:
         client_id_param = int(client_id)
@@ -275,23 +1757,12 @@ def send_email_via_sellsy_template(client_id, customer_info, installer_name, goc
         }
     }
     
-    log_activity(f"🔧 Paramètres requête email Sellsy: {json.dumps(sellsy_request)}")
-    
-    oauth_params = {
-        "oauth_consumer_key": SELLSY_CONSUMER_TOKEN,
-        "oauth_token": SELLSY_USER_TOKEN,
-        "oauth_nonce": nonce,
-        "oauth_timestamp": nonce,
-        "oauth_signature_method": "PLAINTEXT",
-        "oauth_version": "1.0",
-        "oauth_signature": f"{SELLSY_CONSUMER_SECRET}&{SELLSY_USER_SECRET}",
-        "io_mode": "json",
-        "do_in": json.dumps(sellsy_request)
-    }
+    log_activity(lambda: f"🔧 Paramètres requête email Sellsy: {json.dumps(sellsy_request)}", level="DEBUG")
     
     try:
-        response = requests.post(SELLSY_API_URL, data=oauth_params)
-        log_activity(f"📊 Code de réponse email Sellsy: {response.status_code}")
+        response = http_request("sellsy", "POST", SELLSY_API_URL, idempotent=False, endpoint="Mails.sendOne",
+                                build_data=lambda: build_sellsy_oauth_params(sellsy_request))
+        log_activity(f"📊 Code de réponse email Sellsy: {response.status_code}", level="DEBUG")
         
         if response.status_code == 200:
             result = response.json()
@@ -300,81 +1771,284 @@ def send_email_via_sellsy_template(client_id, customer_info, installer_name, goc
                 log_activity(f"✅ Email envoyé avec succès à {customer_info['email']} via le template {SELLSY_EMAIL_TEMPLATE_ID}")
                 return True
             else:
-                log_activity(f"❌ Erreur API Sellsy lors de l'envoi email: {result.get('error')}")
-                log_activity(f"📄 Détail de la réponse: {json.dumps(result)}")
+                log_activity(f"❌ Erreur API Sellsy lors de l'envoi email: {result.get('error')}", level="ERROR")
+                log_activity(lambda: f"📄 Détail de la réponse: {json.dumps(result)}", level="DEBUG")
+                note_failure(classify_sellsy_error(result.get("error")), f"Mails.sendOne: {result.get('error')}")
                 return False
+        elif response.status_code == 504:
+            # Délai dépassé côté passerelle : la requête a pu atteindre Sellsy
+            log_activity("⚠️ Résultat de l'envoi email inconnu (HTTP 504), il ne sera pas renvoyé automatiquement", level="WARNING")
+            return None
         else:
-            log_activity(f"❌ Erreur HTTP Sellsy: {response.status_code}")
-            log_activity(f"📄 Détail de la réponse: {response.text}")
+            log_activity(f"❌ Erreur HTTP Sellsy: {response.status_code}", level="ERROR")
+            log_activity(f"📄 Détail de la réponse: {response.text}", level="DEBUG")
+            note_failure("transient", f"Mails.sendOne: HTTP {response.status_code}")
             return False
     except Exception as e:
-        log_activity(f"❌ Exception lors de l'envoi email: {str(e)}")
+        # Sellsy a pu envoyer l'email : le résultat reste inconnu plutôt que d'autoriser un second envoi
+        if isinstance(e, requests.RequestException) and outcome_unknown(e):
+            log_activity(f"⚠️ Résultat de l'envoi email inconnu ({str(e)}), il ne sera pas renvoyé automatiquement", level="WARNING")
+            return None
+        log_activity(f"❌ Exception lors de l'envoi email: {str(e)}", level="ERROR")
+        note_failure("transient", f"Mails.sendOne: {str(e)}")
         return False
 
-# Processus pour gérer une demande de mandat
-def process_mandate_request(client_id, record_id, installer_name, signature_date):
+# Dernière erreur rencontrée par le thread courant pendant le traitement d'un enregistrement :
+# "permanent" si Sellsy refuse la donnée (client introuvable, incomplet), "transient" pour le réseau, les quotas et les 5xx
+_failure_context = threading.local()
+SELLSY_TRANSIENT_ERRORS = ("nonce", "quota", "limit", "timeout", "temporar", "maintenance")
+
+def note_failure(kind, reason):
+    _failure_context.failure = (kind, reason)
+
+# Renvoie puis efface la dernière erreur notée (ou `default`)
+def take_failure(default=None):
+    failure = getattr(_failure_context, "failure", None) or default
+    _failure_context.failure = None
+    return failure
+
+def classify_sellsy_error(error):
+    message = str(error or "").lower()
+    return "transient" if any(marker in message for marker in SELLSY_TRANSIENT_ERRORS) else "permanent"
+
+# Compte l'échec et place l'enregistrement en attente dans le cache négatif ; renvoie le type d'échec
+def record_mandate_failure(record_id, client_id, kind, reason):
+    count_event("échecs", outcome="failed")
+    count_event(f"échecs {'permanents' if kind == 'permanent' else 'transitoires'}")
+    try:
+        attempts, retry_at = get_state_store().record_failure(record_id, client_id, kind, reason, FAILURE_BACKOFF_BASE, FAILURE_BACKOFF_MAX)
+    except sqlite3.Error as e:
+        log_activity(f"⚠️ Impossible d'enregistrer l'échec de {record_id}: {str(e)}", level="WARNING")
+        return kind
+    retry_iso = datetime.fromtimestamp(retry_at, timezone.utc).isoformat(timespec="seconds")
+    log_activity(f"🧊 {record_id}: échec {kind} n°{attempts} ({reason}), nouvelle tentative après {retry_iso}",
+                 level="WARNING", record_id=record_id, kind=kind, attempts=attempts)
+    return kind
+
+STUCK_RECORDS_REPORT = "stuck_records.json"
+
+# Écrit LOG_DIR/stuck_records.json (enregistrements en échec, les plus tentés d'abord, et envois au résultat inconnu
+# à trancher avec resolve-send) et renvoie le décompte par type
+def report_stuck_records():
+    try:
+        store = get_state_store()
+        stuck = store.stuck_records(forget_after=2 * max(FAILURE_BACKOFF_MAX, FULL_SYNC_INTERVAL))
+        unknown_sends = store.interrupted_send_details(older_than=UNKNOWN_SEND_GRACE)
+    except sqlite3.Error as e:
+        log_activity(f"⚠️ Impossible de lire les enregistrements en échec: {str(e)}", level="WARNING")
+        return {}
+    counts = Counter(entry["kind"] for entry in stuck)
+    for kind in ("permanent", "transient"):
+        metrics.set_gauge("mandat_stuck_records", counts.get(kind, 0), kind=kind)
+    if unknown_sends:
+        counts["unknown_send"] = len(unknown_sends)
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        with open(os.path.join(LOG_DIR, STUCK_RECORDS_REPORT), "w", encoding="utf-8") as f:
+            json.dump({"generated_at": time.time(), "records": stuck, "unknown_sends": unknown_sends}, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        log_activity(f"⚠️ Impossible d'écrire le rapport des enregistrements en échec: {str(e)}", level="WARNING")
+    if stuck:
+        worst = ", ".join(f"{entry['record_id']} ({entry['attempts']}× {entry['reason']})" for entry in stuck[:5])
+        log_activity(f"🧊 {len(stuck)} enregistrements en échec ({counts.get('permanent', 0)} permanents, "
+                     f"{counts.get('transient', 0)} transitoires) : {worst}", level="WARNING")
+    return dict(counts)
+
+# Processus pour gérer une demande de mandat ; renvoie son résultat : "sent", "skipped" (déjà envoyé),
+# "unknown" (résultat de l'envoi inconnu) ou le type d'échec ("permanent" ou "transient")
+def process_mandate_request(client_id, record_id, installer_name, signature_date, read_at=None):
     log_activity(f"🔄 Traitement de la demande de mandat pour client {client_id}...")
+    take_failure()
     
     # 1. Récupérer les informations du client
-    customer_info = get_customer_info_from_sellsy(client_id)
+    if not client_id:
+        log_activity("❌ ID Sellsy manquant dans Airtable", level="ERROR")
+        return record_mandate_failure(record_id, client_id, "permanent", "ID Sellsy manquant")
+    with span("sellsy_client_lookup", client_id=client_id):
+        customer_info = get_customer_info_from_sellsy(client_id)
     if not customer_info:
-        log_activity("❌ Impossible de poursuivre sans les informations du client")
-        return
+        log_activity("❌ Impossible de poursuivre sans les informations du client", level="ERROR")
+        return record_mandate_failure(record_id, client_id, *take_failure(("permanent", "Client introuvable dans Sellsy")))
     
     # Vérification des informations du client
     if not customer_info["email"] or not customer_info["first_name"]:
-        log_activity("❌ Informations client incomplètes (email ou nom manquant)")
-        return
+        log_activity("❌ Informations client incomplètes (email ou nom manquant)", level="ERROR")
+        return record_mandate_failure(record_id, client_id, "permanent", "Informations client incomplètes (email ou prénom)")
     
     # 2. Utiliser le lien GoCardless direct défini en haut du script
     if not GOCARDLESS_DIRECT_LINK:
-        log_activity("❌ Lien GoCardless direct non disponible")
-        return
-    
-    # Petit délai pour éviter les problèmes de rate limiting
-    time.sleep(1)
+        log_activity("❌ Lien GoCardless direct non disponible", level="ERROR")
+        return record_mandate_failure(record_id, client_id, "transient", "Lien GoCardless non configuré")
     
-    # 3. Envoyer l'email via le template Sellsy avec le lien direct
-    email_sent = send_email_via_sellsy_template(
-        client_id=client_id,
-        customer_info=customer_info,
-        installer_name=installer_name,
-        gocardless_link=GOCARDLESS_DIRECT_LINK,
-        signature_date=signature_date
-    )
+    # 3. Enregistrer l'intention d'envoi avant l'appel, pour ne jamais envoyer deux fois le même email
+    store = get_state_store()
+    if not store.begin_send(record_id, client_id, read_at):
+        log_activity(f"⏩ Email déjà envoyé pour l'enregistrement {record_id} (journal des envois), on ignore.", level="DEBUG")
+        count_event("déjà envoyés (journal)", outcome="skipped")
+        return "skipped"
+
+    # 4. Envoyer l'email via le template Sellsy avec le lien direct
+    with span("sellsy_send"):
+        email_sent = send_email_via_sellsy_template(
+            client_id=client_id,
+            customer_info=customer_info,
+            installer_name=installer_name,
+            gocardless_link=GOCARDLESS_DIRECT_LINK,
+            signature_date=signature_date
+        )
     
     if email_sent:
-        # 4. Mettre à jour Airtable pour marquer l'email comme envoyé
-        mark_email_sent_in_airtable(record_id)
+        # 5. Mettre à jour Airtable pour marquer l'email comme envoyé
+        with span("airtable_writeback_enqueue"):
+            mark_email_sent_in_airtable(record_id)
+        count_event("emails envoyés", outcome="sent")
+        record_first_email()
+        store.clear_failure(record_id)
+        return "sent"
+    elif email_sent is None:
+        # L'envoi reste "sending" : jamais renvoyé tant qu'il n'est pas tranché (python main.py resolve-send ...)
+        count_event("envois au résultat inconnu", outcome="failed")
+        return "unknown"
     else:
-        log_activity("❌ L'email n'a pas pu être envoyé, la mise à jour Airtable n'est pas effectuée")
+        store.mark_failed(record_id)
+        log_activity("❌ L'email n'a pas pu être envoyé, la mise à jour Airtable n'est pas effectuée", level="ERROR")
+        return record_mandate_failure(record_id, client_id, *take_failure(("transient", "Mails.sendOne: échec")))
 
-# Marque la case "Email Mandat sellsy" dans Airtable
-def mark_email_sent_in_airtable(record_id):
+# Tampon d'écriture Airtable : les cases "Email Mandat sellsy" sont cochées par lots de 10 maximum
+class AirtableWriteBuffer:
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = {}  # record_id -> champs à écrire
+        self.oldest_at = None
+        self.lock = threading.Lock()
+
+    def add(self, record_id, fields):
+        with self.lock:
+            self.pending[record_id] = fields
+            if self.oldest_at is None:
+                self.oldest_at = time.monotonic()
+            ready = len(self.pending) >= self.batch_size or time.monotonic() - self.oldest_at >= self.flush_interval
+        if ready:
+            self.flush(full_batches_only=True)
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending)
+
+    def _take_batch(self, full_batches_only):
+        with self.lock:
+            if not self.pending or (full_batches_only and len(self.pending) < self.batch_size
+                                    and time.monotonic() - self.oldest_at < self.flush_interval):
+                return None
+            batch = dict(list(self.pending.items())[:self.batch_size])
+            for record_id in batch:
+                del self.pending[record_id]
+            if not self.pending:
+                self.oldest_at = None
+            return batch
+
+    def _requeue(self, updates):
+        with self.lock:
+            self.pending.update(updates)
+            if self.oldest_at is None:
+                self.oldest_at = time.monotonic()
+
+    def flush(self, full_batches_only=False):
+        failed = {}
+        while True:
+            batch = self._take_batch(full_batches_only)
+            if not batch:
+                break
+            batch_failed = write_airtable_batch(batch)
+            get_state_store().mark_written([record_id for record_id in batch if record_id not in batch_failed])
+            failed.update(batch_failed)
+        # Les échecs restent en attente pour le prochain flush, sans nouvel envoi d'email
+        if failed:
+            self._requeue(failed)
+        return not failed
+
+# PATCH groupé des enregistrements ; renvoie les mises à jour qui n'ont pas pu être écrites
+def write_airtable_batch(updates):
     headers = {
         "Authorization": f"Bearer {AIRTABLE_API_KEY}",
         "Content-Type": "application/json"
     }
-    
-    log_activity(f"🔄 Mise à jour de l'enregistrement Airtable {record_id}...")
-    
-    # Mettre à jour uniquement les champs qui existent dans Airtable
-    data = {
-        "fields": {
-            "Email Mandat sellsy": True,  # Assurez-vous que le nom du champ est exact
-            "Date envoi mandat": datetime.now().strftime("%Y-%m-%d")
-        }
+    data = {"records": [{"id": record_id, "fields": fields} for record_id, fields in updates.items()]}
+
+    try:
+        response = http_request("airtable", "PATCH", AIRTABLE_API_URL, endpoint="records.batch_update", headers=headers, json=data)
+    except requests.RequestException as e:
+        log_activity(f"❌ Exception mise à jour groupée Airtable : {str(e)}", level="ERROR")
+        return dict(updates)
+
+    if response.status_code == 200:
+        written = {record.get("id") for record in response.json().get("records", [])}
+        missing = {record_id: fields for record_id, fields in updates.items() if record_id not in written}
+        log_activity(f"✅ Champ 'Email Mandat sellsy' mis à jour dans Airtable pour {len(written)} enregistrements.")
+        return missing
+
+    log_activity(f"❌ Erreur mise à jour groupée Airtable : {response.status_code} - {response.text}", level="ERROR")
+    if len(updates) == 1:
+        return dict(updates)
+    # Un enregistrement invalide fait échouer tout le lot : on réessaie chaque enregistrement séparément
+    failed = {}
+    for record_id, fields in updates.items():
+        failed.update(write_airtable_batch({record_id: fields}))
+    return failed
+
+AIRTABLE_BATCH_SIZE = 10  # Maximum accepté par Airtable pour un PATCH groupé
+AIRTABLE_FLUSH_INTERVAL = float(os.getenv("AIRTABLE_FLUSH_INTERVAL", "5"))
+airtable_write_buffer = AirtableWriteBuffer(AIRTABLE_BATCH_SIZE, AIRTABLE_FLUSH_INTERVAL)
+
+# Champs Airtable d'un email envoyé (uniquement des champs qui existent dans Airtable)
+def email_sent_fields():
+    return {
+        "Email Mandat sellsy": True,  # Assurez-vous que le nom du champ est exact
+        "Date envoi mandat": datetime.now().strftime("%Y-%m-%d")
     }
+
+# Marque la case "Email Mandat sellsy" dans Airtable (écriture différée et groupée)
+def mark_email_sent_in_airtable(record_id):
+    log_activity(f"🔄 Mise à jour de l'enregistrement Airtable {record_id} mise en file...", level="DEBUG")
     
-    log_activity(f"📝 Données pour la mise à jour: {json.dumps(data)}")
-    
-    response = requests.patch(f"{AIRTABLE_API_URL}/{record_id}", headers=headers, json=data)
-    if response.status_code == 200:
-        log_activity("✅ Champ 'Email Mandat sellsy' mis à jour dans Airtable.")
-        # Afficher les détails de la réponse pour vérifier
-        log_activity(f"📄 Détail de la réponse Airtable: {json.dumps(response.json())}")
-    else:
-        log_activity(f"❌ Erreur mise à jour Airtable : {response.status_code} - {response.text}")
+    fields = email_sent_fields()
+    get_state_store().mark_sent(record_id, fields)
+    airtable_write_buffer.add(record_id, fields)
+
+# Rejoue les mises à jour Airtable des emails envoyés lors d'un cycle précédent (échec du PATCH ou arrêt brutal)
+def replay_pending_writebacks():
+    store = get_state_store()
+    interrupted = store.interrupted_sends(older_than=UNKNOWN_SEND_GRACE)
+    metrics.set_gauge("mandat_unknown_sends", len(interrupted))
+    if interrupted:
+        log_activity(f"⚠️ {len(interrupted)} envois au résultat inconnu, ils ne seront pas renvoyés automatiquement: {', '.join(interrupted[:20])}. "
+                     "Vérifier dans Sellsy puis lancer `python main.py resolve-send sent|failed <record_id>...`", level="WARNING")
+    pending = store.pending_writebacks()
+    if not pending:
+        return
+    log_activity(f"🔁 Rejeu de {len(pending)} mises à jour Airtable en attente depuis le journal des envois")
+    for record_id, fields in pending.items():
+        airtable_write_buffer.add(record_id, fields)
+    airtable_write_buffer.flush()
+
+# Tranche les envois au résultat inconnu après vérification dans Sellsy : "sent" écrit la mise à jour Airtable,
+# "failed" laisse l'enregistrement être renvoyé au prochain cycle
+def resolve_unknown_sends(outcome, record_ids):
+    store = get_state_store()
+    resolved = []
+    for record_id in record_ids:
+        fields = email_sent_fields() if outcome == "sent" else None
+        if store.resolve_send(record_id, outcome, fields):
+            resolved.append(record_id)
+            if fields:
+                airtable_write_buffer.add(record_id, fields)
+        else:
+            log_activity(f"⚠️ {record_id}: aucun envoi au résultat inconnu dans le journal", level="WARNING")
+    if outcome == "sent" and not airtable_write_buffer.flush():
+        log_activity("⚠️ Certaines mises à jour Airtable ont échoué, elles seront réessayées au prochain cycle", level="WARNING")
+    log_activity(f"✅ {len(resolved)} envois tranchés ({outcome}): {', '.join(resolved)}")
+    return resolved
 
 # Fonction de vérification des configurations API
 def check_api_configurations():
@@ -384,17 +2058,17 @@ def check_api_configurations():
     
     # Vérification Airtable
     if not AIRTABLE_API_KEY or not AIRTABLE_BASE_ID or not AIRTABLE_TABLE_NAME:
-        log_activity("❌ Configuration Airtable incomplète")
+        log_activity("❌ Configuration Airtable incomplète", level="ERROR")
         config_ok = False
     
     # Vérification de la base des installateurs
     if not AIRTABLE_INSTALLERS_BASE_ID:
-        log_activity("⚠️ Configuration base des installateurs manquante (AIRTABLE_INSTALLERS_BASE_ID)")
-        log_activity("⚠️ Les noms d'installateurs ne seront pas récupérés correctement")
+        log_activity("⚠️ Configuration base des installateurs manquante (AIRTABLE_INSTALLERS_BASE_ID)", level="WARNING")
+        log_activity("⚠️ Les noms d'installateurs ne seront pas récupérés correctement", level="WARNING")
     
     # Vérification Sellsy
     if not SELLSY_CONSUMER_TOKEN or not SELLSY_CONSUMER_SECRET or not SELLSY_USER_TOKEN or not SELLSY_USER_SECRET:
-        log_activity("❌ Configuration Sellsy incomplète")
+        log_activity("❌ Configuration Sellsy incomplète", level="ERROR")
         config_ok = False
     
     if config_ok:
@@ -408,95 +2082,584 @@ def check_api_configurations():
     
     return config_ok
 
-# Test de connexion aux APIs
+# Sondes de connexion aux APIs : chacune renvoie True si l'API répond correctement
+def probe_airtable():
+    headers = {
+        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    response = http_request("airtable", "GET", AIRTABLE_API_URL, endpoint="probe", headers=headers,
+                            params={"maxRecords": 1}, timeout=PROBE_TIMEOUT)
+    if response.status_code == 200:
+        log_activity("✅ Connexion à Airtable réussie")
+        return True
+    log_activity(f"❌ Échec connexion Airtable: {response.status_code} - {response.text}", level="ERROR")
+    return False
+
+def probe_installers():
+    headers = {
+        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    response = http_request("installers", "GET", AIRTABLE_INSTALLERS_API_URL, endpoint="probe", headers=headers,
+                            params={"maxRecords": 1}, timeout=PROBE_TIMEOUT)
+    if response.status_code == 200:
+        log_activity(f"✅ Connexion à la table Airtable '{AIRTABLE_INSTALLATEURS_TABLE}' réussie")
+        return True
+    log_activity(f"⚠️ Échec connexion à la table '{AIRTABLE_INSTALLATEURS_TABLE}': {response.status_code} - {response.text}", level="WARNING")
+    return False
+
+# Test Sellsy - Récupération liste de clients
+def probe_sellsy():
+    sellsy_request = {
+        "method": "Client.getList",
+        "params": {
+            "pagination": {"nbperpage": 1}
+        }
+    }
+    response = http_request("sellsy", "POST", SELLSY_API_URL, endpoint="probe", timeout=PROBE_TIMEOUT,
+                            build_data=lambda: build_sellsy_oauth_params(sellsy_request))
+    if response.status_code != 200:
+        log_activity(f"❌ Échec connexion Sellsy: {response.status_code} - {response.text}", level="ERROR")
+        return False
+    result = response.json()
+    if result.get("status") != "success":
+        log_activity(f"❌ Échec API Sellsy: {result.get('error')}", level="ERROR")
+        return False
+    log_activity("✅ Connexion à Sellsy réussie")
+    return True
+
+# Sonde et criticité : sans la table des installateurs, les noms sont simplement absents des emails
+API_PROBES = {
+    "airtable": (probe_airtable, True),
+    "installers": (probe_installers, False),
+    "sellsy": (probe_sellsy, True),
+}
+
+# Test de connexion aux APIs, en parallèle ; renvoie le résultat de chaque sonde
 def test_api_connections():
     log_activity("🧪 Test des connexions API...")
-    
-    # Test Airtable
+
+    def run_probe(name):
+        probe, critical = API_PROBES[name]
+        try:
+            return probe()
+        except Exception as e:
+            log_activity(f"{'❌' if critical else '⚠️'} Exception test {name}: {str(e)}", level="ERROR" if critical else "WARNING")
+            return False
+
+    with span("api_probes"):
+        with ThreadPoolExecutor(max_workers=len(API_PROBES), thread_name_prefix="probe") as executor:
+            return dict(zip(API_PROBES, executor.map(run_probe, API_PROBES)))
+
+HEALTH_STATE_FILE = "health.json"
+
+# Empreinte de la configuration sondée : un changement de base, de table ou de jeton invalide le cache
+def api_config_fingerprint():
+    config = "|".join([AIRTABLE_API_ROOT, AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME, AIRTABLE_INSTALLERS_BASE_ID,
+                       AIRTABLE_INSTALLATEURS_TABLE, AIRTABLE_API_KEY, SELLSY_API_URL, SELLSY_CONSUMER_TOKEN, SELLSY_USER_TOKEN])
+    return hashlib.sha256(config.encode("utf-8")).hexdigest()
+
+# Vérifie la santé des APIs, depuis le cache si une exécution récente a réussi ; renvoie False si une API critique échoue
+def ensure_api_health():
+    health = read_state_file(HEALTH_STATE_FILE, {})
+    if (PROBE_CACHE_TTL > 0 and health.get("fingerprint") == api_config_fingerprint()
+            and time.time() - health.get("checked_at", 0) < PROBE_CACHE_TTL):
+        log_activity("⚡ Connexions API vérifiées récemment, sondes ignorées", level="DEBUG")
+        return True
+
+    results = test_api_connections()
+    healthy = all(ok for name, ok in results.items() if API_PROBES[name][1])
+    if healthy:
+        try:
+            write_state_file(HEALTH_STATE_FILE, {"fingerprint": api_config_fingerprint(), "checked_at": time.time(), "results": results})
+        except OSError as e:
+            log_activity(f"⚠️ Impossible d'enregistrer l'état des connexions API: {str(e)}", level="WARNING")
+    else:
+        invalidate_api_health()
+    return healthy
+
+# Force de nouvelles sondes à la prochaine exécution (après un cycle en erreur)
+def invalidate_api_health():
     try:
-        headers = {
-            "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-            "Content-Type": "application/json"
+        os.remove(os.path.join(STATE_DIR, HEALTH_STATE_FILE))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        log_activity(f"⚠️ Impossible de supprimer l'état des connexions API: {str(e)}", level="WARNING")
+
+# Résultat d'un cycle qui n'a pas eu lieu : le planificateur garde son intervalle au lieu de ralentir
+def cancelled_cycle(reason):
+    return {"cancelled": reason}
+
+# Lance un cycle si les APIs critiques répondent (ou si PROBE_GATE est désactivé)
+def run_checked_cycle(wait=False):
+    if not ensure_api_health() and PROBE_GATE:
+        log_activity("🚫 API critique indisponible, cycle annulé", level="ERROR")
+        return cancelled_cycle("api_unavailable")
+    summary = run_cycle(wait=wait)
+    if summary is None:
+        return cancelled_cycle("cycle_in_progress")
+    if not summary.get("complete"):
+        invalidate_api_health()
+    return summary
+
+# Rattrapage par morceaux : offset Airtable de reprise et avancement, persistés à chaque page.
+# Les enregistrements déjà traités sont gardés dans la base SQLite, pour une empreinte indépendante de la taille du rattrapage.
+BACKFILL_STATE_FILE = "backfill.json" if SHARD_COUNT == 1 else f"backfill.shard{SHARD_INDEX}-{SHARD_COUNT}.json"
+BACKFILL_DONE_OUTCOMES = frozenset(["sent", "skipped", "unknown", "permanent"])  # Résultats qui ne seront pas retentés
+
+class BackfillCheckpoint:
+    def __init__(self, backfill_id, budget):
+        self.backfill_id = backfill_id
+        self.budget = budget
+        self.run_started = time.monotonic()
+        self.lock = threading.Lock()
+        self.store = get_state_store()
+        state = read_state_file(BACKFILL_STATE_FILE, {})
+        if state.get("id") != backfill_id:
+            state = {"id": backfill_id, "started_at": datetime.now(timezone.utc).isoformat(),
+                     "processed": 0, "elapsed": 0.0, "runs": 0, "pass": 1, "deferred": 0}
+            self.store.prune_backfills(backfill_id)
+        self.state = state
+        self.offset = state.get("offset")
+        self.processed_this_run = 0
+        self.deferred_this_run = 0
+
+    @property
+    def completed(self):
+        return bool(self.state.get("completed_at"))
+
+    @property
+    def total(self):
+        return self.state.get("total")
+
+    def set_total(self, total):
+        self.state["total"] = total
+
+    def run_elapsed(self):
+        return time.monotonic() - self.run_started
+
+    def out_of_time(self):
+        return self.run_elapsed() >= self.budget
+
+    def unprocessed(self, candidates):
+        done = self.store.backfilled_record_ids(self.backfill_id, (candidate.record_id for candidate in candidates))
+        return [candidate for candidate in candidates if candidate.record_id not in done]
+
+    def mark_processed(self, record_ids):
+        if not record_ids:
+            return
+        added = self.store.mark_backfilled(self.backfill_id, record_ids)
+        with self.lock:
+            self.processed_this_run += added
+
+    # Enregistrements laissés pour le passage suivant (échec transitoire ou en attente après échec)
+    def defer(self, count):
+        with self.lock:
+            self.deferred_this_run += count
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.state, offset=self.offset, processed=self.state["processed"] + self.processed_this_run,
+                        deferred=self.state.get("deferred", 0) + self.deferred_this_run,
+                        elapsed=round(self.state["elapsed"] + self.run_elapsed(), 3), runs=self.state["runs"] + 1)
+
+    def save(self, offset):
+        self.offset = offset
+        try:
+            write_state_file(BACKFILL_STATE_FILE, self.snapshot())
+        except OSError as e:
+            log_activity(f"⚠️ Impossible d'enregistrer le point de reprise du rattrapage: {str(e)}", level="WARNING")
+
+    def finish(self):
+        self.state["completed_at"] = datetime.now(timezone.utc).isoformat()
+        self.save(None)
+
+    # Fin d'un parcours complet : nouveau passage depuis le début si des enregistrements ont été laissés,
+    # sinon (ou après BACKFILL_MAX_PASSES passages) le rattrapage est terminé
+    def end_pass(self):
+        deferred = self.snapshot()["deferred"]
+        current = self.state.get("pass", 1)
+        if deferred and current < BACKFILL_MAX_PASSES:
+            log_activity(f"🔁 Rattrapage {self.backfill_id} : {deferred} enregistrements à retenter, passage {current + 1} à la prochaine exécution")
+            with self.lock:
+                self.state["pass"] = current + 1
+                self.state["deferred"] = 0
+                self.deferred_this_run = 0
+            self.save(None)
+            return
+        if deferred:
+            log_activity(f"⚠️ Rattrapage {self.backfill_id} : {deferred} enregistrements toujours en échec après {current} passages, "
+                         "laissés au cycle normal", level="WARNING")
+        self.finish()
+
+    # Avancement et estimation de fin d'après le débit mesuré sur l'ensemble des exécutions
+    def progress(self):
+        state = self.snapshot()
+        done, total, elapsed = state["processed"], state.get("total"), state["elapsed"]
+        rate = done / elapsed if elapsed > 0 else 0.0
+        remaining = 0 if self.completed else max((total or 0) - done, 0)
+        eta = remaining / rate if rate > 0 and total is not None else None
+        return {
+            "id": self.backfill_id,
+            "processed": done,
+            "processed_this_run": self.processed_this_run,
+            "total": total,
+            "percent": round(min(done / total, 1) * 100, 1) if total else None,
+            "rate": round(rate, 2),
+            "eta_seconds": None if eta is None else round(eta),
+            "runs_remaining": None if eta is None or self.budget <= 0 else math.ceil(eta / self.budget),
+            "runs": state["runs"],
+            "pass": state.get("pass", 1),
+            "deferred": state.get("deferred", 0),
+            "completed": self.completed,
         }
-        response = requests.get(AIRTABLE_API_URL, headers=headers, params={"maxRecords": 1})
-        if response.status_code == 200:
-            log_activity("✅ Connexion à Airtable réussie")
+
+# Compte les enregistrements éligibles de la partition en ne lisant que leur identifiant
+def count_eligible_records():
+    pagination = {"pages": 0, "complete": True}
+    total = 0
+    with span("backfill_count"):
+        for _, records, _ in iter_airtable_pages(build_eligibility_formula(), pagination, fields=["ID_Sellsy"]):
+            total += sum(1 for record in records if SHARD_COUNT == 1 or record_shard(record.get("id", "")) == SHARD_INDEX)
+    return total if pagination["complete"] else None
+
+# Exécute un morceau du rattrapage BACKFILL dans le budget de temps ; None si aucun rattrapage n'est en cours
+def run_backfill(wait=False):
+    if not BACKFILL:
+        return None
+    backfill = BackfillCheckpoint(BACKFILL, BACKFILL_TIME_BUDGET)
+    if backfill.completed:
+        log_activity(f"✅ Rattrapage {BACKFILL} déjà terminé le {backfill.state['completed_at']}, retour au cycle normal")
+        return None
+    if not ensure_api_health() and PROBE_GATE:
+        log_activity("🚫 API critique indisponible, rattrapage reporté", level="ERROR")
+        return cancelled_cycle("api_unavailable")
+    if backfill.total is None:
+        backfill.set_total(count_eligible_records())
+        log_activity(f"📦 Rattrapage {BACKFILL} : {backfill.total} enregistrements éligibles à traiter")
+    summary = run_cycle(wait=wait, backfill=backfill)
+    if summary is None:
+        return cancelled_cycle("cycle_in_progress")
+    progress = backfill.progress()
+    summary["backfill"] = progress
+    metrics.set_gauge("mandat_backfill_processed", progress["processed"])
+    if progress["total"] is not None:
+        metrics.set_gauge("mandat_backfill_total", progress["total"])
+    if progress["completed"]:
+        log_activity(f"✅ Rattrapage {BACKFILL} terminé : {progress['processed']} enregistrements traités", backfill=progress)
+    else:
+        eta = "inconnue" if progress["eta_seconds"] is None else f"{progress['eta_seconds']} s (~{progress['runs_remaining']} exécutions)"
+        log_activity(f"📦 Rattrapage {BACKFILL} : {progress['processed']}/{progress['total'] or '?'} ({progress['percent'] or '?'} %), "
+                     f"{progress['processed_this_run']} cette exécution, fin estimée dans {eta}", backfill=progress)
+    return summary
+
+# Planificateur adaptatif : intervalle court tant que du travail arrive, backoff exponentiel plafonné sinon.
+# L'échéance est persistée pour que les exécutions cron de GitHub Actions puissent aussi s'espacer.
+SCHEDULE_STATE_FILE = "schedule.json"
+
+class AdaptivePollScheduler:
+    def __init__(self, initial, min_interval, max_interval, factor, jitter):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.factor = factor
+        self.jitter = jitter
+        state = read_state_file(SCHEDULE_STATE_FILE, {})
+        self.interval = state.get("interval", initial)
+        self.next_poll_at = state.get("next_poll_at", 0)
+
+    # Du travail est en attente si le cycle a trouvé des enregistrements éligibles, n'a pas tout parcouru
+    # ou laisse des mises à jour Airtable à écrire
+    @staticmethod
+    def has_pending_work(summary):
+        return bool(summary.get("eligible") or summary.get("pending_writebacks") or not summary.get("complete", True))
+
+    def record_cycle(self, summary):
+        if summary.get("cancelled"):
+            # Cycle annulé (API indisponible) : le travail en attente est inconnu, l'intervalle ne change pas
+            pass
+        elif self.has_pending_work(summary):
+            self.interval = self.min_interval
         else:
-            log_activity(f"❌ Échec connexion Airtable: {response.status_code} - {response.text}")
-    except Exception as e:
-        log_activity(f"❌ Exception test Airtable: {str(e)}")
-    
-    # Test Airtable Table des installateurs
+            self.interval = min(self.max_interval, max(self.min_interval, self.interval * self.factor))
+        delay = max(1.0, self.interval * (1 + random.uniform(-self.jitter, self.jitter)))
+        self.next_poll_at = time.time() + delay
+        try:
+            write_state_file(SCHEDULE_STATE_FILE, {"interval": self.interval, "next_poll_at": self.next_poll_at})
+        except OSError as e:
+            log_activity(f"⚠️ Impossible d'enregistrer le planning: {str(e)}", level="WARNING")
+        return delay
+
+    # Une exécution cron peut être sautée si le prochain cycle n'est pas dû (avec une minute de tolérance)
+    def is_due(self):
+        return time.time() >= self.next_poll_at - 60
+
+_cycle_lock = threading.Lock()
+
+# Lance un cycle, sauf si un autre est déjà en cours : les cycles ne se chevauchent jamais.
+# Avec `wait`, on attend la fin du cycle en cours au lieu d'abandonner.
+def run_cycle(record_ids=None, wait=False, backfill=None):
+    if not _cycle_lock.acquire(blocking=wait):
+        log_activity("⏭️ Un cycle est déjà en cours, on n'en lance pas un second", level="WARNING")
+        return None
     try:
-        headers = {
-            "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        response = requests.get(AIRTABLE_INSTALLERS_API_URL, headers=headers, params={"maxRecords": 1})
-        if response.status_code == 200:
-            log_activity(f"✅ Connexion à la table Airtable '{AIRTABLE_INSTALLATEURS_TABLE}' réussie")
-        else:
-            log_activity(f"⚠️ Échec connexion à la table '{AIRTABLE_INSTALLATEURS_TABLE}': {response.status_code} - {response.text}")
-    except Exception as e:
-        log_activity(f"⚠️ Exception test Airtable Installateurs: {str(e)}")
-    
-    # Test Sellsy - Récupération liste de clients
+        return check_airtable_changes(record_ids=record_ids, backfill=backfill)
+    finally:
+        _cycle_lock.release()
+
+# Webhook Airtable : identifiant, secret MAC et curseur des payloads déjà traités
+WEBHOOK_STATE_FILE = "webhook.json"
+
+def airtable_headers():
+    return {
+        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
+# ID (tblXXX) de la table suivie : les payloads des webhooks sont indexés par ID, pas par nom
+def resolve_airtable_table_id():
+    if AIRTABLE_TABLE_ID:
+        return AIRTABLE_TABLE_ID
+    if AIRTABLE_TABLE_NAME.startswith("tbl"):
+        return AIRTABLE_TABLE_NAME
+    response = http_request("airtable", "GET", AIRTABLE_META_TABLES_URL, endpoint="meta.tables", headers=airtable_headers())
+    if response.status_code != 200:
+        log_activity(f"❌ Erreur Airtable à la lecture du schéma de la base : {response.status_code} - {response.text}", level="ERROR")
+        return None
+    for table in response.json().get("tables", []):
+        if table.get("name") == AIRTABLE_TABLE_NAME:
+            return table.get("id")
+    log_activity(f"❌ Table {AIRTABLE_TABLE_NAME} introuvable dans le schéma de la base (renseigner AIRTABLE_TABLE_ID)", level="ERROR")
+    return None
+
+# Réutilise (et prolonge) le webhook enregistré, ou en crée un vers WEBHOOK_NOTIFICATION_URL
+def register_airtable_webhook():
+    webhook_state = read_state_file(WEBHOOK_STATE_FILE, {})
     try:
-        # Utiliser un nonce unique avec millisecondes
-        nonce = str(int(time.time() * 1000))
-        sellsy_request = {
-            "method": "Client.getList",
-            "params": {
-                "pagination": {"nbperpage": 1}
-            }
+        known_id = webhook_state.get("table_id") if webhook_state.get("table_name") == AIRTABLE_TABLE_NAME else None
+        table_id = AIRTABLE_TABLE_ID or known_id or resolve_airtable_table_id()
+        if not table_id:
+            return None
+        if webhook_state.get("id") and webhook_state.get("table_id") != table_id:
+            # Webhook créé pour une autre table (ou avant le filtrage par table) : on le remplace
+            log_activity(f"⚠️ Webhook {webhook_state['id']} non limité à la table {table_id}, remplacement", level="WARNING")
+            response = http_request("airtable", "DELETE", f"{AIRTABLE_WEBHOOKS_URL}/{webhook_state['id']}",
+                                    endpoint="webhooks.delete", headers=airtable_headers())
+            if response.status_code not in (200, 404):
+                log_activity(f"⚠️ Ancien webhook non supprimé : {response.status_code} - {response.text}", level="WARNING")
+            webhook_state = {}
+        if webhook_state.get("id"):
+            response = http_request("airtable", "POST", f"{AIRTABLE_WEBHOOKS_URL}/{webhook_state['id']}/refresh",
+                                    idempotent=False, endpoint="webhooks.refresh", headers=airtable_headers())
+            if response.status_code == 200:
+                webhook_state["expiration"] = response.json().get("expirationTime")
+                write_state_file(WEBHOOK_STATE_FILE, webhook_state)
+                return webhook_state
+            if response.status_code != 404:
+                log_activity(f"❌ Erreur Airtable au renouvellement du webhook : {response.status_code} - {response.text}", level="ERROR")
+                return None
+            log_activity(f"⚠️ Webhook {webhook_state['id']} introuvable, création d'un nouveau webhook", level="WARNING")
+
+        if not WEBHOOK_NOTIFICATION_URL:
+            log_activity("❌ WEBHOOK_NOTIFICATION_URL manquant : impossible de créer le webhook Airtable", level="ERROR")
+            return None
+        specification = {
+            "notificationUrl": WEBHOOK_NOTIFICATION_URL,
+            "specification": {"options": {"filters": {"dataTypes": ["tableData"], "recordChangeScope": table_id}}},
         }
-        oauth_params = {
-            "oauth_consumer_key": SELLSY_CONSUMER_TOKEN,
-            "oauth_token": SELLSY_USER_TOKEN,
-            "oauth_nonce": nonce,
-            "oauth_timestamp": nonce,
-            "oauth_signature_method": "PLAINTEXT",
-            "oauth_version": "1.0",
-            "oauth_signature": f"{SELLSY_CONSUMER_SECRET}&{SELLSY_USER_SECRET}",
-            "io_mode": "json",
-            "do_in": json.dumps(sellsy_request)
+        response = http_request("airtable", "POST", AIRTABLE_WEBHOOKS_URL, idempotent=False, endpoint="webhooks.create",
+                                headers=airtable_headers(), json=specification)
+        if response.status_code != 200:
+            log_activity(f"❌ Erreur Airtable à la création du webhook : {response.status_code} - {response.text}", level="ERROR")
+            return None
+        data = response.json()
+        webhook_state = {
+            "id": data["id"],
+            "mac_secret": data["macSecretBase64"],
+            "expiration": data.get("expirationTime"),
+            "cursor": 1,
+            "table_id": table_id,
+            "table_name": AIRTABLE_TABLE_NAME,
         }
-        response = requests.post(SELLSY_API_URL, data=oauth_params)
-        if response.status_code == 200:
-            result = response.json()
-            if result.get("status") == "success":
-                log_activity("✅ Connexion à Sellsy réussie")
-            else:
-                log_activity(f"❌ Échec API Sellsy: {result.get('error')}")
-        else:
-            log_activity(f"❌ Échec connexion Sellsy: {response.status_code} - {response.text}")
-    except Exception as e:
-        log_activity(f"❌ Exception test Sellsy: {str(e)}")
+        write_state_file(WEBHOOK_STATE_FILE, webhook_state)
+        log_activity(f"✅ Webhook Airtable {webhook_state['id']} créé vers {WEBHOOK_NOTIFICATION_URL}")
+        return webhook_state
+    except (requests.RequestException, OSError, ValueError, KeyError) as e:
+        log_activity(f"❌ Exception lors de l'enregistrement du webhook Airtable: {str(e)}", level="ERROR")
+        return None
+
+# Vérifie la signature X-Airtable-Content-MAC d'une notification ; sans secret, rien ne peut être vérifié et tout est refusé
+def verify_webhook_mac(body, header, mac_secret):
+    if not mac_secret:
+        return False
+    expected = hmac.new(base64.b64decode(mac_secret), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f"hmac-sha256={expected}", header or "")
+
+# Lit les payloads depuis le curseur ; renvoie (IDs modifiés ou créés, nouveau curseur, lecture complète).
+# Seule la table suivie compte. Nos propres mises à jour Airtable reviennent aussi dans les payloads : leur relecture
+# ciblée applique la formule d'éligibilité et ne renvoie rien, sans boucle.
+def fetch_webhook_changes(webhook_state):
+    cursor = webhook_state.get("cursor", 1)
+    table_id = webhook_state.get("table_id")
+    record_ids = {}
+    while True:
+        try:
+            response = http_request("airtable", "GET", f"{AIRTABLE_WEBHOOKS_URL}/{webhook_state['id']}/payloads",
+                                    endpoint="webhooks.payloads", headers=airtable_headers(), params={"cursor": cursor})
+        except requests.RequestException as e:
+            log_activity(f"❌ Exception Airtable pendant la lecture des payloads du webhook : {str(e)}", level="ERROR")
+            return list(record_ids), cursor, False
+        if response.status_code != 200:
+            log_activity(f"❌ Erreur Airtable pendant la lecture des payloads du webhook : {response.status_code} - {response.text}", level="ERROR")
+            return list(record_ids), cursor, False
+        data = response.json()
+        for payload in data.get("payloads", []):
+            table_changes = payload.get("changedTablesById", {}).get(table_id, {})
+            for key in ("createdRecordsById", "changedRecordsById"):
+                record_ids.update(dict.fromkeys(table_changes.get(key, {})))
+        cursor = data.get("cursor", cursor)
+        if not data.get("mightHaveMore"):
+            return list(record_ids), cursor, True
+
+# Traite les enregistrements modifiés depuis le curseur puis avance le curseur.
+# Le curseur n'avance qu'après le cycle : un arrêt brutal fait relire les mêmes payloads, sans double envoi (journal SQLite).
+def process_webhook_notifications():
+    webhook_state = read_state_file(WEBHOOK_STATE_FILE, {})
+    if not webhook_state.get("id") or not webhook_state.get("table_id"):
+        return None
+    with span("webhook_payloads"):
+        record_ids, cursor, complete = fetch_webhook_changes(webhook_state)
+    summary = None
+    if record_ids:
+        log_activity(f"🔔 Notification Airtable : {len(record_ids)} enregistrements modifiés")
+        summary = run_cycle(record_ids=record_ids, wait=True)
+        if summary is None or not summary.get("complete"):
+            return summary
+    if cursor != webhook_state.get("cursor"):
+        webhook_state["cursor"] = cursor
+        try:
+            write_state_file(WEBHOOK_STATE_FILE, webhook_state)
+        except OSError as e:
+            log_activity(f"⚠️ Impossible d'enregistrer le curseur du webhook: {str(e)}", level="WARNING")
+    if not complete:
+        log_activity("⚠️ Payloads du webhook lus partiellement, la suite sera lue à la prochaine notification", level="WARNING")
+    return summary
+
+# Reçoit les notifications Airtable (qui ne contiennent pas les changements) et réveille le worker.
+# Les notifications reçues pendant un traitement sont regroupées en une seule lecture des payloads.
+class AirtableWebhookReceiver:
+    def __init__(self, host, port, mac_secret):
+        self.mac_secret = mac_secret
+        self.notified = threading.Event()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if not verify_webhook_mac(body, self.headers.get("X-Airtable-Content-MAC"), receiver.mac_secret):
+                    reason = "signature invalide" if receiver.mac_secret else "secret MAC manquant"
+                    log_activity(f"⚠️ Notification de webhook rejetée : {reason}", level="WARNING")
+                    self.send_response(401)
+                else:
+                    receiver.notify()
+                    self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def notify(self):
+        self.notified.set()
+
+    def _work(self):
+        while True:
+            self.notified.wait()
+            self.notified.clear()
+            try:
+                process_webhook_notifications()
+            except Exception as e:
+                log_activity(f"❌ Exception lors du traitement d'une notification de webhook: {str(e)}", level="ERROR")
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-http", daemon=True).start()
+        threading.Thread(target=self._work, name="webhook-worker", daemon=True).start()
+        log_activity(f"👂 Récepteur de webhook Airtable à l'écoute sur {self.httpd.server_address[0]}:{self.httpd.server_address[1]}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# Active le mode push si demandé ; renvoie le récepteur, ou None pour rester en polling seul
+def start_webhook_receiver():
+    if not WEBHOOK_ENABLED or os.getenv("GITHUB_ACTIONS"):
+        return None
+    webhook_state = register_airtable_webhook()
+    if not webhook_state or not webhook_state.get("mac_secret"):
+        log_activity("⚠️ Mode push indisponible, poursuite en polling", level="WARNING")
+        return None
+    receiver = AirtableWebhookReceiver(WEBHOOK_HOST, WEBHOOK_PORT, webhook_state.get("mac_secret")).start()
+    receiver.notify()  # Rattrape les changements survenus pendant l'arrêt
+    return receiver
 
 # Fonction principale
 def main():
     log_activity("🚀 Lancement de la surveillance Airtable...")
+
+    scheduler = AdaptivePollScheduler(CHECK_INTERVAL, POLL_MIN_INTERVAL, POLL_MAX_INTERVAL, POLL_BACKOFF_FACTOR, POLL_JITTER)
+    # Les exécutions cron sont sautées tant que le planificateur est en backoff (mais jamais une exécution manuelle)
+    if os.getenv("GITHUB_ACTIONS") and os.getenv("GITHUB_EVENT_NAME") == "schedule" and not scheduler.is_due():
+        remaining = int(scheduler.next_poll_at - time.time())
+        log_activity(f"⏭️ Aucun travail récent, prochain cycle dû dans {remaining} secondes : exécution sautée")
+        return
     
     # Vérifier les configurations
     if not check_api_configurations():
-        log_activity("⚠️ Certaines configurations sont manquantes, le programme pourrait ne pas fonctionner correctement")
-    
-    # Tester les connexions API avant de commencer
-    test_api_connections()
+        log_activity("⚠️ Certaines configurations sont manquantes, le programme pourrait ne pas fonctionner correctement", level="WARNING")
     
+    # Les connexions API sont testées avant chaque cycle, sauf si une exécution récente les a validées
     # Si exécuté dans GitHub Actions, faire une seule vérification
     if os.getenv("GITHUB_ACTIONS"):
         log_activity("🔍 Exécution unique dans GitHub Actions")
-        check_airtable_changes()
+        summary = run_backfill()
+        if summary is None:
+            summary = run_checked_cycle()
+        scheduler.record_cycle(summary or {})
     else:
+        # En mode push, le polling n'est plus qu'une réconciliation de sécurité à intervalle fixe
+        receiver = start_webhook_receiver()
+        if receiver:
+            scheduler = AdaptivePollScheduler(WEBHOOK_RECONCILE_INTERVAL, WEBHOOK_RECONCILE_INTERVAL,
+                                              WEBHOOK_RECONCILE_INTERVAL, POLL_BACKOFF_FACTOR, POLL_JITTER)
         # Boucle continue pour exécution locale
         try:
             while True:
-                check_airtable_changes()
-                log_activity(f"🕒 Attente {CHECK_INTERVAL} secondes avant le prochain check.")
-                time.sleep(CHECK_INTERVAL)
+                summary = run_backfill(wait=receiver is not None)
+                if summary is None:
+                    summary = run_checked_cycle(wait=receiver is not None)
+                if receiver:
+                    # Prolonge le webhook, qui expire après 7 jours sans renouvellement (ou le recrée s'il a disparu)
+                    webhook_state = register_airtable_webhook()
+                    if webhook_state:
+                        receiver.mac_secret = webhook_state.get("mac_secret")
+                delay = scheduler.record_cycle(summary or {})
+                log_activity(f"🕒 Attente {int(delay)} secondes avant le prochain check.")
+                time.sleep(delay)
         except KeyboardInterrupt:
             log_activity("🛑 Surveillance interrompue par l'utilisateur.")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "resolve-send":
+        if len(sys.argv) < 4 or sys.argv[2] not in ("sent", "failed"):
+            sys.exit("Usage : python main.py resolve-send sent|failed <record_id>...")
+        invalid = [record_id for record_id in sys.argv[3:] if not re.fullmatch(r"rec[A-Za-z0-9]{14}", record_id)]
+        if invalid:
+            sys.exit(f"IDs d'enregistrement Airtable invalides : {', '.join(invalid)}")
+        resolve_unknown_sends(sys.argv[2], sys.argv[3:])
+    else:
+        main()
@@ -0,0 +1,87 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fake_apis  # noqa: E402
+
+BASE_ID = "appTEST"
+INSTALLERS_BASE_ID = "appTESTINST"
+TABLE_NAME = "Abonnes"
+SIGNED = {"Email Mandat sellsy": False, "Date envoi mandat": "", "Mandat GoCardless": ""}  # Contrat signé, rien d'envoyé
+
+
+def sent_client_ids(server):
+    return [client_id for client_id, _ in server.state.sent_emails]
+
+
+def read_state(main, name):
+    with open(os.path.join(main.STATE_DIR, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+# API factices vierges pour chaque test : les tables sont ajoutées par le test (ou par `subscribers`)
+@pytest.fixture
+def fake_server():
+    server = fake_apis.FakeApiServer().start()
+    server.state.add_table(INSTALLERS_BASE_ID, "Installateurs", fake_apis.FakeAirtableTable(20, fake_apis.default_installer_factory))
+    yield server
+    server.stop()
+
+
+# Table des abonnés (et annuaire Sellsy correspondant) ; renvoie une fonction pour choisir taille et part d'éligibles
+@pytest.fixture
+def subscribers(fake_server):
+    def create(size, eligible_ratio):
+        table = fake_apis.FakeAirtableTable(size, fake_apis.default_subscriber_factory(eligible_ratio))
+        fake_server.state.add_table(BASE_ID, TABLE_NAME, table)
+        fake_server.state.sellsy_clients = fake_apis.FakeSellsyClients(size)
+        return table
+    return create
+
+
+# Importe main.py configuré contre les API factices, avec un STATE_DIR et un LOG_DIR propres au test.
+# La configuration étant lue à l'import, le module est réimporté à chaque appel.
+@pytest.fixture
+def load_main(fake_server, tmp_path, monkeypatch):
+    loaded = []
+
+    def load(**env):
+        monkeypatch.delenv("GITHUB_ACTIONS", raising=False)
+        settings = {
+            "AIRTABLE_API_KEY": "keyTEST",
+            "AIRTABLE_BASE_ID": BASE_ID,
+            "AIRTABLE_TABLE_NAME": TABLE_NAME,
+            "AIRTABLE_INSTALLERS_BASE_ID": INSTALLERS_BASE_ID,
+            "AIRTABLE_API_ROOT": f"{fake_server.url}/v0",
+            "SELLSY_API_URL": f"{fake_server.url}/sellsy/0/",
+            "SELLSY_CONSUMER_TOKEN": "test",
+            "SELLSY_CONSUMER_SECRET": "test",
+            "SELLSY_USER_TOKEN": "test",
+            "SELLSY_USER_SECRET": "test",
+            "AIRTABLE_RATE_LIMIT": "1000",
+            "INSTALLERS_RATE_LIMIT": "1000",
+            "SELLSY_RATE_LIMIT": "1000",
+            "HTTP_BACKOFF_FACTOR": "0.01",
+            "LOG_LEVEL": "ERROR",
+            "LOG_DIR": str(tmp_path / "logs"),
+            "STATE_DIR": str(tmp_path / "state"),
+        }
+        settings.update(env)
+        for name, value in settings.items():
+            monkeypatch.setenv(name, value)
+        sys.modules.pop("main", None)
+        module = importlib.import_module("main")
+        loaded.append(module)
+        return module
+
+    yield load
+    for module in loaded:
+        module._log_writer.flush()
+        if module._state_store is not None:
+            module._state_store.close()
+    sys.modules.pop("main", None)
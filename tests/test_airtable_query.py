@@ -0,0 +1,45 @@
+import fake_apis
+
+
+# Toutes les combinaisons des trois cases (absente, vide, cochée, texte) pour comparer formule et filtre local
+def flags_factory(index):
+    options = [None, False, True]
+    mandate_options = [None, "", True, "MD000123"]
+    values = {
+        "Contrat abonnement signe": options[index % 3],
+        "Email Mandat sellsy": options[index // 3 % 3],
+        "Mandat GoCardless": mandate_options[index // 9 % 4],
+    }
+    fields = {"Nom": f"Client {index}", "Email": f"client{index}@example.com", "ID_Sellsy": str(100000 + index)}
+    fields.update({name: value for name, value in values.items() if value is not None})
+    return {"fields": fields}
+
+
+def test_eligibility_formula_matches_local_filter(load_main):
+    main = load_main()
+    predicate = fake_apis.compile_formula(main.build_eligibility_formula())
+    table = fake_apis.FakeAirtableTable(36, flags_factory)
+    for index in range(table.size):
+        record = table.get(index)
+        assert predicate(record) == main.is_record_eligible(record["fields"]), record["fields"]
+
+
+def test_pagination_reads_every_eligible_record_once(load_main, subscribers):
+    table = subscribers(3000, 0.1)
+    main = load_main()
+    pagination = {"pages": 0, "complete": True}
+    record_ids = [record["id"] for _, records, _ in main.iter_airtable_pages(main.build_eligibility_formula(), pagination)
+                  for record in records]
+    expected = [table.record_id(index) for index in range(table.size) if main.is_record_eligible(table.get(index)["fields"])]
+    assert pagination["complete"] and pagination["pages"] >= 3
+    assert record_ids == expected
+
+
+def test_pages_only_carry_the_projected_fields(load_main, subscribers):
+    subscribers(500, 0.1)
+    main = load_main()
+    pagination = {"pages": 0, "complete": True}
+    for _, records, _ in main.iter_airtable_pages(main.build_eligibility_formula(), pagination):
+        for record in records:
+            assert set(record["fields"]) <= set(main.AIRTABLE_FIELDS)
+    assert pagination["pages"] >= 1
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import fake_apis
+import pytest
+
+
+def make_controller(main, max_limit=8, threshold=100, cooldown=30):
+    return main.BackendController("test", max_limit, latency_target=1, decrease_factor=0.5, failure_threshold=threshold, cooldown=cooldown)
+
+
+def test_limit_decreases_multiplicatively_and_grows_additively(load_main):
+    main = load_main()
+    controller = make_controller(main)
+    for expected in (4, 2, 1, 1):
+        controller.release(controller.acquire(), True, 0)
+        assert controller.limit == expected
+    for expected in (2, 2.5, 2.9):
+        controller.release(controller.acquire(), False, 0.1)
+        assert controller.limit == pytest.approx(expected)
+    for _ in range(200):
+        controller.release(controller.acquire(), False, 0.1)
+    assert controller.limit == 8
+
+    # Un succès trop lent compte comme un signal de surcharge
+    slow = make_controller(main)
+    slow.release(slow.acquire(), False, 1.5)
+    assert slow.limit == 4
+
+
+def test_a_burst_of_failures_decreases_the_limit_once(load_main):
+    main = load_main()
+    controller = make_controller(main)
+    trials = [controller.acquire() for _ in range(4)]
+    for trial in trials:
+        controller.release(trial, True, 0.5)
+    assert controller.limit == 4
+    assert controller.snapshot()["decreases"] == 1
+
+
+def test_requests_beyond_the_limit_wait_for_a_slot(load_main):
+    main = load_main()
+    controller = make_controller(main, max_limit=2)
+    controller.acquire()
+    controller.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (controller.acquire(), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.2)
+    controller.release(False, False, 0.1)
+    assert acquired.wait(1)
+    waiter.join()
+    assert controller.snapshot()["throttled"] >= 1
+
+
+def test_breaker_opens_then_half_opens_with_a_single_trial(load_main):
+    main = load_main()
+    controller = make_controller(main, threshold=3, cooldown=0.1)
+    for _ in range(3):
+        controller.release(controller.acquire(), True, 0)
+    assert controller.state == "open"
+    with pytest.raises(main.CircuitOpenError):
+        controller.acquire()
+
+    # Après le délai, une seule requête d'essai ; son échec rouvre le disjoncteur
+    time.sleep(0.15)
+    assert controller.acquire() is True
+    assert controller.state == "half_open"
+    with pytest.raises(main.CircuitOpenError):
+        controller.acquire()
+    controller.release(True, True, 0)
+    assert controller.state == "open"
+
+    # Un essai réussi le referme
+    time.sleep(0.15)
+    controller.release(controller.acquire(), False, 0.1)
+    assert controller.state == "closed"
+    assert controller.acquire() is False
+
+
+def test_open_breaker_stops_calls_to_a_failing_backend(load_main, subscribers, fake_server):
+    subscribers(1000, 0.05)
+    main = load_main(HTTP_MAX_RETRIES="0", BREAKER_FAILURE_THRESHOLD="3", BREAKER_COOLDOWN="60", PROBE_GATE="false")
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior(error_rate=1.0)
+    summary = main.check_airtable_changes()
+    assert summary["backends"]["sellsy"]["state"] == "open"
+    assert summary["backends"]["sellsy"]["rejected"] > 0
+    # Les 50 envois ne partent pas vers Sellsy : seules les requêtes avant l'ouverture (et les éventuelles en vol) l'atteignent
+    assert fake_server.state.stats["sellsy"]["http_503"] <= 3 + main.MAX_WORKERS
@@ -0,0 +1,41 @@
+import fake_apis
+from conftest import read_state, sent_client_ids
+
+
+def test_backfill_resumes_from_checkpoint(load_main, subscribers, fake_server):
+    subscribers(2500, 0.1)
+    processed = []
+    # Budget nul : une page par exécution, chaque exécution dans un nouveau processus (réimport)
+    for _ in range(10):
+        main = load_main(BACKFILL="bf-test", BACKFILL_TIME_BUDGET="0")
+        summary = main.run_backfill()
+        if summary is None:
+            break
+        processed.append(summary["backfill"]["processed_this_run"])
+        if not summary["backfill"]["completed"]:
+            assert read_state(main, main.BACKFILL_STATE_FILE)["offset"]
+    assert processed == [100, 100, 50]
+    assert read_state(main, main.BACKFILL_STATE_FILE)["completed_at"]
+    sent = sent_client_ids(fake_server)
+    assert len(sent) == len(set(sent)) == 250
+
+
+def test_transient_failures_are_retried_in_a_second_pass(load_main, subscribers, fake_server):
+    subscribers(500, 0.02)
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior(0.0, 1.0, 0.0)
+    main = load_main(BACKFILL="bf-test", HTTP_MAX_RETRIES="0", BREAKER_FAILURE_THRESHOLD="1000", FAILURE_BACKOFF_BASE="0",
+                     PROBE_GATE="false")
+    progress = main.run_backfill()["backfill"]
+    assert (progress["processed"], progress["pass"], progress["completed"]) == (0, 2, False)
+
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior()
+    progress = main.run_backfill()["backfill"]
+    assert (progress["processed"], progress["completed"]) == (10, True)
+    assert len(set(sent_client_ids(fake_server))) == len(fake_server.state.sent_emails) == 10
+    assert main.run_backfill() is None
+
+
+def test_empty_actions_variables_fall_back_to_defaults(load_main):
+    main = load_main(BACKFILL="", BACKFILL_TIME_BUDGET="", BACKFILL_MAX_PASSES="")
+    assert (main.BACKFILL, main.BACKFILL_TIME_BUDGET, main.BACKFILL_MAX_PASSES) == ("", 480.0, 3)
+    assert main.run_backfill() is None
@@ -0,0 +1,25 @@
+import sys
+
+import fake_apis
+
+
+def test_candidate_keeps_only_the_fields_it_needs(load_main):
+    main = load_main()
+    record = fake_apis.public_record(fake_apis.FakeAirtableTable(1, fake_apis.default_subscriber_factory(1.0)).get(0))
+    candidate = main.MandateCandidate.from_record(record, read_at=123.0)
+    assert not hasattr(candidate, "__dict__")
+    assert (candidate.record_id, candidate.client_id, candidate.customer_email, candidate.read_at) == (
+        record["id"], "100000", "client0@example.com", 123.0)
+    assert sys.getsizeof(candidate) < sys.getsizeof(record["fields"])
+
+
+def test_ineligible_records_are_dropped_as_pages_are_read(load_main):
+    main = load_main()
+    table = fake_apis.FakeAirtableTable(100, fake_apis.default_subscriber_factory(0.1))
+    pages = [(1.0, [fake_apis.public_record(table.get(index)) for index in range(start, start + 50)], f"offset{start}")
+             for start in (0, 50)]
+    results = list(main.iter_candidate_pages(iter(pages)))
+    assert [(size, offset) for size, _, offset in results] == [(50, "offset0"), (50, "offset50")]
+    assert [candidate.record_id for _, candidates, _ in results for candidate in candidates] == [
+        table.record_id(index) for index in range(0, 100, 10)]
+    assert all(isinstance(candidate, main.MandateCandidate) for _, candidates, _ in results for candidate in candidates)
@@ -0,0 +1,55 @@
+import json
+import os
+import time
+
+import pytest
+from conftest import BASE_ID, SIGNED, TABLE_NAME, sent_client_ids
+
+
+def test_transient_failures_back_off_exponentially_up_to_the_ceiling(load_main):
+    main = load_main()
+    store = main.get_state_store()
+    delays = []
+    for _ in range(6):
+        started = time.time()
+        attempts, retry_at = store.record_failure("recA", "100", "transient", "timeout", base=60, ceiling=600)
+        delays.append(round(retry_at - started))
+    assert attempts == 6
+    assert delays == [60, 120, 240, 480, 600, 600]
+
+    _, retry_at = store.record_failure("recB", "100", "permanent", "Client introuvable", base=60, ceiling=600)
+    assert retry_at - time.time() == pytest.approx(600, abs=1)
+
+
+def test_changed_client_id_lifts_the_backoff(load_main):
+    main = load_main()
+    store = main.get_state_store()
+    store.record_failure("recA", "100", "permanent", "Client introuvable", base=60, ceiling=600)
+    assert store.backed_off_record_ids({"recA": "100"}) == {"recA"}
+    assert store.backed_off_record_ids({"recA": "200"}) == set()
+    # Un nouvel échec avec un autre ID repart de la première tentative
+    assert store.record_failure("recA", "200", "transient", "timeout", base=60, ceiling=600)[0] == 1
+
+
+def test_failing_record_is_not_retried_until_fixed(load_main, subscribers, fake_server):
+    table = subscribers(100, 0.0)
+    main = load_main(FULL_SYNC_INTERVAL="0")
+    record_id = table.record_id(5)
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, record_id, {**SIGNED, "ID_Sellsy": "999999999"})
+    assert main.check_airtable_changes().get("failed") == 1
+
+    # Les cycles suivants relisent l'enregistrement sans rappeler Sellsy
+    get_one = fake_server.state.stats["sellsy"]["Client.getOne"]
+    summary = main.check_airtable_changes()
+    assert summary.get("skipped") == 1 and not summary.get("failed")
+    assert fake_server.state.stats["sellsy"]["Client.getOne"] == get_one
+
+    with open(os.path.join(main.LOG_DIR, main.STUCK_RECORDS_REPORT), encoding="utf-8") as f:
+        (stuck,) = json.load(f)["records"]
+    assert (stuck["record_id"], stuck["kind"], stuck["attempts"]) == (record_id, "permanent", 1)
+
+    # L'ID Sellsy corrigé dans Airtable lève l'attente
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, record_id, {"ID_Sellsy": "100005"})
+    assert main.check_airtable_changes().get("sent") == 1
+    assert sent_client_ids(fake_server) == ["100005"]
+    assert main.get_state_store().stuck_records(forget_after=3600) == []
@@ -0,0 +1,48 @@
+import time
+
+import fake_apis
+from conftest import BASE_ID, INSTALLERS_BASE_ID, sent_client_ids
+
+
+# Compteurs incrémentés avant la réponse, contrairement à "requests"
+def probe_count(server):
+    stats = server.state.stats
+    return (stats.get(f"airtable:{BASE_ID}", {}).get("pages", 0) + stats.get(f"airtable:{INSTALLERS_BASE_ID}", {}).get("pages", 0)
+            + stats.get("sellsy", {}).get("Client.getList", 0))
+
+
+def test_probes_run_in_parallel_and_are_cached(load_main, subscribers, fake_server):
+    subscribers(100, 0.0)
+    main = load_main()
+    for backend in ("airtable", "sellsy"):
+        fake_server.state.behaviors[backend] = fake_apis.FakeBackendBehavior(latency=0.3)
+    started = time.monotonic()
+    assert main.ensure_api_health()
+    # Trois sondes de 300 ms : bien moins d'une seconde si elles partent ensemble
+    assert time.monotonic() - started < 0.7
+    assert probe_count(fake_server) == 3
+
+    assert main.ensure_api_health()
+    assert probe_count(fake_server) == 3
+
+
+def test_config_change_invalidates_the_cache(load_main, subscribers, fake_server):
+    subscribers(100, 0.0)
+    assert load_main().ensure_api_health()
+    assert probe_count(fake_server) == 3
+    assert load_main(SELLSY_USER_TOKEN="other").ensure_api_health()
+    assert probe_count(fake_server) == 6
+
+
+def test_only_critical_probes_gate_the_cycle(load_main, subscribers, fake_server):
+    subscribers(500, 0.04)
+    del fake_server.state.tables[(INSTALLERS_BASE_ID, "Installateurs")]
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior(error_rate=1.0)
+    main = load_main(HTTP_MAX_RETRIES="0")
+    assert main.run_checked_cycle() == {"cancelled": "api_unavailable"}
+    assert sent_client_ids(fake_server) == []
+
+    # Sellsy revient : la table des installateurs manquante n'empêche pas le cycle
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior()
+    assert main.run_checked_cycle().get("sent") == 20
+    assert len(sent_client_ids(fake_server)) == 20
@@ -0,0 +1,48 @@
+import fake_apis
+import requests
+from conftest import sent_client_ids
+
+
+def response_with(headers):
+    response = requests.Response()
+    response.status_code = 429
+    response.headers.update(headers)
+    return response
+
+
+def test_retry_delay_honours_and_caps_retry_after(load_main):
+    main = load_main(HTTP_BACKOFF_FACTOR="0.5", HTTP_RETRY_AFTER_MAX="5")
+    assert main.retry_delay(0, response_with({"Retry-After": "2"})) == 2
+    assert main.retry_delay(0, response_with({"Retry-After": "120"})) == 5
+    assert main.retry_delay(0, response_with({"Retry-After": "-3"})) == 0
+    # Retry-After absent ou sous forme de date : backoff exponentiel, lui aussi plafonné
+    assert main.retry_delay(1, response_with({"Retry-After": "Wed, 21 Oct 2026 07:28:00 GMT"})) == 1
+    assert main.retry_delay(2) == 2
+    assert main.retry_delay(10) == 5
+
+
+def test_connections_are_reused_across_requests(load_main, subscribers):
+    subscribers(2000, 0.02)
+    main = load_main()
+    assert main.check_airtable_changes().get("sent") == 40
+    stats = main.get_transport_stats()
+    requests_made = sum(stats["requests"].values())
+    connections = sum(stats["connections"].values())
+    # Une session par hôte : toutes les requêtes passent par quelques connexions keep-alive
+    assert len(main._sessions) == 1
+    assert requests_made >= 40
+    assert connections <= main.HTTP_POOL_SIZE < requests_made
+
+
+def test_sellsy_nonce_is_unique_per_attempt(load_main, subscribers, fake_server):
+    subscribers(1000, 0.05)
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior(0.0, 0.2, 0.0, seed=3)
+    main = load_main(HTTP_RETRY_AFTER_MAX="0.05", BREAKER_FAILURE_THRESHOLD="1000")
+    main.check_airtable_changes()
+    stats = fake_server.state.stats["sellsy"]
+    assert stats.get("http_503", 0) > 0
+    assert stats.get("nonce_reuse", 0) == 0
+    assert stats.get("invalid_timestamp", 0) == 0
+    assert len(fake_server.state.nonces) == stats["requests"]
+    sent = sent_client_ids(fake_server)
+    assert len(sent) == len(set(sent)) > 0
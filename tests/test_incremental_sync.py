@@ -0,0 +1,58 @@
+import time
+
+import fake_apis
+from conftest import BASE_ID, SIGNED, TABLE_NAME
+
+
+def test_incremental_cycle_reads_only_records_modified_since_watermark(load_main, subscribers, fake_server):
+    table = subscribers(1000, 0.0)
+    main = load_main()
+    assert main.check_airtable_changes()["complete"]
+    assert main.read_state_file(main.SYNC_STATE_FILE, {})["watermark"]
+
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(42), SIGNED)
+    summary = main.check_airtable_changes()
+    assert summary.get("eligible") == 1
+    assert [client_id for client_id, _ in fake_server.state.sent_emails] == ["100042"]
+
+
+def test_failed_records_are_retried_after_sellsy_recovers(load_main, subscribers, fake_server):
+    table = subscribers(1000, 0.0)
+    main = load_main(FAILURE_BACKOFF_BASE="0", HTTP_MAX_RETRIES="0", BREAKER_FAILURE_THRESHOLD="1000", SYNC_OVERLAP_SECONDS="0")
+    main.check_airtable_changes()  # Parcours complet initial : rien à envoyer
+
+    for index in range(0, 200, 10):
+        fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(index), SIGNED)
+    time.sleep(1.1)  # Le watermark est à la seconde : le cycle suivant démarre après ces modifications
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior(0.0, 1.0, 0.0)
+    summary = main.check_airtable_changes()
+    assert summary.get("eligible") == 20
+    assert summary.get("failed") == 20
+    assert fake_server.state.sent_emails == []
+
+    # Sellsy revient : le watermark a dépassé ces enregistrements, mais leurs échecs les font relire
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior()
+    summary = main.check_airtable_changes()
+    assert summary.get("sent") == 20
+    assert len(fake_server.state.sent_emails) == 20
+
+
+def test_record_leased_by_another_process_is_read_again(load_main, subscribers, fake_server):
+    table = subscribers(1000, 0.0)
+    main = load_main(LEASE_OWNER="worker-a", SYNC_OVERLAP_SECONDS="0")
+    main.check_airtable_changes()
+
+    record_id = table.record_id(7)
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, record_id, SIGNED)
+    store = main.get_state_store()
+    assert store.claim_records([record_id], "worker-b", 60) == {record_id}
+    time.sleep(1.1)
+    main.check_airtable_changes()
+    assert fake_server.state.sent_emails == []
+    assert main.read_state_file(main.SYNC_STATE_FILE, {})["recheck"] == [record_id]
+
+    # L'autre processus s'est arrêté sans traiter l'enregistrement
+    store.release_record(record_id, "worker-b")
+    main.check_airtable_changes()
+    assert [client_id for client_id, _ in fake_server.state.sent_emails] == ["100007"]
+    assert main.read_state_file(main.SYNC_STATE_FILE, {})["recheck"] == []
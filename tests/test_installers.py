@@ -0,0 +1,39 @@
+import fake_apis
+from conftest import INSTALLERS_BASE_ID, read_state
+
+INSTALLERS = f"airtable:{INSTALLERS_BASE_ID}"
+
+
+def installer_stats(server):
+    return server.state.stats.get(INSTALLERS, {})
+
+
+def test_directory_is_loaded_once_in_pages_and_persisted(load_main, subscribers, fake_server):
+    installers = fake_apis.FakeAirtableTable(250, fake_apis.default_installer_factory)
+    fake_server.state.add_table(INSTALLERS_BASE_ID, "Installateurs", installers)
+    subscribers(500, 0.04)
+    main = load_main()
+    assert main.check_airtable_changes().get("sent") == 20
+    # Une seule passe paginée pour les 20 enregistrements éligibles, aucune lecture unitaire
+    stats = installer_stats(fake_server)
+    assert stats["pages"] == stats["requests"] == 3
+    assert len(read_state(main, main.INSTALLERS_CACHE_FILE)["names"]) == 250
+
+    # Un nouveau processus reprend l'annuaire enregistré sans rappeler Airtable
+    fake_server.state.reset_stats()
+    main = load_main()
+    assert main.get_installer_name_from_airtable(installers.record_id(7)) == "Installateur 7"
+    assert installer_stats(fake_server) == {}
+
+
+def test_unknown_installer_is_fetched_once_then_cached(load_main, fake_server):
+    main = load_main()
+    table = fake_server.state.tables[(INSTALLERS_BASE_ID, "Installateurs")]
+    main.get_installer_directory()
+    del main._installer_directory["names"][table.record_id(3)]
+
+    fake_server.state.reset_stats()
+    for _ in range(3):
+        assert main.get_installer_name_from_airtable(table.record_id(3)) == "Installateur 3"
+    assert installer_stats(fake_server).get("requests") == 1
+    assert table.record_id(3) in read_state(main, main.INSTALLERS_CACHE_FILE)["names"]
@@ -0,0 +1,50 @@
+import glob
+import json
+import os
+
+import pytest
+
+
+def read_log(main):
+    main._log_writer.flush()
+    (path,) = glob.glob(os.path.join(main.LOG_DIR, "log_*.txt"))
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("asynchronous", ["false", "true"])
+def test_entries_are_json_lines_filtered_by_level(load_main, asynchronous):
+    main = load_main(LOG_LEVEL="WARNING", LOG_ASYNC=asynchronous)
+    main.log_activity("ignoré")
+    main.log_activity("⚠️ Quota proche", level="WARNING", backend="sellsy")
+    main.log_activity("❌ Échec", level="ERROR")
+    entries = read_log(main)
+    assert [(entry["level"], entry["msg"]) for entry in entries] == [("WARNING", "⚠️ Quota proche"), ("ERROR", "❌ Échec")]
+    assert entries[0]["backend"] == "sellsy"
+    assert entries[0]["ts"]
+
+
+def test_debug_payloads_are_only_built_when_enabled(load_main):
+    calls = []
+
+    def payload():
+        calls.append(1)
+        return "réponse complète"
+
+    main = load_main(LOG_LEVEL="INFO")
+    main.log_activity(payload, level="DEBUG")
+    assert calls == []
+
+    main = load_main(LOG_LEVEL="DEBUG")
+    main.log_activity(payload, level="DEBUG")
+    assert calls == [1]
+    assert read_log(main)[-1]["msg"] == "réponse complète"
+
+
+def test_cycle_logs_a_single_rollup_instead_of_one_line_per_record(load_main, subscribers):
+    subscribers(500, 0.04)
+    main = load_main(LOG_LEVEL="INFO")
+    assert main.check_airtable_changes().get("sent") == 20
+    rollups = [entry for entry in read_log(main) if "counters" in entry]
+    assert len(rollups) == 1
+    assert rollups[0]["counters"]["emails envoyés"] == 20
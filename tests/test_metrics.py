@@ -0,0 +1,40 @@
+import glob
+import json
+import os
+
+
+def test_label_values_are_escaped(load_main):
+    main = load_main()
+    assert main._escape_label('a\\b"c\nd') == 'a\\\\b\\"c\\nd'
+    metrics = main.Metrics()
+    metrics.inc("mandat_test_total", endpoint='Client"getOne\n')
+    assert 'mandat_test_total{endpoint="Client\\"getOne\\n"} 1' in metrics.render().splitlines()
+
+
+def test_histogram_renders_cumulative_buckets(load_main):
+    main = load_main()
+    metrics = main.Metrics()
+    for value in (0.003, 0.2, 120):
+        metrics.observe("mandat_test_seconds", value, phase="send")
+    lines = metrics.render().splitlines()
+    assert lines[0] == "# TYPE mandat_test_seconds histogram"
+    assert 'mandat_test_seconds_bucket{phase="send",le="0.005"} 1' in lines
+    assert 'mandat_test_seconds_bucket{phase="send",le="0.25"} 2' in lines
+    assert 'mandat_test_seconds_bucket{phase="send",le="+Inf"} 3' in lines
+    assert 'mandat_test_seconds_count{phase="send"} 3' in lines
+
+
+def test_record_traces_are_capped_but_cycle_trace_is_kept(load_main, subscribers):
+    subscribers(500, 0.04)
+    main = load_main(TRACE_MAX_RECORDS="5")
+    assert main.check_airtable_changes().get("sent") == 20
+
+    with open(os.path.join(main.LOG_DIR, "metrics.prom"), encoding="utf-8") as f:
+        assert 'mandat_records_total{outcome="sent"} 20' in f.read().splitlines()
+    (traces_path,) = glob.glob(os.path.join(main.LOG_DIR, "traces_*.jsonl"))
+    with open(traces_path, encoding="utf-8") as f:
+        export = json.loads(f.readline())
+    names = [trace["name"] for trace in export["traces"]]
+    assert names.count("record") == 5
+    assert "cycle" in names
+    assert export["dropped_record_traces"] == 15
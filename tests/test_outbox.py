@@ -0,0 +1,55 @@
+import json
+
+from conftest import sent_client_ids
+
+
+def test_read_timeout_on_send_never_resends(load_main, subscribers, fake_server):
+    table = subscribers(500, 0.02)
+    fake_server.state.response_delays["Mails.sendOne"] = 0.5
+    main = load_main(HTTP_READ_TIMEOUT="0.2", BREAKER_FAILURE_THRESHOLD="100", INCREMENTAL_SYNC="false", FAILURE_BACKOFF_BASE="0")
+    for _ in range(3):
+        main.check_airtable_changes()
+    sent = sent_client_ids(fake_server)
+    assert len(sent) == 10
+    assert len(set(sent)) == 10
+    assert fake_server.state.stats["sellsy"]["Mails.sendOne"] == 10
+
+    # Les envois au résultat inconnu restent "sending" jusqu'à leur résolution manuelle
+    store = main.get_state_store()
+    unknown = store.interrupted_sends()
+    assert len(unknown) == 10
+    main.resolve_unknown_sends("sent", unknown)
+    assert store.interrupted_sends() == []
+    assert all(table.get(table.index_of(record_id))["fields"]["Email Mandat sellsy"] for record_id in unknown)
+
+    fake_server.state.response_delays.clear()
+    main.check_airtable_changes()
+    assert len(fake_server.state.sent_emails) == 10
+
+
+def test_unknown_sends_are_listed_in_stuck_records_report(load_main, subscribers, fake_server):
+    subscribers(500, 0.02)
+    fake_server.state.response_delays["Mails.sendOne"] = 0.5
+    main = load_main(HTTP_READ_TIMEOUT="0.2", BREAKER_FAILURE_THRESHOLD="100")
+    main.UNKNOWN_SEND_GRACE = 0
+    summary = main.check_airtable_changes()
+    assert summary["stuck_records"] == {"unknown_send": 10}
+    with open(f"{main.LOG_DIR}/{main.STUCK_RECORDS_REPORT}", encoding="utf-8") as f:
+        report = json.load(f)
+    assert sorted(send["client_id"] for send in report["unknown_sends"]) == sorted(sent_client_ids(fake_server))
+
+
+def test_unconfirmed_writeback_is_replayed_without_resending(load_main, subscribers, fake_server):
+    table = subscribers(100, 0.1)
+    main = load_main()
+    # Arrêt brutal entre l'envoi et la mise à jour Airtable
+    record_id = table.record_id(10)
+    store = main.get_state_store()
+    assert store.begin_send(record_id, "100010")
+    store.mark_sent(record_id, main.email_sent_fields())
+
+    summary = main.check_airtable_changes()
+    assert "100010" not in sent_client_ids(fake_server)
+    assert summary.get("sent") == 9
+    assert table.get(10)["fields"]["Email Mandat sellsy"] is True
+    assert store.pending_writebacks() == {}
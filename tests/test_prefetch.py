@@ -0,0 +1,57 @@
+import threading
+import time
+
+import fake_apis
+import pytest
+
+
+def test_prefetch_reads_ahead_up_to_its_depth(load_main):
+    main = load_main()
+    produced = []
+
+    def pages():
+        for index in range(10):
+            produced.append(index)
+            yield index
+
+    items = main.prefetch(pages(), 2, "test")
+    assert next(items) == 0
+    time.sleep(0.2)
+    # Un élément consommé, deux en file, un bloqué dans put
+    assert len(produced) == 4
+    assert list(items) == list(range(1, 10))
+
+
+def test_prefetch_raises_producer_errors_after_earlier_items(load_main):
+    main = load_main()
+
+    def pages():
+        yield 1
+        yield 2
+        raise RuntimeError("page 3")
+
+    items = main.prefetch(pages(), 2, "test")
+    assert next(items) == 1
+    assert next(items) == 2
+    with pytest.raises(RuntimeError):
+        next(items)
+
+
+def test_closing_stops_the_producer(load_main):
+    main = load_main()
+    items = main.prefetch(iter(range(1000)), 1, "test")
+    assert next(items) == 0
+    items.close()
+    assert not [thread for thread in threading.enumerate() if thread.name == "test-prefetch"]
+
+
+def test_pages_read_before_a_pagination_failure_are_processed(load_main, subscribers, fake_server):
+    subscribers(40, 0.5)
+    main = load_main(AIRTABLE_PAGE_SIZE="10")
+    # Chaque offset expire avant que la requête suivante soit servie : seule la première page est lue
+    fake_server.state.offset_ttl = 0.05
+    fake_server.state.behaviors["airtable"] = fake_apis.FakeBackendBehavior(latency=0.1)
+    summary = main.check_airtable_changes()
+    assert not summary["complete"]
+    assert summary.get("sent") == 10
+    assert "watermark" not in main.read_state_file(main.SYNC_STATE_FILE, {})
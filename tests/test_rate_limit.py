@@ -0,0 +1,40 @@
+import threading
+import time
+
+import fake_apis
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(load_main):
+    main = load_main()
+    bucket = main.TokenBucket(20, capacity=5)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.05
+    for _ in range(10):
+        bucket.acquire()
+    assert 0.4 <= time.monotonic() - started < 0.8
+
+
+def test_token_bucket_is_shared_by_threads(load_main):
+    main = load_main()
+    bucket = main.TokenBucket(50, capacity=1)
+    started = time.monotonic()
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 20 jetons à 50/s, rafale d'un seul : au moins 19 intervalles de 20 ms, quel que soit le nombre de threads
+    assert time.monotonic() - started >= 0.36
+
+
+def test_records_are_processed_concurrently(load_main, subscribers, fake_server):
+    subscribers(500, 0.04)
+    main = load_main(MAX_WORKERS="8")
+    main.warm_sellsy_client_directory()
+    fake_server.state.behaviors["sellsy"] = fake_apis.FakeBackendBehavior(latency=0.1)
+    started = time.monotonic()
+    assert main.check_airtable_changes().get("sent") == 20
+    # 20 envois de 100 ms chacun prendraient au moins 2 s l'un après l'autre
+    assert time.monotonic() - started < 1.2
@@ -0,0 +1,48 @@
+import time
+
+from conftest import read_state
+
+IDLE = {"complete": True, "pending_writebacks": 0}
+
+
+def make_scheduler(main, initial=60):
+    return main.AdaptivePollScheduler(initial, min_interval=30, max_interval=600, factor=2, jitter=0)
+
+
+def test_idle_cycles_back_off_up_to_the_cap(load_main):
+    main = load_main()
+    scheduler = make_scheduler(main)
+    delays = [scheduler.record_cycle(IDLE) for _ in range(6)]
+    assert delays == [120, 240, 480, 600, 600, 600]
+
+
+def test_pending_work_returns_to_the_minimum_interval(load_main):
+    main = load_main()
+    scheduler = make_scheduler(main, initial=480)
+    assert scheduler.record_cycle({**IDLE, "eligible": 3}) == 30
+    scheduler.interval = 480
+    assert scheduler.record_cycle({**IDLE, "pending_writebacks": 2}) == 30
+    scheduler.interval = 480
+    assert scheduler.record_cycle({"complete": False}) == 30
+
+
+def test_cancelled_cycle_keeps_the_interval(load_main):
+    main = load_main()
+    scheduler = make_scheduler(main, initial=240)
+    assert scheduler.record_cycle({"cancelled": True}) == 240
+    assert scheduler.interval == 240
+
+
+def test_schedule_is_persisted_for_cron_runs(load_main):
+    main = load_main()
+    scheduler = make_scheduler(main)
+    assert scheduler.is_due()
+    scheduler.record_cycle(IDLE)
+    assert read_state(main, main.SCHEDULE_STATE_FILE)["interval"] == 120
+
+    # Une exécution suivante relit le planning : elle est sautée tant que le cycle n'est pas dû
+    restarted = make_scheduler(main)
+    assert restarted.interval == 120
+    assert not restarted.is_due()
+    restarted.next_poll_at = time.time() + 30
+    assert restarted.is_due()
@@ -0,0 +1,64 @@
+import time
+
+from conftest import BASE_ID, SIGNED, TABLE_NAME
+
+
+# Vieillit l'annuaire comme s'il avait été chargé `seconds` plus tôt
+def age_directory(main, seconds):
+    store = main.get_state_store()
+    store._execute("UPDATE sellsy_clients SET seen_at = seen_at - ?", (seconds,))
+    directory = main.read_state_file(main.SELLSY_DIRECTORY_STATE_FILE, {})
+    directory.update(loaded_at=directory["loaded_at"] - seconds, refreshed_at=directory["refreshed_at"] - seconds)
+    main.write_state_file(main.SELLSY_DIRECTORY_STATE_FILE, directory)
+
+
+def sellsy_calls(server, method):
+    return server.state.stats.get("sellsy", {}).get(method, 0)
+
+
+def test_client_key_accepts_string_and_int_forms(load_main):
+    main = load_main()
+    assert main.sellsy_client_key("0123") == main.sellsy_client_key(" 123") == main.sellsy_client_key(123) == "123"
+
+
+def test_directory_hit_needs_no_get_one(load_main, subscribers, fake_server):
+    table = subscribers(2000, 0.005)
+    main = load_main(SELLSY_LIST_PAGE_SIZE="500")
+    summary = main.check_airtable_changes()
+    assert summary.get("sent") == 10
+    assert sellsy_calls(fake_server, "Client.getList") == 4
+    assert sellsy_calls(fake_server, "Client.getOne") == 0
+
+    # Des entrées chargées il y a deux heures servent encore, sans appel par enregistrement
+    age_directory(main, 7200)
+    for index in (1, 2, 3):
+        fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(index), SIGNED)
+    assert main.check_airtable_changes().get("sent") == 3
+    assert sellsy_calls(fake_server, "Client.getOne") == 0
+
+
+def test_max_age_reloads_directory_instead_of_get_one(load_main, subscribers, fake_server):
+    table = subscribers(2000, 0.0)
+    main = load_main(SELLSY_LIST_PAGE_SIZE="500", SELLSY_CLIENT_MAX_AGE="900")
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(1), SIGNED)
+    main.check_airtable_changes()
+    assert sellsy_calls(fake_server, "Client.getList") == 4
+
+    age_directory(main, 1800)
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(2), SIGNED)
+    assert main.check_airtable_changes().get("sent") == 1
+    assert sellsy_calls(fake_server, "Client.getList") == 8
+    assert sellsy_calls(fake_server, "Client.getOne") == 0
+    _, seen_at = main.lookup_sellsy_client("100002")
+    assert time.time() - seen_at < 60
+
+
+def test_missing_client_falls_back_to_get_one(load_main, subscribers, fake_server):
+    table = subscribers(100, 0.0)
+    main = load_main()
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(1), SIGNED)
+    main.warm_sellsy_client_directory()
+    main.get_state_store()._execute("DELETE FROM sellsy_clients WHERE client_key = '100001'")
+    assert main.check_airtable_changes().get("sent") == 1
+    assert sellsy_calls(fake_server, "Client.getOne") == 1
+    assert main.lookup_sellsy_client("100001")[0]["email"] == "client1@example.com"
@@ -0,0 +1,56 @@
+import time
+
+from conftest import sent_client_ids
+
+
+def test_shards_split_the_records_without_overlap(load_main, subscribers, fake_server):
+    table = subscribers(900, 0.1)
+    eligible = {str(100000 + index) for index in range(0, table.size, 10)}
+    per_shard = []
+    for index in range(3):
+        before = len(fake_server.state.sent_emails)
+        main = load_main(SHARD_COUNT="3", SHARD_INDEX=str(index))
+        assert main.check_airtable_changes()["complete"]
+        per_shard.append(sent_client_ids(fake_server)[before:])
+        assert main.read_state_file(main.SYNC_STATE_FILE, {})["watermark"]
+        assert main.SYNC_STATE_FILE == f"sync_state.shard{index}-3.json"
+
+    assert all(15 <= len(sent) <= 45 for sent in per_shard)
+    sent = sent_client_ids(fake_server)
+    assert len(sent) == len(set(sent))
+    assert set(sent) == eligible
+
+
+def test_record_shard_is_stable_across_processes(load_main):
+    record_ids = [f"rec{index:014d}" for index in range(100)]
+    first = [load_main(SHARD_COUNT="4").record_shard(record_id) for record_id in record_ids]
+    second = [load_main(SHARD_COUNT="4").record_shard(record_id) for record_id in record_ids]
+    assert first == second
+    assert set(first) == {0, 1, 2, 3}
+
+
+def test_leases_are_exclusive_until_they_expire(load_main):
+    main = load_main()
+    store = main.get_state_store()
+    assert store.claim_records(["recA", "recB"], "worker-a", 60) == {"recA", "recB"}
+    assert store.claim_records(["recA", "recC"], "worker-b", 60) == {"recC"}
+    # Le propriétaire peut prolonger son bail
+    assert store.claim_records(["recA"], "worker-a", 60) == {"recA"}
+
+    store.release_record("recA", "worker-b")  # Sans effet : worker-b ne détient pas ce bail
+    assert store.claim_records(["recA"], "worker-b", 60) == set()
+    store.release_record("recA", "worker-a")
+    assert store.claim_records(["recA"], "worker-b", 60) == {"recA"}
+
+    assert store.claim_records(["recD"], "worker-a", 0) == {"recD"}
+    time.sleep(0.01)
+    assert store.claim_records(["recD"], "worker-b", 60) == {"recD"}
+
+
+def test_sellsy_oauth_timestamp_is_unix_seconds(load_main):
+    main = load_main()
+    params = [main.build_sellsy_oauth_params({"method": "Infos.getInfos"}) for _ in range(1000)]
+    assert len({param["oauth_nonce"] for param in params}) == 1000
+    for param in params:
+        assert param["oauth_timestamp"].isdigit()
+        assert abs(int(param["oauth_timestamp"]) - time.time()) <= 2
@@ -0,0 +1,92 @@
+import base64
+import hashlib
+import hmac
+
+import fake_apis
+from conftest import BASE_ID, SIGNED, TABLE_NAME, read_state, sent_client_ids
+
+
+def test_record_ids_formulas_cover_every_chunk(load_main, subscribers):
+    table = subscribers(300, 0.1)
+    main = load_main()
+    targets = [table.record_id(index) for index in range(0, 240, 2)]
+    formulas = main.build_record_ids_formulas(targets)
+    assert len(formulas) == 3
+    found = []
+    for formula in formulas:
+        pagination = {"pages": 0, "complete": True}
+        found += [record["id"] for _, records, _ in main.iter_airtable_pages(formula, pagination) for record in records]
+        assert pagination["complete"]
+    assert found == [table.record_id(index) for index in range(0, 240, 10)]
+
+
+def test_webhook_mac_requires_secret(load_main):
+    main = load_main()
+    secret = base64.b64encode(b"s" * 32).decode("ascii")
+    body = b'{"base": {"id": "appTEST"}}'
+    header = "hmac-sha256=" + hmac.new(b"s" * 32, body, hashlib.sha256).hexdigest()
+    assert main.verify_webhook_mac(body, header, secret)
+    assert not main.verify_webhook_mac(body + b" ", header, secret)
+    assert not main.verify_webhook_mac(body, header, None)
+
+
+def test_webhook_changes_keep_only_subscriber_table(load_main, subscribers, fake_server):
+    table = subscribers(100, 0.0)
+    fake_server.state.add_table(BASE_ID, "Autre", fake_apis.FakeAirtableTable(10, fake_apis.default_installer_factory))
+    main = load_main()
+    webhook_id, webhook = fake_server.state.add_webhook(BASE_ID, None)  # Sans recordChangeScope : toutes les tables
+    state = {"id": webhook_id, "mac_secret": webhook["mac_secret"], "cursor": 1, "table_id": fake_apis.table_id(TABLE_NAME)}
+    fake_server.state.update_record(BASE_ID, "Autre", "rec00000000000001", {"Nom": "x"})
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(5), {"Nom": "y"}, source="publicApi")
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(7), {"Nom": "z"})
+    assert main.fetch_webhook_changes(state) == ([table.record_id(5), table.record_id(7)], 4, True)
+
+
+def test_contract_signed_through_the_api_triggers_a_cycle(load_main, subscribers, fake_server):
+    table = subscribers(100, 0.0)
+    main = load_main(WEBHOOK_NOTIFICATION_URL="http://127.0.0.1:9/")
+    main.register_airtable_webhook()
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(3), SIGNED, source="publicApi")
+    assert main.process_webhook_notifications()["complete"]
+    assert sent_client_ids(fake_server) == ["100003"]
+
+
+def test_webhook_cursor_advances_only_after_processing(load_main, subscribers, fake_server, monkeypatch):
+    table = subscribers(300, 0.0)
+    main = load_main(WEBHOOK_NOTIFICATION_URL="http://127.0.0.1:9/")
+    assert main.register_airtable_webhook()["table_id"] == fake_apis.table_id(TABLE_NAME)
+
+    # 60 signatures : plus d'une page de payloads
+    for index in range(60):
+        fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(index), SIGNED)
+    summary = main.process_webhook_notifications()
+    assert summary["complete"]
+    assert len(set(sent_client_ids(fake_server))) == len(fake_server.state.sent_emails) == 60
+    assert read_state(main, main.WEBHOOK_STATE_FILE)["cursor"] == 61
+
+    # Nos propres mises à jour Airtable sont relues sans rien renvoyer
+    summary = main.process_webhook_notifications()
+    assert summary["complete"] and not summary.get("eligible")
+    assert read_state(main, main.WEBHOOK_STATE_FILE)["cursor"] == 121
+    assert len(fake_server.state.sent_emails) == 60
+
+    # Un cycle incomplet laisse le curseur en place : les payloads sont relus à la notification suivante
+    fake_server.state.update_record(BASE_ID, TABLE_NAME, table.record_id(100), SIGNED)
+    with monkeypatch.context() as patch:
+        patch.setattr(main, "run_cycle", lambda **kwargs: {"complete": False})
+        main.process_webhook_notifications()
+    assert read_state(main, main.WEBHOOK_STATE_FILE)["cursor"] == 121
+    main.process_webhook_notifications()
+    assert read_state(main, main.WEBHOOK_STATE_FILE)["cursor"] == 122
+    assert len(fake_server.state.sent_emails) == 61
+
+
+def test_unscoped_webhook_is_replaced(load_main, subscribers, fake_server):
+    subscribers(10, 0.0)
+    main = load_main(WEBHOOK_NOTIFICATION_URL="http://127.0.0.1:9/")
+    old_id, webhook = fake_server.state.add_webhook(BASE_ID, None)
+    main.write_state_file(main.WEBHOOK_STATE_FILE, {"id": old_id, "mac_secret": webhook["mac_secret"], "cursor": 5})
+    state = main.register_airtable_webhook()
+    assert state["id"] != old_id and state["cursor"] == 1
+    assert list(fake_server.state.webhooks) == [state["id"]]
+    assert fake_server.state.webhooks[state["id"]]["record_change_scope"] == fake_apis.table_id(TABLE_NAME)
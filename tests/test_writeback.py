@@ -0,0 +1,35 @@
+from conftest import BASE_ID
+
+AIRTABLE = f"airtable:{BASE_ID}"
+
+
+def test_sent_emails_are_marked_in_batches_of_ten(load_main, subscribers, fake_server):
+    table = subscribers(1000, 0.025)
+    main = load_main()
+    assert main.check_airtable_changes().get("sent") == 25
+    assert fake_server.state.stats[AIRTABLE]["patches"] == 3
+    for index in range(0, 1000, 40):
+        assert table.get(index)["fields"]["Email Mandat sellsy"] is True
+    assert main.get_state_store().pending_writebacks() == {}
+
+
+def test_invalid_record_does_not_block_the_rest_of_its_batch(load_main, subscribers, fake_server):
+    table = subscribers(100, 0.0)
+    main = load_main(AIRTABLE_FLUSH_INTERVAL="3600")
+    store = main.get_state_store()
+    # Le dernier ID n'existe pas dans la table : Airtable rejette tout le lot
+    record_ids = [table.record_id(index) for index in range(9)] + [table.record_id(table.size + 1)]
+    for record_id in record_ids:
+        assert store.begin_send(record_id, "100000")
+        main.mark_email_sent_in_airtable(record_id)
+
+    # Le dixième ajout complète le lot et déclenche son écriture
+    for index in range(9):
+        assert table.get(index)["fields"]["Email Mandat sellsy"] is True
+    assert fake_server.state.stats[AIRTABLE]["patches"] == 11
+
+    # Seul l'enregistrement invalide reste à écrire, au prochain flush ou au prochain cycle
+    assert main.airtable_write_buffer.pending_count() == 1
+    assert list(store.pending_writebacks()) == [record_ids[-1]]
+    assert not main.airtable_write_buffer.flush()
+    assert main.airtable_write_buffer.pending_count() == 1